@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .metrics import admission_rejected, llm_queue_wait, llm_queued
+
+# ================== کنترل پذیرش درخواست‌ها ==================
+# حداکثر max_concurrent فراخوانی هم‌زمان LLM در هر پروسه؛ بقیه در صف می‌مانند.
+# صف برای هر کلاینت (session) جدا است و نوبت به‌صورت چرخشی بین کلاینت‌ها می‌چرخد
+# تا یک کاربر پرحرف بقیه را پشت سر خودش نگه ندارد. صف پر، صف پر آن کلاینت یا
+# ماندن بیش از queue_timeout در صف یعنی پاسخ فوری «شلوغ است» (Overloaded)، تا
+# زمان پاسخ درخواست‌های پذیرفته‌شده محدود بماند.
+# قفل threading است و بیدار کردن با call_soon_threadsafe، چون زیر WSGI هر
+# درخواست async ممکن است event loop خودش را داشته باشد.
+
+
+class Overloaded(Exception):
+    status = 503
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimited(Overloaded):
+    status = 429
+
+
+def _grant(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = 20, max_queue: int = 100, max_queue_per_client: int = 2,
+                 queue_timeout: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.queue_timeout = queue_timeout  # ثانیه
+        self.active = 0
+        self.queued = 0
+        # کلاینت -> صف futureها؛ ترتیب dict همان ترتیب نوبت است
+        self._waiting = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _reject(self, reason: str):
+        admission_rejected.inc(reason=reason)
+        raise Overloaded(reason)
+
+    def _client_full(self, client: str) -> bool:
+        return len(self._waiting.get(client, ())) >= self.max_queue_per_client
+
+    def check(self, client: str):
+        # سهم صف همین کلاینت، بدون گرفتن جا؛ برای درخواستی که به فراخوانی مشترک
+        # درخواست دیگری می‌پیوندد یا آن را می‌سازد
+        with self._lock:
+            full = self._client_full(client)
+        if full:
+            self._reject("client_queue_full")
+
+    async def acquire(self, client: str, check_client: bool = True):
+        with self._lock:
+            if self.active < self.max_concurrent and not self.queued:
+                self.active += 1
+                return
+            if self.queued >= self.max_queue:
+                reason = "queue_full"
+            elif check_client and self._client_full(client):
+                reason = "client_queue_full"
+            else:
+                reason = None
+                future = asyncio.get_running_loop().create_future()
+                self._waiting.setdefault(client, deque()).append(future)
+                self.queued += 1
+                llm_queued.set(self.queued)
+        if reason:
+            self._reject(reason)
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                granted = not self._remove(client, future)
+            if not granted:
+                if isinstance(e, TimeoutError):
+                    self._reject("queue_timeout")
+                raise
+            # نوبت همان لحظه رسیده بود؛ اگر کلاینت رفته، جا را به بعدی بده
+            if isinstance(e, asyncio.CancelledError):
+                self.release()
+                raise
+        llm_queue_wait.observe(time.perf_counter() - start)
+
+    def _remove(self, client: str, future) -> bool:
+        queue = self._waiting.get(client)
+        if queue is None or future not in queue:
+            return False
+        queue.remove(future)
+        if not queue:
+            del self._waiting[client]
+        self.queued -= 1
+        llm_queued.set(self.queued)
+        return True
+
+    def release(self):
+        with self._lock:
+            if not self._waiting:
+                self.active -= 1
+                return
+            client, queue = next(iter(self._waiting.items()))
+            future = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            self.queued -= 1
+            llm_queued.set(self.queued)
+        # جا مستقیم به نفر بعدی می‌رسد؛ active عوض نمی‌شود
+        future.get_loop().call_soon_threadsafe(_grant, future)
+
+
+class TokenBuckets:
+    # سهمیه توکن هر کلاینت: per_minute توکن در دقیقه پر می‌شود تا سقف burst. قبل
+    # از فراخوانی LLM توکن‌های پرامپت برداشته می‌شوند و بعد از پاسخ توکن‌های
+    # پاسخ (که می‌تواند سطل را منفی کند تا درخواست بعدی صبر کند).
+    def __init__(self, per_minute: int, burst: int = 0, max_clients: int = 10000):
+        self.rate = per_minute / 60
+        self.burst = burst or per_minute
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _level(self, client: str, now: float) -> float:
+        level, updated = self._buckets.pop(client, (self.burst, now))
+        return min(self.burst, level + (now - updated) * self.rate)
+
+    def _store(self, client: str, level: float, now: float):
+        self._buckets[client] = (level, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+
+    def take(self, client: str, tokens: int):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        with self._lock:
+            level = self._level(client, now)
+            # پرامپت بزرگ‌تر از ظرفیت سطل هم با سطل پر پذیرفته می‌شود
+            needed = min(tokens, self.burst)
+            if level < needed:
+                self._store(client, level, now)
+                admission_rejected.inc(reason="rate_limited")
+                raise RateLimited("rate_limited", (needed - level) / self.rate)
+            self._store(client, level - tokens, now)
+
+    def charge(self, client: str, tokens: int):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._store(client, self._level(client, now) - tokens, now)
@@ -0,0 +1,131 @@
+import hashlib
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from itertools import islice
+
+from django.core.cache import caches
+
+from .retrieval import char_ngrams
+from .text import normalize_text
+
+# ================== کش پاسخ‌ها ==================
+# سوال‌های پرتکرار (پرداخت، ارسال، پیگیری سفارش) با متن یکسان‌شده و نسخه
+# کاتالوگ کلید می‌خورند؛ backend همان کش جنگو است (locmem/file/redis) و TTL و
+# حذف LRU را خودش انجام می‌دهد. لایه اختیاری دوم، سوال‌های «تقریباً یکسان» (فقط
+# از نظر املا، نه معنا) را با شباهت کسینوسی بردار شمارش trigram حرفی پیدا می‌کند.
+# بردارها بر اساس نسخه کاتالوگ و عددهای سوال دسته‌بندی می‌شوند و فقط
+# max_candidates بردار آخر همان دسته مقایسه می‌شوند تا کار هر درخواست روی event
+# loop محدود بماند.
+_NUMBER_RE = re.compile(r"\d+")
+STATS = ("exact_hits", "similar_hits", "misses", "stores")
+MAX_CANDIDATES = 200
+
+
+def trigram_vector(text: str):
+    counts = Counter(char_ngrams(text))
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {gram: v / norm for gram, v in counts.items()}
+
+
+def cosine(a, b) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(gram, 0.0) for gram, v in a.items())
+
+
+class ResponseCache:
+    def __init__(self, alias: str = "chat_responses", similarity: float = 0.0, max_vectors: int = 1000,
+                 max_candidates: int = MAX_CANDIDATES):
+        self.alias = alias
+        self.similarity = similarity
+        self.max_vectors = max_vectors
+        self.max_candidates = max_candidates
+        # بردارها محلی (هر پروسه) نگه داشته می‌شوند؛ خود پاسخ‌ها در backend مشترک‌اند.
+        # _vectors: کلید -> دسته، به ترتیب LRU؛ _buckets: دسته -> {کلید: بردار}
+        self._vectors = OrderedDict()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def key(self, question: str, version) -> str:
+        digest = hashlib.sha1(normalize_text(question).encode()).hexdigest()
+        return f"chat:{version}:{digest}"
+
+    def _bucket(self, question: str, version):
+        # «زیر ۱۰ میلیون» و «زیر ۲۰ میلیون» شبیه‌اند ولی پاسخ یکسان ندارند
+        return version, tuple(_NUMBER_RE.findall(normalize_text(question)))
+
+    def _trigram_match(self, question: str, version):
+        vector = trigram_vector(question)
+        best_key, best_score = None, self.similarity
+        with self._lock:
+            bucket = self._buckets.get(self._bucket(question, version), {})
+            # تازه‌ترین‌ها اول
+            candidates = list(islice(reversed(bucket.items()), self.max_candidates))
+        for key, cand_vector in candidates:
+            score = cosine(vector, cand_vector)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    async def aget(self, question: str, version):
+        backend = self.backend
+        value = await backend.aget(self.key(question, version))
+        if value is not None:
+            await self._incr("exact_hits")
+            return value
+
+        if self.similarity > 0:
+            key = self._trigram_match(question, version)
+            if key is not None:
+                value = await backend.aget(key)
+                if value is not None:
+                    await self._incr("similar_hits")
+                    return value
+
+        await self._incr("misses")
+        return None
+
+    async def aset(self, question: str, version, value):
+        key = self.key(question, version)
+        await self.backend.aset(key, value)
+        await self._incr("stores")
+        if self.similarity > 0:
+            bucket, vector = self._bucket(question, version), trigram_vector(question)
+            with self._lock:
+                self._forget(key)
+                self._vectors[key] = bucket
+                self._buckets.setdefault(bucket, {})[key] = vector
+                while len(self._vectors) > self.max_vectors:
+                    self._forget(next(iter(self._vectors)))
+
+    def _forget(self, key: str):
+        bucket = self._vectors.pop(key, None)
+        if bucket is None:
+            return
+        vectors = self._buckets[bucket]
+        del vectors[key]
+        if not vectors:
+            del self._buckets[bucket]
+
+    async def _incr(self, name: str):
+        # شمارنده‌ها در خود backend هستند تا با redis بین workerها جمع شوند
+        key = f"chat:stats:{name}"
+        backend = self.backend
+        if not await backend.aadd(key, 1, timeout=None):
+            try:
+                await backend.aincr(key)
+            except ValueError:
+                await backend.aset(key, 1, timeout=None)
+
+    async def astats(self):
+        values = await self.backend.aget_many([f"chat:stats:{name}" for name in STATS])
+        stats = {name: values.get(f"chat:stats:{name}", 0) for name in STATS}
+        lookups = stats["exact_hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["exact_hits"] + stats["similar_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
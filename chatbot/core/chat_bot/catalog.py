@@ -0,0 +1,500 @@
+import fcntl
+import json
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import quote
+
+from .prompts import PRODUCT_REF_RE, SystemPrompt, compact_line, get_encoding, product_ref
+from .retrieval import BM25_B, BM25_K1, bm25_idf, char_ngrams, product_document
+from .text import normalize_product, normalize_text, parse_price_range
+
+# ================== snapshot مشترک کاتالوگ ==================
+# all_products.jsonl یک بار به یک فایل SQLite فقط‌خواندنی تبدیل می‌شود (محصولات،
+# سطر آماده پرامپت با تعداد توکنش و ایندکس BM25). همه workerها همان فایل را با
+# mmap می‌خوانند، پس صفحه‌هایش در page cache سیستم‌عامل مشترک است و حافظه با
+# تعداد workerها چند برابر نمی‌شود.
+# قیمت عددی و دسته‌ها هم ایندکس شده‌اند: products_price (مرتب بر اساس قیمت) و
+# product_categories (دسته -> محصولات، مرتب بر اساس قیمت) تا فیلتر و مرتب‌سازی
+# فقط یک پیمایش بازه‌ای روی ایندکس باشد.
+SNAPSHOT_FORMAT = "4"
+# SQLite قدیمی حداکثر ۹۹۹ پارامتر می‌پذیرد؛ هر gram دو پارامتر می‌گیرد.
+MAX_QUERY_GRAMS = 400
+# جستجوی متنی با مرتب‌سازی قیمت: نتیجه‌هایی که حداقل MIN_GRAM_SHARE از trigramهای
+# سوال را دارند و امتیازشان حداقل RELEVANCE_CUTOFF برابر بهترین نتیجه است (حداکثر
+# MAX_SEARCH_RESULTS تا)، به ترتیب قیمت. بدون حداقل trigram مشترک، «هارد» با
+# «هارمان کاردن» (سه trigram از چهار) جور می‌شد و بلندگو ارزان‌ترین «هارد» بود.
+MAX_SEARCH_RESULTS = 200
+RELEVANCE_CUTOFF = 0.5
+MIN_GRAM_SHARE = 0.8
+SORTS = ("relevance", "price", "-price")
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY,
+    ref TEXT NOT NULL,
+    category TEXT,
+    title TEXT NOT NULL,
+    link TEXT NOT NULL,
+    price TEXT NOT NULL,
+    price_value INTEGER,
+    categories TEXT NOT NULL,
+    category_ids TEXT NOT NULL,
+    line TEXT NOT NULL,
+    line_tokens INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX products_link ON products (link);
+CREATE UNIQUE INDEX products_ref ON products (ref);
+CREATE INDEX products_price ON products (price_value, id);
+CREATE TABLE categories (id TEXT PRIMARY KEY, name TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE product_categories (
+    category TEXT NOT NULL,
+    price_value INTEGER,
+    product_id INTEGER NOT NULL
+);
+CREATE INDEX product_categories_price ON product_categories (category, price_value, product_id);
+CREATE INDEX product_categories_product ON product_categories (product_id);
+CREATE TABLE grams (gram TEXT PRIMARY KEY, idf REAL NOT NULL) WITHOUT ROWID;
+CREATE TABLE postings (
+    gram TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (gram, product_id)
+) WITHOUT ROWID;
+"""
+
+_SEARCH_SQL = """
+WITH q(gram, qtf) AS (VALUES {values})
+SELECT p.product_id,
+       SUM(q.qtf * g.idf * p.tf * (? + 1) / (p.tf + ? * (1 - ? + ? * d.length / ?))) AS score
+FROM q
+JOIN grams g ON g.gram = q.gram
+JOIN postings p ON p.gram = q.gram
+JOIN products d ON d.id = p.product_id
+{where}
+GROUP BY p.product_id
+HAVING COUNT(*) >= ?
+ORDER BY score DESC
+LIMIT ?
+"""
+
+# هر محصول زیر دقیق‌ترین دسته‌اش (کم‌محصول‌ترین) در پرامپت می‌آید
+_GROUP_SQL = """
+CREATE TEMP TABLE category_sizes AS
+    SELECT category, COUNT(*) AS size FROM product_categories GROUP BY category;
+UPDATE products SET category = (
+    SELECT pc.category FROM product_categories pc
+    JOIN category_sizes s ON s.category = pc.category
+    WHERE pc.product_id = products.id
+    ORDER BY s.size, pc.category
+    LIMIT 1
+);
+DROP TABLE category_sizes;
+"""
+
+
+def source_version(path: Path):
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def delta_path(json_path: Path) -> Path:
+    # اسکرپر کنار all_products.jsonl تغییرات همان دور را هم می‌نویسد
+    return Path(json_path).with_suffix(".delta.json")
+
+
+def iter_products(path: Path):
+    # all_products.jsonl خط به خط خوانده می‌شود و هیچ‌وقت کل کاتالوگ در حافظه نیست؛
+    # خروجی JSON آرایه‌ای قدیمی (all_products.json) هم هنوز پذیرفته می‌شود.
+    path = Path(path)
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with f:
+        if path.suffix != ".jsonl":
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _insert_product(conn, doc_id: int, p, encoding):
+    # p از normalize_product آمده؛ خروجی: n-gramهای سند برای BM25
+    grams = Counter(char_ngrams(product_document(p)))
+    ref = product_ref(p, doc_id)
+    if conn.execute("SELECT 1 FROM products WHERE ref = ? AND id != ?", (ref, doc_id)).fetchone():
+        # دو لینک با یک شماره سایت
+        ref = f"n{doc_id}"
+    line = compact_line(p, ref)
+    conn.execute("INSERT OR REPLACE INTO products VALUES (?, ?, NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+        doc_id, ref, p["title"], p["link"], p["price"], p["price_value"],
+        json.dumps(p["categories"], ensure_ascii=False),
+        json.dumps(p["category_ids"], ensure_ascii=False),
+        line, len(encoding.encode(line)), sum(grams.values()),
+    ))
+    conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", ((gram, doc_id, tf) for gram, tf in grams.items()))
+    conn.executemany("INSERT OR IGNORE INTO categories VALUES (?, ?)", zip(p["category_ids"], p["categories"]))
+    conn.executemany("INSERT INTO product_categories VALUES (?, ?, ?)",
+                     ((category, p["price_value"], doc_id) for category in p["category_ids"]))
+    return grams
+
+
+def build_snapshot(products, snapshot_path: Path, version, target_web: str, model: str):
+    # products می‌تواند iterator باشد (iter_products)؛ هر محصول همان لحظه در جدول
+    # نوشته می‌شود و فقط postings برای محاسبه idf در حافظه جمع می‌شود.
+    encoding = get_encoding(model)
+
+    fd, tmp_path = tempfile.mkstemp(dir=snapshot_path.parent, prefix=snapshot_path.name, suffix=".tmp")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        with conn:
+            conn.executescript(_SCHEMA)
+            df = Counter()
+            count = total_len = 0
+            for doc_id, p in enumerate(products):
+                # رکوردهای قدیمی (بدون price_value/category_ids) همین‌جا نرمال می‌شوند
+                grams = _insert_product(conn, doc_id, normalize_product(p), encoding)
+                df.update(grams.keys())
+                count += 1
+                total_len += sum(grams.values())
+
+            conn.executemany("INSERT INTO grams VALUES (?, ?)", ((gram, bm25_idf(count, n)) for gram, n in df.items()))
+            conn.executescript(_GROUP_SQL)
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ("format", SNAPSHOT_FORMAT),
+                ("version", version or ""),
+                ("target_web", target_web),
+                ("model", model),
+                ("count", str(count)),
+                ("avg_len", repr(total_len / count if count else 0.0)),
+            ])
+        conn.close()
+        # جایگزینی اتمیک: workerهایی که فایل قبلی را باز دارند تا پایان روی همان نسخه می‌مانند.
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def apply_delta(delta, snapshot_path: Path, version, model: str):
+    # به‌جای ساخت دوباره کل snapshot فقط محصولات جدید/تغییرکرده encode و
+    # ایندکس می‌شوند؛ روی یک کپی کار می‌شود چون خواننده‌ها فایل را immutable باز کرده‌اند.
+    encoding = get_encoding(model)
+    fd, tmp_path = tempfile.mkstemp(dir=snapshot_path.parent, prefix=snapshot_path.name, suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copyfile(snapshot_path, tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        with conn:
+            ids = dict(conn.execute("SELECT link, id FROM products"))
+            next_id = max(ids.values(), default=-1) + 1
+
+            for link in delta["removed"]:
+                doc_id = ids.pop(link, None)
+                if doc_id is not None:
+                    conn.execute("DELETE FROM products WHERE id = ?", (doc_id,))
+                    conn.execute("DELETE FROM postings WHERE product_id = ?", (doc_id,))
+                    conn.execute("DELETE FROM product_categories WHERE product_id = ?", (doc_id,))
+
+            for p in [*delta["added"], *delta["changed"]]:
+                doc_id = ids.get(p["link"])
+                if doc_id is None:
+                    doc_id = ids[p["link"]] = next_id
+                    next_id += 1
+                conn.execute("DELETE FROM postings WHERE product_id = ?", (doc_id,))
+                conn.execute("DELETE FROM product_categories WHERE product_id = ?", (doc_id,))
+                _insert_product(conn, doc_id, normalize_product(p), encoding)
+            conn.execute("DELETE FROM categories WHERE id NOT IN (SELECT category FROM product_categories)")
+            # اندازه دسته‌ها عوض شده؛ دسته پرامپت همه محصولات دوباره انتخاب می‌شود
+            conn.executescript(_GROUP_SQL)
+
+            # idf همه gramها به تعداد کل محصولات وابسته است؛ از روی postings دوباره حساب می‌شود
+            count, avg_len = conn.execute("SELECT COUNT(*), COALESCE(AVG(length), 0.0) FROM products").fetchone()
+            df = list(conn.execute("SELECT gram, COUNT(*) FROM postings GROUP BY gram"))
+            conn.execute("DELETE FROM grams")
+            conn.executemany("INSERT INTO grams VALUES (?, ?)", ((gram, bm25_idf(count, n)) for gram, n in df))
+            conn.executemany("UPDATE meta SET value = ? WHERE key = ?", [
+                (version or "", "version"),
+                (str(count), "count"),
+                (repr(float(avg_len)), "avg_len"),
+            ])
+        conn.close()
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def read_meta(snapshot_path: Path):
+    try:
+        conn = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        return {}
+    try:
+        return dict(conn.execute("SELECT key, value FROM meta"))
+    except sqlite3.DatabaseError:
+        return {}
+    finally:
+        conn.close()
+
+
+# ================== خواندن کاتالوگ ==================
+class ProductFilter:
+    # category_ids: هر کدام از این دسته‌ها؛ قیمت‌ها به تومان و شامل خود مرزها
+    def __init__(self, category_ids=(), min_price=None, max_price=None):
+        self.category_ids = tuple(category_ids)
+        self.min_price = min_price
+        self.max_price = max_price
+
+    def __bool__(self):
+        return bool(self.category_ids) or self.min_price is not None or self.max_price is not None
+
+    def price_clauses(self, column: str):
+        clauses, params = [], []
+        if self.min_price is not None:
+            clauses.append(f"{column} >= ?")
+            params.append(self.min_price)
+        if self.max_price is not None:
+            clauses.append(f"{column} <= ?")
+            params.append(self.max_price)
+        return clauses, params
+
+    def category_clause(self, column: str):
+        placeholders = ", ".join("?" * len(self.category_ids))
+        return f"{column} IN ({placeholders})", list(self.category_ids)
+
+
+class Catalog:
+    def __init__(self, snapshot_path: Path, target_web: str, model: str):
+        self.snapshot_path = snapshot_path
+        self.conn = self._connect()
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        self.version = meta["version"] or None
+        self.count = int(meta["count"])
+        self.avg_len = float(meta["avg_len"])
+        self.prompt = SystemPrompt(self, target_web, model)
+        self._categories = None
+
+    def _connect(self):
+        # immutable=1: فایل هیچ‌وقت درجا تغییر نمی‌کند، پس SQLite قفل و بررسی journal نمی‌خواهد.
+        conn = sqlite3.connect(
+            f"file:{self.snapshot_path}?mode=ro&immutable=1", uri=True, check_same_thread=False,
+        )
+        conn.execute("PRAGMA mmap_size = 268435456")
+        return conn
+
+    def reopen(self):
+        # اتصال SQLite نباید از fork رد شود؛ بقیه کاتالوگ (پرامپت‌های کش‌شده) می‌ماند
+        self.conn = self._connect()
+
+    def __len__(self):
+        return self.count
+
+    def products(self, product_ids=None):
+        columns = "id, title, link, price, price_value, categories, category_ids, ref"
+        if product_ids is None:
+            rows = self.conn.execute(f"SELECT {columns} FROM products ORDER BY id")
+            return [self._product(row) for row in rows]
+        by_id = {row[0]: row for row in self._select(columns, product_ids)}
+        return [self._product(by_id[i]) for i in product_ids if i in by_id]
+
+    def categories(self):
+        # {شناسه: نام}؛ برای هر نسخه کاتالوگ یک بار خوانده می‌شود
+        if self._categories is None:
+            self._categories = dict(self.conn.execute("SELECT id, name FROM categories ORDER BY id"))
+        return self._categories
+
+    def match_filter(self, text: str) -> ProductFilter:
+        # بازه قیمت و دسته‌هایی که نامشان در پیام کاربر آمده («گوشی موبایل زیر ۲۰ میلیون»)
+        min_price, max_price = parse_price_range(text)
+        normalized = f" {normalize_text(text)} "
+        category_ids = [
+            category for category in self.categories()
+            if f" {category.replace('-', ' ')} " in normalized
+        ]
+        return ProductFilter(category_ids, min_price, max_price)
+
+    def filter_ids(self, product_filter: ProductFilter = None, descending: bool = False, limit: int = 20,
+                   offset: int = 0):
+        # محصولات فیلترشده به ترتیب قیمت، مستقیم از روی ایندکس‌های products_price و
+        # product_categories_price (بدون مرتب‌سازی جدا)
+        product_filter = product_filter or ProductFilter()
+        order = "DESC" if descending else "ASC"
+        if product_filter.category_ids:
+            clause, params = product_filter.category_clause("category")
+            price_clauses, price_params = product_filter.price_clauses("price_value")
+            where = " AND ".join([clause, *price_clauses])
+            # یک محصول در چند دسته انتخاب‌شده فقط یک بار
+            sql = (f"SELECT product_id FROM product_categories WHERE {where} GROUP BY price_value, product_id "
+                   f"ORDER BY price_value {order}, product_id {order} LIMIT ? OFFSET ?")
+            params += price_params
+        else:
+            price_clauses, params = product_filter.price_clauses("price_value")
+            where = f"WHERE {' AND '.join(price_clauses)}" if price_clauses else ""
+            sql = f"SELECT id FROM products {where} ORDER BY price_value {order}, id {order} LIMIT ? OFFSET ?"
+        return [row[0] for row in self.conn.execute(sql, [*params, limit, offset])]
+
+    def query_ids(self, query: str = "", product_filter: ProductFilter = None, sort: str = None,
+                  limit: int = 20, offset: int = 0):
+        # جستجوی API محصولات: متن (BM25) و/یا فیلتر، با مرتب‌سازی relevance/price/-price
+        if not query.strip():
+            return self.filter_ids(product_filter, sort == "-price", limit, offset)
+        if sort in ("price", "-price"):
+            # n-gram حرفی تقریباً با همه چیز کمی جور است؛ فقط نتیجه‌های واقعاً مرتبط
+            rows = self._search(query, MAX_SEARCH_RESULTS, product_filter, MIN_GRAM_SHARE)
+            best = rows[0][1] if rows else 0.0
+            ids = [product_id for product_id, score in rows if score >= best * RELEVANCE_CUTOFF]
+            prices = dict(self._select("id, price_value", ids))
+            ids.sort(key=lambda i: (prices[i] is None, prices[i] or 0, i), reverse=sort == "-price")
+            return ids[offset:offset + limit]
+        return self.search_ids(query, offset + limit, product_filter)[offset:]
+
+    def prompt_lines(self, product_ids=None):
+        # [(دسته، سطر، توکن)]
+        if product_ids is None:
+            return list(self.conn.execute("SELECT category, line, line_tokens FROM products ORDER BY category, id"))
+        by_id = {row[0]: row[1:] for row in self._select("id, category, line, line_tokens", product_ids)}
+        return [by_id[i] for i in product_ids if i in by_id]
+
+    def expand_refs(self, text: str) -> str:
+        # [30796] در پاسخ مدل -> [نام محصول](لینک)؛ شناسه ناشناخته دست نمی‌خورد
+        refs = set(PRODUCT_REF_RE.findall(text))
+        if not refs:
+            return text
+        placeholders = ", ".join("?" * len(refs))
+        links = {
+            ref: f"[{title.replace('[', '(').replace(']', ')')}]({quote(link, safe=':/?&=#%')})"
+            for ref, title, link in self.conn.execute(
+                f"SELECT ref, title, link FROM products WHERE ref IN ({placeholders})", list(refs))
+        }
+        return PRODUCT_REF_RE.sub(lambda m: links.get(m.group(1), m.group(0)), text)
+
+    def search_ids(self, query: str, top_k: int, product_filter: ProductFilter = None):
+        return [product_id for product_id, _ in self._search(query, top_k, product_filter)]
+
+    def _search(self, query: str, top_k: int, product_filter: ProductFilter = None, min_gram_share: float = 0.0):
+        # [(id محصول، امتیاز BM25)] به ترتیب امتیاز؛ فقط محصولاتی که حداقل
+        # min_gram_share از trigramهای متمایز سوال را دارند
+        grams = Counter(char_ngrams(query)).most_common(MAX_QUERY_GRAMS)
+        if not grams or not self.count:
+            return []
+        clauses, filter_params = [], []
+        if product_filter:
+            clauses, filter_params = product_filter.price_clauses("d.price_value")
+            if product_filter.category_ids:
+                clause, params = product_filter.category_clause("category")
+                clauses.append(f"d.id IN (SELECT product_id FROM product_categories WHERE {clause})")
+                filter_params += params
+        sql = _SEARCH_SQL.format(
+            values=", ".join(["(?, ?)"] * len(grams)),
+            where=f"WHERE {' AND '.join(clauses)}" if clauses else "",
+        )
+        params = [value for pair in grams for value in pair]
+        params += [BM25_K1, BM25_K1, BM25_B, BM25_B, self.avg_len, *filter_params,
+                   math.ceil(len(grams) * min_gram_share), top_k]
+        return list(self.conn.execute(sql, params))
+
+    def _select(self, columns: str, product_ids):
+        placeholders = ", ".join("?" * len(product_ids))
+        return self.conn.execute(f"SELECT {columns} FROM products WHERE id IN ({placeholders})", list(product_ids))
+
+    @staticmethod
+    def _product(row):
+        return {
+            "title": row[1],
+            "link": row[2],
+            "price": row[3],
+            "price_value": row[4],
+            "categories": json.loads(row[5]),
+            "category_ids": json.loads(row[6]),
+            "id": row[7],
+        }
+
+
+class CatalogStore:
+    # بارگذاری تنبل: حداکثر هر check_interval ثانیه یک stat روی فایل منبع؛ اگر
+    # عوض شده باشد snapshot تازه (فقط توسط یک پروسه، با flock) ساخته و کاتالوگ
+    # جدید به‌صورت اتمیک جایگزین می‌شود. درخواست‌های در حال اجرا روی نسخه قبلی می‌مانند.
+    # اگر اسکرپر برای همین نسخه delta نوشته باشد فقط همان تغییرات روی snapshot اعمال می‌شود.
+    def __init__(self, json_path: Path, snapshot_path: Path, target_web: str, model: str,
+                 check_interval: float = 1.0):
+        self.json_path = Path(json_path)
+        self.snapshot_path = Path(snapshot_path)
+        self.target_web = target_web
+        self.model = model
+        self.check_interval = check_interval
+        self._catalog = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Catalog:
+        catalog = self._catalog
+        if catalog is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return catalog
+
+        version = source_version(self.json_path)
+        if catalog is None or catalog.version != version:
+            with self._lock:
+                catalog = self._catalog
+                if catalog is None or catalog.version != version:
+                    catalog = self._open(version)
+                    self._catalog = catalog
+        self._checked_at = time.monotonic()
+        return catalog
+
+    def after_fork(self):
+        catalog = self._catalog
+        if catalog is not None:
+            catalog.reopen()
+
+    def _is_current(self, version) -> bool:
+        meta = read_meta(self.snapshot_path)
+        return (
+            meta.get("format") == SNAPSHOT_FORMAT
+            and (meta.get("version") or None) == version
+            and meta.get("target_web") == self.target_web
+            and meta.get("model") == self.model
+        )
+
+    def _load_delta(self, version):
+        # delta فقط وقتی قابل اعمال است که دقیقاً از snapshot فعلی به همین نسخه JSON برسد
+        try:
+            with open(delta_path(self.json_path), "r", encoding="utf-8") as f:
+                delta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if delta.get("version") != version or not delta.get("base_version"):
+            return None
+        if not self._is_current(delta["base_version"]):
+            return None
+        return delta
+
+    def _open(self, version) -> Catalog:
+        if not self._is_current(version):
+            lock_path = self.snapshot_path.with_name(self.snapshot_path.name + ".lock")
+            with open(lock_path, "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if not self._is_current(version):
+                    delta = self._load_delta(version)
+                    if delta is not None:
+                        apply_delta(delta, self.snapshot_path, version, self.model)
+                    else:
+                        build_snapshot(iter_products(self.json_path), self.snapshot_path,
+                                       version, self.target_web, self.model)
+        return Catalog(self.snapshot_path, self.target_web, self.model)
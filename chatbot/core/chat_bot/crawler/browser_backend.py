@@ -0,0 +1,141 @@
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from playwright.async_api import async_playwright, TimeoutError, Error
+
+from .extract import BASE_URL, CATEGORY_SELECTOR, PRODUCT_SELECTOR, extract_products
+from .results import PageError
+from .routing import ResourcePolicy
+
+PAGE_RECYCLE_AFTER = 50  # هر تب بعد از این تعداد صفحه بسته و تازه ساخته می‌شود
+CARDS_TIMEOUT = 10000  # میلی‌ثانیه انتظار برای اولین کارت محصول
+LOAD_TIMEOUT = 20000  # میلی‌ثانیه انتظار برای رویداد load وقتی کارتی نیامده
+
+
+# ================== دریافت صفحه‌ها با Chromium ==================
+class BrowserBackend:
+    # مجموعه‌ای از N پروسه Chromium، هر کدام با یک context پایدار برای کل اسکرپ
+    # (کوکی‌ها، localStorage و وقتی مسدودسازی خاموش است کش دیسک؛ با profile_dir
+    # بین اجراها هم می‌ماند). چند پروسه یعنی رندر روی چند هسته پخش می‌شود. تب‌ها
+    # بین صفحه‌ها دوباره استفاده و هر recycle_after صفحه بسته و تازه ساخته می‌شوند
+    # تا حافظه renderer بالا نرود.
+    def __init__(self, base_url: str = BASE_URL, extract_mode: str = "evaluate", policy=None,
+                 block_resources: bool = True, profile_dir=None, processes: int = 1,
+                 recycle_after: int = PAGE_RECYCLE_AFTER):
+        self.base_url = base_url
+        self.extract_mode = extract_mode
+        if policy is None and block_resources:
+            policy = ResourcePolicy(base_url)
+        self.policy = policy
+        self.profile_dir = profile_dir
+        self.processes = max(1, processes)
+        self.recycle_after = recycle_after
+        self._tmp_profile = None
+        self._playwright = None
+        self.contexts = []
+        self._open_pages = []
+        self._idle = []
+
+    async def __aenter__(self):
+        if self.profile_dir is None:
+            self._tmp_profile = tempfile.TemporaryDirectory(prefix="crawler-profile-")
+        profile_dir = Path(self.profile_dir or self._tmp_profile.name)
+        self._playwright = await async_playwright().start()
+        for i in range(self.processes):
+            # هر پروسه پوشه profile خودش را می‌خواهد
+            context = await self._playwright.chromium.launch_persistent_context(
+                str(profile_dir / f"browser-{i}"), headless=True,
+            )
+            if self.policy is not None:
+                await context.route("**/*", self.policy.handle)
+            self.contexts.append(context)
+            self._open_pages.append(0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for context in self.contexts:
+            await context.close()
+        await self._playwright.stop()
+        if self._tmp_profile is not None:
+            self._tmp_profile.cleanup()
+        if self.policy is not None:
+            print(f"Browser: {self.policy.summary()}.")
+
+    @asynccontextmanager
+    async def page(self):
+        if self._idle:
+            page, index, uses = self._idle.pop()
+        else:
+            # تب تازه در پروسه‌ای که کمترین تب باز را دارد
+            index = min(range(len(self.contexts)), key=self._open_pages.__getitem__)
+            self._open_pages[index] += 1
+            try:
+                page = await self.contexts[index].new_page()
+            except BaseException:
+                self._open_pages[index] -= 1
+                raise
+            uses = 0
+        reusable = False
+        try:
+            yield page
+            reusable = True
+        finally:
+            uses += 1
+            if reusable and uses < self.recycle_after and not page.is_closed():
+                self._idle.append((page, index, uses))
+            else:
+                # بعد از خطا وضعیت تب معلوم نیست؛ بسته می‌شود
+                self._open_pages[index] -= 1
+                await page.close()
+
+    async def categories(self):
+        async with self.page() as page:
+            try:
+                response = await page.goto(self.base_url, timeout=60000, wait_until="domcontentloaded")
+            except (TimeoutError, Error) as e:
+                raise PageError(f"Page too slow: {self.base_url} ({e!r})") from e
+            if response is not None and (response.status >= 500 or response.status == 429):
+                raise PageError(f"HTTP {response.status}: {self.base_url}")
+            category_links = await page.query_selector_all(CATEGORY_SELECTOR)
+            categories = []
+            for c in category_links:
+                href = await c.get_attribute("href")
+                text = (await c.inner_text()).strip()
+                if href and href.startswith("/products/category"):
+                    categories.append((f"{self.base_url}{href}", text))
+            return categories
+
+    async def listing(self, category_url, page_num, category_name):
+        # None یعنی صفحه خالی است و صفحه‌های بعدی این دسته لازم نیستند
+        url = f"{category_url}?page={page_num}"
+        async with self.page() as page:
+            try:
+                response = await page.goto(url, timeout=60000, wait_until="domcontentloaded")
+            except (TimeoutError, Error) as e:
+                raise PageError(f"Page too slow: {url} ({e!r})") from e
+            if response is not None and (response.status >= 500 or response.status == 429):
+                raise PageError(f"HTTP {response.status}: {url}")
+            if not await self._wait_for_cards(page, url):
+                print(f"No products on {url}. Ending this category.")
+                return None
+
+            products = await extract_products(page, url, category_name, self.extract_mode, self.base_url)
+            if products is None:
+                print(f"No products on {url}. Ending this category.")
+            return products
+
+    async def _wait_for_cards(self, page, url) -> bool:
+        # False فقط یعنی صفحه کامل بار شده و کارتی ندارد (پایان دسته). اگر کارت‌ها
+        # به موقع نرسیدند و صفحه هم تمام نشده، PageError تا retry و backoff اعمال
+        # شود و صفحه به اشتباه «خالی» در checkpoint ثبت نشود.
+        try:
+            await page.wait_for_selector(PRODUCT_SELECTOR, timeout=CARDS_TIMEOUT)
+            return True
+        except (TimeoutError, Error) as e:
+            error = e
+        try:
+            await page.wait_for_load_state("load", timeout=LOAD_TIMEOUT)
+        except (TimeoutError, Error):
+            raise PageError(f"Listing did not finish loading: {url} ({error!r})") from error
+        return await page.query_selector(PRODUCT_SELECTOR) is not None
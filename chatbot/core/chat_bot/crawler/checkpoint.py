@@ -0,0 +1,37 @@
+from django.db.models import F
+
+from ..models import CrawlTask
+
+# ================== checkpoint صفحه‌های اسکرپ ==================
+# هر (دسته، صفحه) قبل از شروع به‌صورت pending ثبت و بعد از ذخیره محصولاتش done
+# (یا empty) می‌شود. اگر اسکرپ وسط کار قطع شود، --resume فقط صفحه‌های باقی‌مانده
+# را می‌گیرد و لینک‌های صفحه‌های تمام‌شده را از همین جدول برمی‌دارد.
+
+
+class CrawlCheckpoint:
+    def reset(self):
+        CrawlTask.objects.all().delete()
+
+    def plan(self, category_url: str, category_name: str, max_page: int):
+        CrawlTask.objects.bulk_create(
+            [CrawlTask(category_url=category_url, category_name=category_name, page=page)
+             for page in range(1, max_page + 1)],
+            ignore_conflicts=True,
+        )
+        done = {}
+        last_page = max_page
+        tasks = CrawlTask.objects.filter(category_url=category_url).exclude(status=CrawlTask.PENDING)
+        for page, status, links in tasks.values_list("page", "status", "product_links"):
+            if status == CrawlTask.EMPTY:
+                last_page = min(last_page, page - 1)
+            else:
+                done[page] = links
+        return {page: links for page, links in done.items() if page <= last_page}, last_page
+
+    def done(self, category_url: str, page: int, links, empty: bool = False):
+        CrawlTask.objects.filter(category_url=category_url, page=page).update(
+            status=CrawlTask.EMPTY if empty else CrawlTask.DONE, product_links=links,
+        )
+
+    def failed(self, category_url: str, page: int):
+        CrawlTask.objects.filter(category_url=category_url, page=page).update(attempts=F("attempts") + 1)
@@ -0,0 +1,168 @@
+import asyncio
+import random
+import time
+
+from asgiref.sync import sync_to_async
+
+from .limiter import TARGET_LATENCY, AdaptiveLimiter, ConcurrencyLimiter
+from .results import PageError, UnchangedPage
+
+# ================== هماهنگ‌کننده اسکرپ ==================
+# backend (HttpBackend یا BrowserBackend) فقط صفحه‌ها را می‌گیرد و محصولات را
+# برمی‌گرداند؛ صف صفحه‌ها، تکرار صفحه‌های ناموفق، محدودیت هم‌زمانی (ثابت یا
+# تطبیقی) و ذخیره در sink اینجاست.
+MAX_CONCURRENT = 5  # صفحات هم‌زمان در شروع اسکرپ
+MAX_PAGE = 10  # حداکثر صفحات
+PAGE_WORKERS = 3  # حداکثر صفحات هم‌زمان از یک دسته
+PAGE_RETRIES = 3  # تلاش دوباره برای صفحه‌ای که timeout/خطا داده
+RETRY_BASE_DELAY = 1.0  # ثانیه
+RETRY_MAX_DELAY = 30.0
+
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    # exponential backoff با full jitter تا صفحه‌های ناموفق هم‌زمان دوباره به سایت نخورند
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def with_retries(fetch, retries=PAGE_RETRIES):
+    # fetch() را تا retries بار بعد از PageError دوباره اجرا می‌کند؛ بعد از آن خطا بالا می‌رود
+    for attempt in range(retries + 1):
+        try:
+            return await fetch()
+        except PageError as e:
+            if attempt == retries:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"{e}. Retry {attempt + 1}/{retries} in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+
+
+async def scrape_page(backend, category_url, page_num, category_name):
+    # None یعنی صفحه خالی است و صفحه‌های بعدی این دسته لازم نیستند؛ خطای دریافت
+    # PageError را بالا می‌فرستد تا دوباره تلاش شود.
+    products = await backend.listing(category_url, page_num, category_name)
+    if isinstance(products, UnchangedPage):
+        return products
+    if products is not None and not products:
+        print(f"No available products on {category_url}?page={page_num}. Ending this category.")
+        return None
+    return products
+
+
+async def scrape_category(backend, limiter, category_url, category_name, on_page, max_page=MAX_PAGE,
+                          skip=(), retries=PAGE_RETRIES, on_failure=None):
+    # صف صفحه‌ها: چند worker صفحه‌های دسته را هم‌زمان می‌گیرند و limiter سراسری
+    # تعداد کل صفحه‌های در حال دریافت را محدود می‌کند. اولین صفحه خالی سقف دسته
+    # را پایین می‌آورد تا صفحه‌های بعدی اصلاً درخواست نشوند. هر صفحه به محض رسیدن
+    # به on_page(page_num, result) داده می‌شود (لیست محصولات، UnchangedPage یا None).
+    # خروجی: آیا همه صفحه‌ها تا انتهای دسته گرفته شدند.
+    queue = asyncio.Queue()
+    for page_num in range(1, max_page + 1):
+        if page_num not in skip:
+            queue.put_nowait(page_num)
+    last_page = max_page
+    complete = True
+
+    async def fetch(page_num):
+        async def attempt():
+            try:
+                # limiter هنگام انتظار backoff آزاد است
+                async with limiter:
+                    if page_num > last_page:
+                        return None
+                    start = time.perf_counter()
+                    try:
+                        result = await scrape_page(backend, category_url, page_num, category_name)
+                    except PageError:
+                        await limiter.record(start, ok=False)
+                        raise
+                    await limiter.record(start, ok=True)
+                    return result
+            except PageError:
+                if on_failure is not None:
+                    await on_failure(page_num)
+                raise
+
+        return await with_retries(attempt, retries)
+
+    async def worker():
+        nonlocal last_page, complete
+        while not queue.empty():
+            page_num = queue.get_nowait()
+            if page_num > last_page:
+                return
+            try:
+                result = await fetch(page_num)
+            except PageError as e:
+                print(f"{e}. Giving up on this page; --resume will try it again.")
+                complete = False
+                continue
+            if page_num > last_page:
+                return
+            if result is None:
+                last_page = min(last_page, page_num - 1)
+            await on_page(page_num, result)
+
+    await asyncio.gather(*(worker() for _ in range(PAGE_WORKERS)))
+    return complete
+
+
+async def scrape_category_to_sink(backend, limiter, url, name, sink, max_page=MAX_PAGE, state=None,
+                                  checkpoint=None, retries=PAGE_RETRIES):
+    done = {}
+    if checkpoint is not None:
+        done, max_page = await sync_to_async(checkpoint.plan)(url, name, max_page)
+    # صفحه‌های بدون تغییر (و صفحه‌های تمام‌شده دور قبل) فقط لینک‌هایشان را
+    # می‌دهند تا محصولاتشان «حذف‌شده» حساب نشوند
+    unchanged_links = [link for links in done.values() for link in links]
+    written = 0
+
+    async def on_page(page_num, result):
+        nonlocal written
+        if isinstance(result, UnchangedPage):
+            links = result.links
+            unchanged_links.extend(links)
+        elif result:
+            # هر صفحه به محض رسیدن در sink نوشته می‌شود و از حافظه بیرون می‌رود
+            await sync_to_async(sink.write)(result, url)
+            links = [p["link"] for p in result]
+            written += len(result)
+        else:
+            links = []
+        # وضعیت و checkpoint صفحه فقط بعد از ذخیره محصولاتش ثبت می‌شود
+        if state is not None:
+            await sync_to_async(state.flush)([f"{url}?page={page_num}"])
+        if checkpoint is not None:
+            await sync_to_async(checkpoint.done)(url, page_num, links, empty=result is None)
+
+    async def on_failure(page_num):
+        await sync_to_async(checkpoint.failed)(url, page_num)
+
+    complete = await scrape_category(
+        backend, limiter, url, name, on_page, max_page, skip=done, retries=retries,
+        on_failure=on_failure if checkpoint is not None else None,
+    )
+    await sync_to_async(sink.category_done)(name, unchanged_links, complete)
+    return written + len(unchanged_links)
+
+
+def make_limiter(concurrency=MAX_CONCURRENT, adaptive=False, min_concurrency=1, max_concurrency=None,
+                 target_latency=TARGET_LATENCY):
+    if not adaptive:
+        return ConcurrencyLimiter(concurrency)
+    return AdaptiveLimiter(concurrency, min_concurrency, max_concurrency or concurrency * 4, target_latency)
+
+
+async def scrape_site(backend, sink, concurrency=MAX_CONCURRENT, max_page=MAX_PAGE, state=None,
+                      checkpoint=None, retries=PAGE_RETRIES, limiter=None):
+    # limiter برای هر اسکرپ تازه ساخته می‌شود (نه در زمان import)
+    limiter = limiter or make_limiter(concurrency)
+    # صفحه اصلی هم مثل صفحه‌های فهرست با backoff دوباره گرفته می‌شود
+    categories = await with_retries(backend.categories, retries)
+    tasks = [
+        scrape_category_to_sink(backend, limiter, url, name, sink, max_page, state, checkpoint, retries)
+        for url, name in categories
+    ]
+    total = sum(await asyncio.gather(*tasks))
+    print(f"Crawl finished with {limiter.summary()}.")
+    return total
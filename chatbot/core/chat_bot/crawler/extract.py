@@ -0,0 +1,76 @@
+from ..text import normalize_product
+
+# ================== استخراج محصولات از صفحه فهرست ==================
+BASE_URL = "https://www.ehadish.com"
+PRODUCT_SELECTOR = "div.bx-product"
+CATEGORY_SELECTOR = "a[href*='/products/category-']"
+
+# همه کارت‌های صفحه در یک رفت‌وبرگشت به Chromium خوانده می‌شوند، به‌جای
+# حدود پنج await (query_selector، inner_text، get_attribute، ...) برای هر کارت.
+EXTRACT_PRODUCTS_JS = """
+cards => cards.map(card => {
+    const a = card.querySelector("h2 a");
+    const price = card.querySelector("div.bx-price");
+    return {
+        title: a ? a.innerText : null,
+        href: a ? a.getAttribute("href") : null,
+        price: price ? price.innerText : "",
+    };
+})
+"""
+
+
+def build_product(row, category_name, url, base_url=BASE_URL):
+    if not row["title"] or not row["href"]:
+        print(f"Failed to parse a product on {url}: missing title link")
+        return None
+    price = row["price"].replace("تومان", "").strip()
+    if not price:  # محصول موجود نیست
+        return None
+    # قیمت عددی، شناسه دسته و ارقام/فاصله‌های یکسان (chat_bot.text.normalize_product)
+    return normalize_product({
+        "title": row["title"],
+        "link": f"{base_url}{row['href']}",
+        "price": price,
+        "categories": [category_name],
+    })
+
+
+async def extract_rows_evaluate(page):
+    return await page.eval_on_selector_all(PRODUCT_SELECTOR, EXTRACT_PRODUCTS_JS)
+
+
+async def extract_rows_per_element(page):
+    # روش قدیمی؛ فقط برای مقایسه در بنچمارک نگه داشته شده
+    rows = []
+    for product in await page.query_selector_all(PRODUCT_SELECTOR):
+        title_tag = await product.query_selector("h2 a")
+        price_tag = await product.query_selector("div.bx-price")
+        rows.append({
+            "title": await title_tag.inner_text() if title_tag else None,
+            "href": await title_tag.get_attribute("href") if title_tag else None,
+            "price": await price_tag.inner_text() if price_tag else "",
+        })
+    return rows
+
+
+EXTRACTORS = {
+    "evaluate": extract_rows_evaluate,
+    "per-element": extract_rows_per_element,
+}
+
+
+def products_from_rows(rows, url, category_name, base_url=BASE_URL):
+    # None یعنی صفحه هیچ کارت محصولی ندارد
+    if not rows:
+        return None
+    products = []
+    for row in rows:
+        product = build_product(row, category_name, url, base_url)
+        if product is not None:
+            products.append(product)
+    return products
+
+
+async def extract_products(page, url, category_name, mode="evaluate", base_url=BASE_URL):
+    return products_from_rows(await EXTRACTORS[mode](page), url, category_name, base_url)
@@ -0,0 +1,161 @@
+import hashlib
+import multiprocessing
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+# ================== صفحه‌های ساختگی با ساختار ehadish.com ==================
+# برای بنچمارک و تست بدون رفتن سراغ سایت اصلی؛ ساختار کارت‌ها همان سلکتورهای
+# اسکرپر را دارد (div.bx-product، h2 a، div.bx-price).
+_WORDS = ["لپ تاپ", "گوشی موبایل", "هارد", "حافظه اس اس دی", "مانیتور", "کیبورد", "ماوس", "هدست"]
+_BRANDS = ["لنوو", "ایسوس", "سامسونگ", "شیائومی", "وسترن دیجیتال", "گرین", "ایسر"]
+
+
+def product_card(category_slug: str, product_id: int, available: bool = True, rng=random) -> str:
+    title = f"{rng.choice(_WORDS)} {rng.choice(_BRANDS)} مدل {product_id}"
+    slug = title.replace(" ", "-")
+    price = f"{rng.randrange(500, 200000) * 1000:,} تومان" if available else ""
+    return (
+        '<div class="bx-product">'
+        f'<div class="bx-img"><img src="/images/{product_id}.jpg" alt="{title}"></div>'
+        f'<h2><a href="/product/{category_slug}/{product_id}-{slug}/">{title}</a></h2>'
+        f'<div class="bx-price">{price}</div>'
+        "</div>"
+    )
+
+
+def listing_html(category_slug: str, page_num: int, per_page: int = 24, seed: int = 0) -> str:
+    rng = random.Random(f"{category_slug}:{page_num}:{seed}")
+    first_id = page_num * 1000
+    cards = "".join(
+        product_card(category_slug, first_id + i, available=rng.random() > 0.1, rng=rng)
+        for i in range(per_page)
+    )
+    return (
+        '<!DOCTYPE html><html lang="fa" dir="rtl"><head><meta charset="utf-8">'
+        f"<title>{category_slug}</title></head>"
+        f'<body><div class="products">{cards}</div></body></html>'
+    )
+
+
+def home_html(category_slugs) -> str:
+    links = "".join(
+        f'<a href="/products/{slug}/">دسته {slug}</a>' for slug in category_slugs
+    )
+    return f'<!DOCTYPE html><html><head><meta charset="utf-8"></head><body><nav>{links}</nav></body></html>'
+
+
+# ================== سرور محلی صفحه‌های نمونه ==================
+class FixtureSite:
+    # یا صفحه‌های ذخیره‌شده از سایت واقعی را از یک پوشه می‌خواند
+    # (index.html و <slug>/page-<n>.html) یا صفحه‌های ساختگی می‌سازد.
+    # latency (± jitter) ثانیه تأخیر به هر پاسخ اضافه می‌کند و failure_rate سهم
+    # درخواست‌هایی است که 503 می‌گیرند، تا رفتار اسکرپر زیر فشار هم سنجیده شود.
+    def __init__(self, categories: int = 8, pages: int = 4, per_page: int = 24, directory=None,
+                 latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.directory = Path(directory) if directory else None
+        self.slugs = [f"category-fixture-{i}" for i in range(categories)]
+        self.pages = pages
+        self.per_page = per_page
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def delay(self) -> float:
+        with self._rng_lock:
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def should_fail(self) -> bool:
+        if not self.failure_rate:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < self.failure_rate
+
+    def render(self, path: str, query: dict):
+        if self.directory is not None:
+            return self._from_directory(path, query)
+        if path in ("", "/"):
+            return 200, home_html(self.slugs)
+        slug = path.strip("/").split("/")[-1]
+        if slug not in self.slugs:
+            return 404, "not found"
+        page_num = int(query.get("page", ["1"])[0])
+        per_page = self.per_page if page_num <= self.pages else 0
+        return 200, listing_html(slug, page_num, per_page=per_page)
+
+    def _from_directory(self, path: str, query: dict):
+        if path in ("", "/"):
+            file = self.directory / "index.html"
+        else:
+            slug = path.strip("/").split("/")[-1]
+            file = self.directory / slug / f"page-{query.get('page', ['1'])[0]}.html"
+        if not file.exists():
+            return 200, listing_html("empty", 0, per_page=0)
+        return 200, file.read_text(encoding="utf-8")
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    site = None
+    protocol_version = "HTTP/1.1"  # keep-alive، مثل سایت واقعی
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        delay = self.site.delay()
+        if delay:
+            time.sleep(delay)
+        if self.site.should_fail():
+            status, body = 503, "temporarily unavailable"
+        else:
+            status, body = self.site.render(url.path, parse_qs(url.query))
+        data = body.encode("utf-8")
+        # ETag مثل سرورهای واقعی تا درخواست‌های شرطی re-crawl هم آزموده شوند
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server(site: FixtureSite, host: str = "127.0.0.1", port: int = 0):
+    # سرور در یک thread پس‌زمینه اجرا می‌شود؛ server.base_url آدرس ریشه سایت است
+    handler = type("Handler", (FixtureHandler,), {"site": site})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _serve_in_child(site: FixtureSite, host: str, port: int, conn):
+    server = start_fixture_server(site, host, port)
+    conn.send(server.base_url)
+    conn.close()
+    while True:
+        time.sleep(3600)
+
+
+def start_fixture_process(site: FixtureSite, host: str = "127.0.0.1", port: int = 0):
+    # برای بنچمارک: سرور در پروسه جدا تا ساختن صفحه‌ها با اسکرپر سر GIL و CPU رقابت نکند
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context("fork").Process(
+        target=_serve_in_child, args=(site, host, port, child_conn), daemon=True,
+    )
+    process.start()
+    process.base_url = parent_conn.recv()
+    return process
@@ -0,0 +1,125 @@
+import asyncio
+
+import httpx
+from selectolax.lexbor import LexborHTMLParser as HTMLParser
+
+from .extract import BASE_URL, CATEGORY_SELECTOR, PRODUCT_SELECTOR, products_from_rows
+from .results import PageError, UnchangedPage
+from .state import rows_hash
+
+# ================== دریافت صفحه‌ها با HTTP (بدون مرورگر) ==================
+# صفحه‌های فهرست ehadish سمت سرور رندر می‌شوند؛ یک کلاینت HTTP با اتصال‌های
+# keep-alive و پارسر selectolax همان سلکتورها و همان خروجی را با کسری از حافظه
+# و CPU مرورگر می‌دهد. Chromium فقط وقتی بالا می‌آید که صفحه اول یک دسته بدون
+# کارت محصول برگردد (یعنی احتمالاً با JS ساخته می‌شود).
+# با state (CrawlState) درخواست‌ها شرطی‌اند و صفحه‌ای که 304 بدهد یا همان
+# محصولات دفعه قبل را داشته باشد به‌صورت UnchangedPage برمی‌گردد.
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+
+def _text(node) -> str:
+    # مثل innerText مرورگر: فاصله‌های اضافه حذف می‌شوند
+    return " ".join(node.text(deep=True).split())
+
+
+def parse_listing(html: str):
+    rows = []
+    for card in HTMLParser(html).css(PRODUCT_SELECTOR):
+        a = card.css_first("h2 a")
+        price = card.css_first("div.bx-price")
+        rows.append({
+            "title": _text(a) if a else None,
+            "href": a.attributes.get("href") if a else None,
+            "price": _text(price) if price else "",
+        })
+    return rows
+
+
+def parse_categories(html: str, base_url: str):
+    categories = []
+    for a in HTMLParser(html).css(CATEGORY_SELECTOR):
+        href = a.attributes.get("href")
+        if href and href.startswith("/products/category"):
+            categories.append((f"{base_url}{href}", _text(a)))
+    return categories
+
+
+class HttpBackend:
+    def __init__(self, base_url: str = BASE_URL, max_connections: int = 20, timeout: float = 30.0,
+                 js_fallback: bool = True, state=None, browser_options=None):
+        self.base_url = base_url
+        self.browser_options = browser_options or {}
+        self.state = state
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.js_fallback = js_fallback
+        self.client = None
+        self._browser = None
+        self._browser_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT, "Accept-Language": "fa,en;q=0.8"},
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
+            follow_redirects=True,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        if self._browser is not None:
+            await self._browser.__aexit__(*exc_info)
+
+    async def browser(self):
+        # Playwright فقط در صورت نیاز import و اجرا می‌شود
+        async with self._browser_lock:
+            if self._browser is None:
+                from .browser_backend import BrowserBackend
+
+                self._browser = await BrowserBackend(self.base_url, **self.browser_options).__aenter__()
+        return self._browser
+
+    async def get(self, url: str) -> str:
+        try:
+            response = await self.client.get(url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise PageError(f"Page failed: {url} ({e!r})") from e
+        return response.text
+
+    async def categories(self):
+        categories = parse_categories(await self.get(self.base_url), self.base_url)
+        if not categories and self.js_fallback:
+            return await (await self.browser()).categories()
+        return categories
+
+    async def listing(self, category_url, page_num, category_name):
+        url = f"{category_url}?page={page_num}"
+        headers = self.state.conditional_headers(url) if self.state is not None else {}
+        try:
+            response = await self.client.get(url, headers=headers)
+            if response.status_code == 304:
+                return UnchangedPage(self.state.links(url))
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise PageError(f"Page failed: {url} ({e!r})") from e
+
+        rows = parse_listing(response.text)
+        if not rows and page_num == 1 and self.js_fallback:
+            print(f"No product cards in the HTML of {url}; retrying with the browser.")
+            return await (await self.browser()).listing(category_url, page_num, category_name)
+
+        products = products_from_rows(rows, url, category_name, self.base_url)
+        if products is None:
+            print(f"No products on {url}. Ending this category.")
+        elif products and self.state is not None:
+            # هش روی ردیف‌های استخراج‌شده است، نه HTML، تا توکن‌ها و زمان‌های داخل صفحه اثری نداشته باشند
+            content_hash = rows_hash(rows)
+            unchanged = self.state.is_unchanged(url, content_hash)
+            self.state.record(url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                              content_hash, [p["link"] for p in products])
+            if unchanged:
+                return UnchangedPage(self.state.links(url))
+        return products
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+# ================== محدودیت هم‌زمانی ==================
+# مثل asyncio.Semaphore، ولی سقفش حین اسکرپ قابل تغییر است. AdaptiveLimiter سقف
+# را به سبک AIMD از روی زمان پاسخ و خطاها تنظیم می‌کند: تا وقتی سایت سریع جواب
+# می‌دهد در هر «دور» یکی اضافه و با اولین کندی/خطا (429، 503، timeout) نصف می‌شود.
+TARGET_LATENCY = 3.0  # ثانیه؛ کندتر از این یعنی سایت زیر فشار است
+BACKOFF_FACTOR = 0.5
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.active = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < max(1, int(self.limit)))
+            self.active += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    async def record(self, started: float, ok: bool):
+        pass
+
+    def summary(self) -> str:
+        return f"concurrency {int(self.limit)}"
+
+
+class AdaptiveLimiter(ConcurrencyLimiter):
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 64,
+                 target_latency: float = TARGET_LATENCY, backoff: float = BACKOFF_FACTOR):
+        super().__init__(float(min(max(initial, minimum), maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.completed = 0
+        self.errors = 0
+        self.peak = self.limit
+        self._decreased_at = 0.0
+
+    async def record(self, started: float, ok: bool):
+        # started: time.perf_counter() لحظه شروع درخواست
+        latency = time.perf_counter() - started
+        self.completed += 1
+        if not ok:
+            self.errors += 1
+        if ok and latency <= self.target_latency:
+            # +1 به ازای هر limit پاسخ موفق، یعنی یکی در هر دور
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.peak = max(self.peak, self.limit)
+            async with self._cond:
+                self._cond.notify_all()
+        elif started >= self._decreased_at:
+            # درخواست‌هایی که قبل از آخرین کاهش رفته بودند دوباره باعث کاهش نمی‌شوند
+            self.limit = max(self.minimum, self.limit * self.backoff)
+            self._decreased_at = time.perf_counter()
+            print(f"Site is slowing down ({'error' if not ok else f'{latency:.1f}s'}); "
+                  f"concurrency lowered to {int(self.limit)}.")
+
+    def summary(self) -> str:
+        return (f"concurrency {int(self.limit)} at the end (peak {int(self.peak)}), "
+                f"{self.errors} failed of {self.completed} page requests")
@@ -0,0 +1,13 @@
+# ================== نتیجه دریافت یک صفحه ==================
+class PageError(Exception):
+    # دریافت صفحه شکست خورد (timeout، خطای HTTP، ...)؛ با صفحه خالی فرق دارد
+    pass
+
+
+class UnchangedPage:
+    # صفحه نسبت به دفعه قبل عوض نشده (304 یا همان محتوا)؛ فقط لینک‌هایش را داریم
+    def __init__(self, links):
+        self.links = links
+
+    def __bool__(self):
+        return bool(self.links)
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+# ================== سیاست مسیریابی درخواست‌ها ==================
+# از صفحه فقط متن و href کارت‌ها لازم است؛ تصویر، فونت، CSS و اسکریپت‌های
+# سایت‌های دیگر (آنالیتیکس، چت آنلاین، ...) فقط پهنای باند و زمان لود می‌گیرند.
+# فقط نوع‌ها و hostهای allowlist عبور می‌کنند و بقیه abort می‌شوند.
+ALLOWED_RESOURCE_TYPES = ("document", "script", "xhr", "fetch")
+# Playwright وقتی route فعال است کش HTTP مرورگر را خاموش می‌کند؛ پس منابع
+# ثابت مجاز (اسکریپت‌های خود سایت) یک بار دریافت و از حافظه سرو می‌شوند.
+CACHED_RESOURCE_TYPES = ("script", "stylesheet")
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class ResourcePolicy:
+    def __init__(self, base_url: str, allowed_types=ALLOWED_RESOURCE_TYPES, allowed_hosts=(),
+                 max_cache_bytes: int = MAX_CACHE_BYTES):
+        site = urlsplit(base_url).hostname or ""
+        # خود سایت با یا بدون www و زیردامنه‌هایش (مثلاً cdn.ehadish.com)
+        self.site_domain = site.removeprefix("www.")
+        self.allowed_types = set(allowed_types)
+        self.allowed_hosts = {h.lower() for h in allowed_hosts}
+        self.max_cache_bytes = max_cache_bytes
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self.allowed = 0
+        self.blocked = 0
+        self.cache_hits = 0
+
+    def allows(self, request) -> bool:
+        if request.resource_type not in self.allowed_types:
+            return False
+        host = (urlsplit(request.url).hostname or "").lower()
+        if host == self.site_domain or host.endswith("." + self.site_domain):
+            return True
+        return host in self.allowed_hosts
+
+    async def handle(self, route, request):
+        if not self.allows(request):
+            self.blocked += 1
+            await route.abort("blockedbyclient")
+            return
+        self.allowed += 1
+        if request.method != "GET" or request.resource_type not in CACHED_RESOURCE_TYPES:
+            await route.continue_()
+            return
+
+        cached = self._cache.get(request.url)
+        if cached is not None:
+            self.cache_hits += 1
+            self._cache.move_to_end(request.url)
+            status, headers, body = cached
+            await route.fulfill(status=status, headers=headers, body=body)
+            return
+        response = await route.fetch()
+        body = await response.body()
+        if response.ok:
+            self._remember(request.url, (response.status, response.headers, body))
+        await route.fulfill(response=response, body=body)
+
+    def _remember(self, url, entry):
+        self._cache[url] = entry
+        self._cache_bytes += len(entry[2])
+        while self._cache_bytes > self.max_cache_bytes and self._cache:
+            _, (_, _, body) = self._cache.popitem(last=False)
+            self._cache_bytes -= len(body)
+
+    def summary(self) -> str:
+        return f"{self.allowed} requests allowed ({self.cache_hits} from cache), {self.blocked} blocked"
@@ -0,0 +1,63 @@
+import hashlib
+import json
+
+from ..models import CrawlPage
+
+# ================== وضعیت خزش برای re-crawl تدریجی ==================
+# برای هر صفحه فهرست ETag/Last-Modified و هش محتوای استخراج‌شده نگه داشته
+# می‌شود؛ صفحه‌ای که 304 بدهد یا همان محصولات را داشته باشد دوباره پردازش نمی‌شود.
+
+
+def rows_hash(rows) -> str:
+    data = json.dumps(rows, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class CrawlState:
+    def __init__(self):
+        self.pages = {}
+        self._dirty = {}
+
+    def load(self):
+        self.pages = {
+            page.url: page
+            for page in CrawlPage.objects.only("url", "etag", "last_modified", "content_hash", "product_links")
+        }
+        return self
+
+    def conditional_headers(self, url: str):
+        page = self.pages.get(url)
+        headers = {}
+        if page is not None:
+            if page.etag:
+                headers["If-None-Match"] = page.etag
+            if page.last_modified:
+                headers["If-Modified-Since"] = page.last_modified
+        return headers
+
+    def links(self, url: str):
+        page = self.pages.get(url)
+        return page.product_links if page is not None else []
+
+    def is_unchanged(self, url: str, content_hash: str) -> bool:
+        page = self.pages.get(url)
+        return page is not None and page.content_hash == content_hash
+
+    def record(self, url: str, etag: str, last_modified: str, content_hash: str, links):
+        page = CrawlPage(url=url, etag=etag or "", last_modified=last_modified or "",
+                         content_hash=content_hash, product_links=links)
+        self.pages[url] = page
+        self._dirty[url] = page
+
+    def flush(self, urls=None):
+        # بعد از ذخیره محصولات هر صفحه (فقط برای همان urlها) صدا زده می‌شود تا هش
+        # صفحه‌ای ثبت نشود که محصولاتش هنوز در دیتابیس نیستند
+        urls = list(self._dirty) if urls is None else [url for url in urls if url in self._dirty]
+        if not urls:
+            return
+        CrawlPage.objects.bulk_create(
+            [self._dirty.pop(url) for url in urls],
+            update_conflicts=True,
+            unique_fields=["url"],
+            update_fields=["etag", "last_modified", "content_hash", "product_links", "fetched_at"],
+        )
@@ -0,0 +1,279 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.db import transaction
+
+from .catalog import delta_path, source_version
+from .models import Category, Product
+from .text import category_id, parse_price
+
+# ================== ذخیره تدریجی محصولات در دیتابیس ==================
+# اسکرپر هر صفحه را به محض رسیدن به این sink می‌دهد؛ در دسته‌های
+# BATCH_SIZE تایی upsert می‌شوند و چیزی جز همان یک دسته در حافظه نمی‌ماند.
+BATCH_SIZE = 500
+
+
+class ProductSink:
+    # لینک محصول به دسته‌ای که تا صفحه آخر بدون خطا خزیده شده ولی محصول دیگر در آن
+    # دیده نشده، در category_done حذف می‌شود.
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        self.batch_size = batch_size
+        self._category_ids = {}
+        self.written = 0
+        # نام دسته -> لینک محصولاتی که در این دور در آن دسته دیده شده‌اند
+        self.seen_in = {}
+
+    def category_id(self, name: str, url: str = "") -> int:
+        if name not in self._category_ids:
+            category, _ = Category.objects.update_or_create(name=name, defaults={"url": url} if url else {})
+            self._category_ids[name] = category.pk
+        return self._category_ids[name]
+
+    def category_done(self, name: str, unchanged_links, complete: bool):
+        seen = self.seen_in.pop(name, set())
+        seen.update(unchanged_links)
+        if complete:
+            self.categories_changed(self._prune_links(name, seen))
+
+    def _prune_links(self, name: str, seen) -> set:
+        Through = Product.categories.through
+        stale = [
+            (pk, link)
+            for pk, link in Through.objects.filter(category__name=name).values_list("id", "product__link")
+            if link not in seen
+        ]
+        for start in range(0, len(stale), self.batch_size):
+            Through.objects.filter(pk__in=[pk for pk, _ in stale[start:start + self.batch_size]]).delete()
+        return {link for _, link in stale}
+
+    def categories_changed(self, links):
+        # محصولاتی که دسته‌ای به آن‌ها اضافه یا از آن‌ها حذف شده
+        pass
+
+    def write(self, products, category_url: str = ""):
+        for item in products:
+            for name in item["categories"]:
+                self.seen_in.setdefault(name, set()).add(item["link"])
+        for start in range(0, len(products), self.batch_size):
+            self._write_batch(products[start:start + self.batch_size], category_url)
+
+    @transaction.atomic
+    def _write_batch(self, batch, category_url: str):
+        by_link = {}
+        for item in batch:
+            by_link.setdefault(item["link"], item)
+
+        self._upsert(by_link)
+        ids = dict(Product.objects.filter(link__in=by_link).values_list("link", "id"))
+
+        Through = Product.categories.through
+        wanted = {
+            (ids[item["link"]], self.category_id(name, category_url))
+            for item in batch
+            for name in item["categories"]
+        }
+        existing = set(Through.objects.filter(product_id__in=ids.values()).values_list("product_id", "category_id"))
+        new = wanted - existing
+        Through.objects.bulk_create(
+            [Through(product_id=product_id, category_id=category_id) for product_id, category_id in new],
+            ignore_conflicts=True,
+        )
+        links = {product_id: link for link, product_id in ids.items()}
+        self.categories_changed({links[product_id] for product_id, _ in new})
+        self.written += len(by_link)
+
+    def _upsert(self, by_link):
+        Product.objects.bulk_create(
+            [
+                Product(
+                    link=link,
+                    title=item["title"],
+                    price=parse_price(item["price"]),
+                    price_text=item["price"],
+                )
+                for link, item in by_link.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["link"],
+            update_fields=["title", "price", "price_text", "updated_at"],
+        )
+
+
+class DeltaSink(ProductSink):
+    # re-crawl تدریجی: فقط محصولات جدید یا با عنوان/قیمت تغییرکرده upsert می‌شوند؛
+    # محصولی که فقط دسته‌هایش عوض شده هم «تغییرکرده» است.
+    # محصولی که در این دور دیده نشده فقط وقتی حذف می‌شود که همه دسته‌هایش بدون
+    # خطا تا صفحه آخر خزیده شده باشند؛ خطای شبکه نباید کاتالوگ را خالی کند.
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        super().__init__(batch_size)
+        self.seen = set()
+        self.complete = set()
+        self.incomplete = set()
+        self.added = set()
+        self.changed = set()
+        self.removed = []
+
+    def category_done(self, name: str, unchanged_links, complete: bool):
+        self.seen.update(unchanged_links)
+        (self.complete if complete else self.incomplete).add(name)
+        super().category_done(name, unchanged_links, complete)
+
+    def categories_changed(self, links):
+        self.changed.update(set(links) - self.added)
+
+    def write(self, products, category_url: str = ""):
+        self.seen.update(p["link"] for p in products)
+        super().write(products, category_url)
+
+    def _upsert(self, by_link):
+        existing = {
+            link: (title, price_text)
+            for link, title, price_text in Product.objects.filter(link__in=by_link).values_list(
+                "link", "title", "price_text")
+        }
+        changed = {}
+        for link, item in by_link.items():
+            old = existing.get(link)
+            if old is None:
+                self.added.add(link)
+            elif old != (item["title"], item["price"]):
+                self.changed.add(link)
+            else:
+                continue
+            changed[link] = item
+        if changed:
+            super()._upsert(changed)
+
+    def finish(self):
+        removable = self.complete - self.incomplete
+        candidates = [
+            pk for pk, link in Product.objects.values_list("id", "link").iterator(chunk_size=2000)
+            if link not in self.seen
+        ]
+        Through = Product.categories.through
+        for start in range(0, len(candidates), self.batch_size):
+            chunk = candidates[start:start + self.batch_size]
+            blocked = set(
+                Through.objects.filter(product_id__in=chunk)
+                .exclude(category__name__in=removable)
+                .values_list("product_id", flat=True)
+            )
+            doomed = Product.objects.filter(pk__in=[pk for pk in chunk if pk not in blocked])
+            self.removed.extend(doomed.values_list("link", flat=True))
+            doomed.delete()
+        return self.delta()
+
+    def delta(self):
+        def as_dicts(links):
+            products = Product.objects.filter(link__in=links).prefetch_related("categories").order_by("id")
+            return [p.as_dict() for p in products]
+
+        return {
+            "added": as_dicts(self.added - self.changed),
+            "changed": as_dicts(self.changed),
+            "removed": self.removed,
+        }
+
+
+def _write_json_atomic(path: Path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def dump_record(product) -> str:
+    # یک محصول در هر خط، بدون فاصله و تورفتگی
+    return json.dumps(product, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def export_catalog(path, chunk_size: int = 2000, delta=None):
+    # خروجی all_products.jsonl برای ربات، مستقیم از دیتابیس و به‌صورت جریانی؛
+    # با جایگزینی اتمیک تا CatalogStore هیچ‌وقت فایل نیمه‌کاره نبیند.
+    # delta (در صورت وجود) قبل از جایگزینی فایل نوشته می‌شود تا CatalogStore با
+    # دیدن نسخه جدید، تغییراتش را آماده داشته باشد.
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            products = Product.objects.prefetch_related("categories").order_by("id")
+            for product in products.iterator(chunk_size=chunk_size):
+                f.write(dump_record(product.as_dict()))
+        if delta is not None:
+            # os.replace زمان و اندازه فایل را نگه می‌دارد، پس نسخه نهایی همین است
+            _write_json_atomic(delta_path(path), {
+                "base_version": source_version(path),
+                "version": source_version(Path(tmp_path)),
+                **delta,
+            })
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+# ================== خروجی JSONL بدون دیتابیس ==================
+def merge_jsonl(source, path):
+    # محصولی که در چند دسته آمده یک رکورد با همه دسته‌هایش می‌شود. دو گذر روی
+    # فایل: اول فقط لینک و نام دسته‌ها جمع می‌شود، بعد هر محصول یک بار نوشته می‌شود.
+    path = Path(path)
+    categories = {}
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            names = categories.setdefault(item["link"], [])
+            names.extend(c for c in item["categories"] if c not in names)
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with open(source, "r", encoding="utf-8") as f, os.fdopen(fd, "w", encoding="utf-8") as out:
+            for line in f:
+                item = json.loads(line)
+                names = categories.pop(item["link"], None)
+                if names is None:
+                    continue
+                item["categories"] = names
+                item["category_ids"] = [category_id(name) for name in names]
+                out.write(dump_record(item))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class JsonlSink:
+    # هر صفحه به محض رسیدن، یک رکورد فشرده در هر خط، به فایل .partial اضافه
+    # می‌شود؛ حافظه با اندازه کاتالوگ رشد نمی‌کند و crash فقط صفحه‌های در حال
+    # دریافت را از دست می‌دهد. finalize() تکراری‌ها را ادغام و فایل نهایی را اتمیک جایگزین می‌کند.
+    def __init__(self, path, append: bool = False):
+        self.path = Path(path)
+        self.partial_path = self.path.with_name(self.path.name + ".partial")
+        # append: ادامه اسکرپ قطع‌شده؛ رکوردهای تکراری در finalize ادغام می‌شوند. اگر
+        # دور قبل تا finalize رسیده باشد، صفحه‌های تمام‌شده‌اش در خود خروجی‌اند.
+        if append and not self.partial_path.exists() and self.path.exists():
+            shutil.copyfile(self.path, self.partial_path)
+        self._file = open(self.partial_path, "a" if append else "w", encoding="utf-8")
+        self.written = 0
+
+    def category_done(self, name: str, unchanged_links, complete: bool):
+        pass
+
+    def write(self, products, category_url: str = ""):
+        self._file.writelines(dump_record(p) for p in products)
+        self._file.flush()
+        self.written += len(products)
+
+    def finalize(self):
+        self._file.close()
+        merge_jsonl(self.partial_path, self.path)
+        os.unlink(self.partial_path)
@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import aclosing, asynccontextmanager, contextmanager
+
+from .admission import AdmissionController
+from .metrics import llm_calls, llm_circuit_open, llm_coalesced, llm_inflight
+
+# ================== دروازه LLM ==================
+# همه فراخوانی‌های مدل از اینجا رد می‌شوند:
+# - درخواست‌های هم‌زمان با پیام‌های یکسان یک فراخوانی بالادستی مشترک دارند؛ در
+#   stream هر مشترک تازه chunkهای قبلی را یکجا و بقیه را همراه بقیه می‌گیرد.
+# - مهلت اولین توکن و مهلت کل پاسخ؛ بعد از آن، و با قطع اتصال یا 5xx از API،
+#   LLMUnavailable.
+# - circuit breaker: بعد از چند خطای پشت سر هم، تا مدتی بدون تماس با API فوراً
+#   LLMUnavailable می‌دهد تا ویو پاسخ جایگزین برگرداند و درخواست‌ها پشت یک API
+#   کند صف نکشند؛ بعد از آن یک درخواست آزمایشی مدار را دوباره می‌بندد.
+# - هر فراخوانی بالادستی (نه هر درخواست مشترک در آن) یک جا از AdmissionController
+#   می‌گیرد؛ صبر در صف جزو مهلت‌های LLM حساب نمی‌شود. سهم صف هر کلاینت قبل از
+#   ساختن یا پیوستن به فراخوانی، برای خود همان درخواست بررسی می‌شود تا
+#   مشترک‌ها رد شدن کلاینت اول را به ارث نبرند؛ فقط صف پر و مهلت صف، که مال خود
+#   فراخوانی است، به همه مشترک‌ها می‌رسد.
+# state در حافظه همین پروسه است؛ با چند worker هر worker مدار خودش را دارد.
+
+
+class LLMUnavailable(Exception):
+    pass
+
+
+def make_chat_model(model: str, base_url: str, api_key: str, max_connections: int = 100,
+                    connect_timeout: float = 5.0, deadline: float = 60.0, max_retries: int = 1):
+    # یک connection pool مشترک با keep-alive برای همه درخواست‌های این پروسه؛
+    # پیش‌فرض کلاینت openai مهلت ۱۰ دقیقه و ۲ بار تلاش دوباره است.
+    # import اینجاست چون langchain_openai/openai نزدیک یک ثانیه import می‌خواهند و
+    # دستورهای مدیریتی (migrate، اسکرپر، ...) که views را import می‌کنند لازمش ندارند.
+    import httpx
+    from langchain_openai import ChatOpenAI
+
+    timeout = httpx.Timeout(deadline, connect=connect_timeout)
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=timeout,
+    )
+    return ChatOpenAI(
+        model=model,
+        base_url=base_url,
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=max_retries,
+        http_async_client=client,
+    )
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    # مهلت، قطع اتصال، 5xx و 429 یعنی API در دسترس نیست؛ خطای 4xx (مثلاً پرامپت
+    # بیش از حد طولانی) مشکل درخواست است، نه سلامت API.
+    # openai اگر خطا از کلاینتش آمده باشد قبلاً import شده است.
+    import openai
+
+    if isinstance(error, openai.APIConnectionError):  # APITimeoutError هم زیرکلاس همین است
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code == 429
+    return False
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown  # ثانیه باز ماندن مدار قبل از درخواست آزمایشی
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        llm_circuit_open.set(0)
+
+    def failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            llm_circuit_open.set(1)
+
+    def release(self):
+        # فراخوانی لغو شد (کلاینت رفت)؛ نه موفقیت حساب می‌شود نه خطا
+        self._probing = False
+
+
+class _SharedStream:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def close(self, error=None):
+        self.error = error
+        self.done = True
+        self._notify()
+
+    async def follow(self):
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class LLMGateway:
+    def __init__(self, llm=None, first_token_timeout: float = 20.0, deadline: float = 60.0,
+                 breaker: CircuitBreaker = None, admission: AdmissionController = None, factory=None):
+        # بدون llm، مدل با factory() در اولین فراخوانی ساخته می‌شود
+        self._llm = llm
+        self.factory = factory
+        self.first_token_timeout = first_token_timeout
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+        self.admission = admission
+        self._inflight = {}
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = self.factory()
+        return self._llm
+
+    @llm.setter
+    def llm(self, value):
+        self._llm = value
+
+    def key(self, kind: str, messages):
+        # taskها به event loop خودشان وابسته‌اند
+        payload = json.dumps([(m.type, m.content) for m in messages], ensure_ascii=False)
+        return kind, id(asyncio.get_running_loop()), hashlib.sha1(payload.encode()).hexdigest()
+
+    def _admit(self, kind: str):
+        if not self.breaker.allow():
+            llm_calls.inc(kind=kind, outcome="rejected")
+            raise LLMUnavailable("LLM circuit is open")
+
+    def _check(self, client: str):
+        if self.admission is not None:
+            self.admission.check(client)
+
+    def _join(self, kind: str, info):
+        llm_coalesced.inc(kind=kind)
+        if info is not None:
+            info["coalesced"] = True
+
+    @asynccontextmanager
+    async def _slot(self, client: str):
+        if self.admission is None:
+            yield
+            return
+        try:
+            # سهم صف کلاینت را _check در خود درخواست بررسی کرده است
+            await self.admission.acquire(client, check_client=False)
+        except BaseException:
+            # درخواست آزمایشی مدار که اصلاً به API نرسید
+            self.breaker.release()
+            raise
+        try:
+            yield
+        finally:
+            self.admission.release()
+
+    @contextmanager
+    def _upstream(self, kind: str):
+        llm_inflight.inc()
+        try:
+            yield
+        except TimeoutError:
+            llm_calls.inc(kind=kind, outcome="timeout")
+            self.breaker.failure()
+            raise LLMUnavailable("LLM deadline exceeded") from None
+        except Exception as e:
+            llm_calls.inc(kind=kind, outcome="error")
+            if not is_upstream_failure(e):
+                self.breaker.release()
+                raise
+            # کاربر به‌جای پیام خطا پاسخ جایگزین می‌گیرد
+            self.breaker.failure()
+            raise LLMUnavailable(f"LLM upstream failed: {e}") from e
+        except BaseException:
+            self.breaker.release()
+            raise
+        else:
+            llm_calls.inc(kind=kind, outcome="ok")
+            self.breaker.success()
+        finally:
+            llm_inflight.dec()
+
+    async def ainvoke(self, messages, info=None, client: str = ""):
+        key = self.key("invoke", messages)
+        self._check(client)
+        task = self._inflight.get(key)
+        if task is None:
+            self._admit("invoke")
+            task = self._inflight[key] = asyncio.ensure_future(self._invoke(messages, client))
+            task.add_done_callback(lambda t: self._finished(key, t))
+        else:
+            self._join("invoke", info)
+        # shield: لغو شدن یک منتظر، فراخوانی مشترک بقیه را لغو نمی‌کند
+        return await asyncio.shield(task)
+
+    async def _invoke(self, messages, client: str):
+        async with self._slot(client):
+            with self._upstream("invoke"):
+                async with asyncio.timeout(self.deadline):
+                    return await self.llm.ainvoke(messages)
+
+    def _finished(self, key, task):
+        self._inflight.pop(key, None)
+        # اگر همه منتظرها رفته باشند، خطا همین‌جا خوانده می‌شود تا asyncio هشدار ندهد
+        if not task.cancelled():
+            task.exception()
+
+    async def astream(self, messages, info=None, client: str = ""):
+        key = self.key("stream", messages)
+        self._check(client)
+        shared = self._inflight.get(key)
+        if shared is None:
+            self._admit("stream")
+            shared = self._inflight[key] = _SharedStream()
+            shared.task = asyncio.ensure_future(self._produce(key, shared, messages, client))
+        else:
+            self._join("stream", info)
+        shared.subscribers += 1
+        try:
+            async for chunk in shared.follow():
+                yield chunk
+        finally:
+            shared.subscribers -= 1
+            if not shared.subscribers and not shared.done:
+                # آخرین کلاینت هم قطع شد؛ stream بالادستی بسته می‌شود
+                if self._inflight.get(key) is shared:
+                    del self._inflight[key]
+                shared.task.cancel()
+
+    async def _produce(self, key, shared: _SharedStream, messages, client: str):
+        error = None
+        try:
+            async with self._slot(client):
+                with self._upstream("stream"):
+                    async with asyncio.timeout(self.deadline):
+                        async with asyncio.timeout(self.first_token_timeout) as first_token:
+                            async with aclosing(self.llm.astream(messages)) as stream:
+                                async for chunk in stream:
+                                    if chunk.content:
+                                        first_token.reschedule(None)
+                                    shared.publish(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            if self._inflight.get(key) is shared:
+                del self._inflight[key]
+            shared.close(error)
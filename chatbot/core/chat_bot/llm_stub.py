@@ -0,0 +1,141 @@
+import json
+import multiprocessing
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ================== LLM ساختگی سازگار با OpenAI ==================
+# برای بنچمارک و پروفایل سربار خود ما بدون API واقعی: POST /v1/chat/completions
+# را با تاخیر اولین توکن (ttft) و سرعت توکن قابل تنظیم جواب می‌دهد، هم معمولی
+# و هم stream (SSE با chunkهای chat.completion.chunk و [DONE]).
+_REPLY = [
+    "## ", "پیشنهاد ", "ما\n\n",
+    "برای ", "این ", "نیاز ", "این ", "محصولات ", "**مناسب** ", "هستند:\n\n",
+    "- ", "[30796] ", "با ", "ظرفیت ", "۲۵۶ ", "گیگ ", "— ", "۱,۷۰۰,۰۰۰ ", "تومان\n",
+    "- ", "[30793] ", "برای ", "حجم ", "بیشتر ", "— ", "۵,۰۵۰,۰۰۰ ", "تومان\n\n",
+    "اگر ", "سوال ", "دیگری ", "دارید، ", "در ", "خدمتتونم.\n\n",
+]
+
+
+class LLMStub:
+    def __init__(self, ttft: float = 0.5, tokens_per_sec: float = 50.0, reply_tokens: int = 120):
+        self.ttft = ttft  # ثانیه تا اولین توکن
+        self.tokens_per_sec = tokens_per_sec  # 0 یعنی بدون تاخیر بین توکن‌ها
+        self.reply_tokens = reply_tokens
+
+    def tokens(self):
+        # متن markdown (سرتیتر، لیست، شناسه محصول) تا رندر markdown و expand_refs هم اندازه گرفته شوند
+        return [_REPLY[i % len(_REPLY)] for i in range(self.reply_tokens)]
+
+    def token_delay(self) -> float:
+        return 1 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+
+class LLMStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive، مثل API واقعی
+    stub = None
+
+    def do_POST(self):
+        try:
+            self._handle_post()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # کلاینت قبل از تمام شدن پاسخ رفته (مثلاً مهلتش گذشته)
+
+    def _handle_post(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        model = body.get("model", "stub")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        time.sleep(self.stub.ttft)
+        if body.get("stream"):
+            self._stream(completion_id, model)
+        else:
+            tokens = self.stub.tokens()
+            time.sleep(self.stub.token_delay() * len(tokens))
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+    def _stream(self, completion_id: str, model: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        self._write_event(chunk({"role": "assistant", "content": ""}))
+        delay = self.stub.token_delay()
+        for i, token in enumerate(self.stub.tokens()):
+            if i and delay:
+                time.sleep(delay)
+            self._write_event(chunk({"content": token}))
+        self._write_event(chunk({}, "stop"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_event(self, data):
+        self._write_chunk(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, data):
+        payload = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_llm_stub(stub: LLMStub, host: str = "127.0.0.1", port: int = 0):
+    # server.base_url همان چیزی است که در API_URL گذاشته می‌شود (با /v1)
+    handler = type("Handler", (LLMStubHandler,), {"stub": stub})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.base_url = f"http://{host}:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _serve_in_child(stub: LLMStub, host: str, port: int, conn):
+    server = start_llm_stub(stub, host, port)
+    conn.send(server.base_url)
+    conn.close()
+    while True:
+        time.sleep(3600)
+
+
+def start_llm_stub_process(stub: LLMStub, host: str = "127.0.0.1", port: int = 0):
+    # در پروسه جدا تا sleepها و JSON سازی stub با سرور چت سر GIL رقابت نکنند
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context("fork").Process(
+        target=_serve_in_child, args=(stub, host, port, child_conn), daemon=True,
+    )
+    process.start()
+    process.base_url = parent_conn.recv()
+    return process
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import multiprocessing
+import resource
+import socket
+import time
+import httpx
+from django.core.management.base import BaseCommand
+
+from chat_bot.llm_stub import LLMStub, start_llm_stub_process
+from chat_bot.management.commands.bench_scrape import percentile
+
+QUESTIONS = [
+    "یک لپ تاپ مناسب برنامه نویسی معرفی کن",
+    "قیمت هارد اکسترنال وسترن دیجیتال چقدر است؟",
+    "گوشی سامسونگ زیر ۲۰ میلیون دارید؟",
+    "برای گیمینگ چه مانیتوری پیشنهاد می‌دهید؟",
+]
+
+
+def free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def _serve_chat(host: str, port: int, llm_url: str):
+    # پروسه فرزند: همان اپ ASGI پروژه، فقط llm به stub وصل می‌شود
+    import logging
+    import uvicorn
+    from chat_bot import views
+    from chat_bot.llm_gateway import make_chat_model
+    from core.asgi import application
+
+    views.llm_gateway.llm = make_chat_model(
+        views.MODEL_NAME, llm_url, "stub",
+        max_connections=views.LLM_MAX_CONNECTIONS,
+        connect_timeout=views.LLM_CONNECT_TIMEOUT,
+        deadline=views.LLM_DEADLINE,
+        max_retries=views.LLM_MAX_RETRIES,
+    )
+    # لاگ JSON هر درخواست خروجی بنچمارک را شلوغ می‌کند
+    logging.getLogger("chat_bot.requests").setLevel(logging.WARNING)
+    uvicorn.Server(uvicorn.Config(application, host=host, port=port, log_level="warning", lifespan="off")).run()
+
+
+def start_chat_process(llm_url: str, host: str = "127.0.0.1"):
+    port = free_port(host)
+    process = multiprocessing.get_context("fork").Process(
+        target=_serve_chat, args=(host, port, llm_url), daemon=True,
+    )
+    process.start()
+    process.base_url = f"http://{host}:{port}"
+    return process
+
+
+async def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.perf_counter() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+async def llm_counters(url: str):
+    # شمارنده‌های دروازه LLM از /metrics سرور: {"ok": ..., "timeout": ..., "coalesced": ..., "busy": ...}
+    counters = {}
+    async with httpx.AsyncClient(base_url=url) as client:
+        response = await client.get("/metrics")
+    for line in response.text.splitlines():
+        name, _, value = line.rpartition(" ")
+        if name.startswith("chat_llm_calls_total"):
+            key = name.partition('outcome="')[2].partition('"')[0]
+        elif name.startswith("chat_llm_coalesced_total"):
+            key = "coalesced"
+        elif name.startswith("chat_admission_rejected_total"):
+            key = "busy"
+        else:
+            continue
+        counters[key] = counters.get(key, 0) + float(value)
+    return counters
+
+
+def parse_server_timing(header: str):
+    timings = {}
+    for part in header.split(","):
+        name, _, value = part.strip().partition(";dur=")
+        if name and value:
+            timings[name] = float(value)
+    return timings
+
+
+async def sync_request(client, question: str):
+    start = time.perf_counter()
+    response = await client.post("/", data={"user_input": question}, headers={"X-CSRFToken": client.cookies["csrftoken"]})
+    response.raise_for_status()
+    elapsed = time.perf_counter() - start
+    # در حالت sync اولین بایت همان کل پاسخ است
+    return elapsed, elapsed, parse_server_timing(response.headers.get("Server-Timing", ""))
+
+
+async def stream_request(client, question: str):
+    start = time.perf_counter()
+    ttft = None
+    timings = {}
+    event = None
+    async with client.stream(
+        "POST", "/stream/", data={"user_input": question}, headers={"X-CSRFToken": client.cookies["csrftoken"]},
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                if event in ("token", "block") and ttft is None:
+                    ttft = time.perf_counter() - start
+                elif event == "error":
+                    raise RuntimeError(json.loads(line[len("data: "):])["html"])
+                elif event == "done":
+                    timings = json.loads(line[len("data: "):]).get("timings", {})
+    elapsed = time.perf_counter() - start
+    return elapsed, ttft if ttft is not None else elapsed, timings
+
+
+async def virtual_user(url: str, mode: str, user: int, requests: int, same_question: bool, results):
+    send = stream_request if mode == "stream" else sync_request
+    async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+        # کوکی csrftoken (و بعداً session) مثل مرورگر
+        (await client.get("/")).raise_for_status()
+        for i in range(requests):
+            question = QUESTIONS[(user + i) % len(QUESTIONS)]
+            if not same_question:
+                # سوال یکتا تا هر درخواست واقعاً به LLM برسد و از کش جواب داده نشود
+                question = f"{question} ({mode} {user}-{i})"
+            try:
+                results.append(await send(client, question))
+            except (httpx.HTTPError, RuntimeError) as e:
+                results.append(e)
+
+
+async def run_mode(url: str, mode: str, users: int, requests: int, same_question: bool):
+    # یک درخواست گرم‌کردن (ساخت snapshot کاتالوگ، tiktoken، ...) جزو نتایج نیست
+    await virtual_user(url, mode, -1, 1, same_question, [])
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(virtual_user(url, mode, user, requests, same_question, results) for user in range(users)))
+    return time.perf_counter() - start, results
+
+
+class Command(BaseCommand):
+    help = "Load-test ChatView and ChatStreamView against a local LLM stub (rps, TTFT, server-side stage timings)"
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=["sync", "stream", "both"], default="both")
+        parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+        parser.add_argument("--requests", type=int, default=5, help="requests per user")
+        parser.add_argument("--same-question", action="store_true", help="let the response cache answer repeats")
+        parser.add_argument("--ttft", type=float, default=0.5, help="stub seconds before the first token")
+        parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+        parser.add_argument("--reply-tokens", type=int, default=120)
+        parser.add_argument("--url", help="benchmark an already running chat server instead of starting one")
+        parser.add_argument("--llm-url", help="use this OpenAI-compatible API instead of starting the stub")
+
+    def handle(self, *args, mode, users, requests, same_question, ttft, tokens_per_sec, reply_tokens,
+               url, llm_url, **kwargs):
+        processes = []
+        llm = llm_url or "the running server's API_URL"
+        if url is None:
+            if llm_url is None:
+                stub = start_llm_stub_process(LLMStub(ttft, tokens_per_sec, reply_tokens))
+                processes.append(stub)
+                llm_url = stub.base_url
+                llm = f"stub (ttft {ttft}s, {tokens_per_sec} tokens/s, {reply_tokens} tokens)"
+            server = start_chat_process(llm_url)
+            processes.append(server)
+            url = server.base_url
+        self.stdout.write(f"{url}, {users} users x {requests} requests, LLM {llm}")
+        try:
+            asyncio.run(wait_until_up(url))
+            for current in (["sync", "stream"] if mode == "both" else [mode]):
+                before = asyncio.run(llm_counters(url))
+                elapsed, results = asyncio.run(run_mode(url, current, users, requests, same_question))
+                after = asyncio.run(llm_counters(url))
+                self.report(current, elapsed, results)
+                self.report_llm({key: int(value - before.get(key, 0)) for key, value in after.items()})
+        finally:
+            for process in processes:
+                process.terminate()
+
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        if processes:
+            self.stdout.write(f"peak RSS: {children:.0f} MB largest child process (chat server / LLM stub)")
+
+    def report_llm(self, counters):
+        # شامل درخواست گرم‌کردن هم هست
+        calls = ", ".join(f"{counters.get(key, 0)} {key}" for key in ("ok", "error", "timeout", "rejected"))
+        self.stdout.write(
+            f"  upstream LLM calls: {calls}; {counters.get('coalesced', 0)} requests shared a call, "
+            f"{counters.get('busy', 0)} got a busy reply"
+        )
+
+    def report(self, mode, elapsed, results):
+        ok = [r for r in results if not isinstance(r, Exception)]
+        errors = [r for r in results if isinstance(r, Exception)]
+        latencies = [r[0] for r in ok]
+        ttfts = [r[1] for r in ok]
+        self.stdout.write(
+            f"{mode}: {len(ok) / elapsed:.1f} req/s, latency p50 {percentile(latencies, 0.5) * 1000:.0f} ms / "
+            f"p95 {percentile(latencies, 0.95) * 1000:.0f} ms, TTFT p50 {percentile(ttfts, 0.5) * 1000:.0f} ms / "
+            f"p95 {percentile(ttfts, 0.95) * 1000:.0f} ms, {len(errors)} failed of {len(results)}"
+        )
+        if errors:
+            self.stdout.write(f"  first error: {errors[0]!r}")
+        stages = {}
+        for _, _, timings in ok:
+            for name, ms in timings.items():
+                stages.setdefault(name, []).append(ms)
+        for name, values in stages.items():
+            self.stdout.write(
+                f"  {name:>10}: mean {sum(values) / len(values):8.2f} ms, p95 {percentile(values, 0.95):8.2f} ms"
+            )
@@ -0,0 +1,55 @@
+import asyncio
+import time
+from playwright.async_api import async_playwright
+from django.core.management.base import BaseCommand
+
+from chat_bot.crawler.extract import EXTRACTORS, extract_products
+from chat_bot.crawler.fixtures import listing_html
+
+
+async def bench_mode(page, mode, repeat):
+    wall = []
+    cpu = []
+    products = None
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        products = await extract_products(page, "fixture", "bench", mode)
+        cpu.append(time.process_time() - cpu_start)
+        wall.append(time.perf_counter() - wall_start)
+    wall.sort()
+    return {
+        "median_ms": wall[len(wall) // 2] * 1000,
+        "cpu_ms": sum(cpu) / len(cpu) * 1000,
+        "products": products,
+    }
+
+
+async def run(cards, repeat):
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        page = await browser.new_page()
+        await page.set_content(listing_html("category-bench", 1, per_page=cards))
+        results = {mode: await bench_mode(page, mode, repeat) for mode in EXTRACTORS}
+        await browser.close()
+    return results
+
+
+class Command(BaseCommand):
+    help = "Benchmark single-evaluate vs per-element product extraction on a synthetic listing page"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cards", type=int, default=48, help="product cards on the page")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, cards, repeat, **kwargs):
+        results = asyncio.run(run(cards, repeat))
+        baseline = results["per-element"]
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:>12}: {result['median_ms']:8.2f} ms/page (median), "
+                f"{result['cpu_ms']:8.2f} ms python CPU/page, "
+                f"{len(result['products'])} products, "
+                f"{baseline['median_ms'] / result['median_ms']:.1f}x vs per-element"
+            )
+        if results["evaluate"]["products"] != baseline["products"]:
+            self.stderr.write("extraction modes returned different products")
@@ -0,0 +1,170 @@
+import asyncio
+import contextlib
+import io
+import resource
+import tempfile
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from chat_bot.crawler.crawl import PAGE_RETRIES, make_limiter, scrape_site
+from chat_bot.crawler.fixtures import FixtureSite, start_fixture_process
+from chat_bot.crawler.results import PageError
+from chat_bot.ingest import JsonlSink, ProductSink
+from chat_bot.management.commands.scraper import browser_options, make_backend
+
+
+class TimedBackend:
+    # زمان هر صفحه فهرست را ثبت می‌کند و بقیه کار را به backend اصلی می‌سپارد
+    def __init__(self, backend):
+        self.backend = backend
+        self.latencies = []
+        self.failures = 0
+
+    async def categories(self):
+        try:
+            return await self.backend.categories()
+        except Exception:
+            self.failures += 1
+            raise
+
+    async def listing(self, category_url, page_num, category_name):
+        start = time.perf_counter()
+        try:
+            return await self.backend.listing(category_url, page_num, category_name)
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+class NullSink:
+    # فقط شمارش؛ برای جدا کردن هزینه خزیدن از هزینه ذخیره
+    written = 0
+
+    def write(self, products, category_url: str = ""):
+        self.written += len(products)
+
+    def category_done(self, name: str, unchanged_links, complete: bool):
+        pass
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(q * (len(values) - 1)))]
+
+
+@contextlib.contextmanager
+def throwaway_database(directory):
+    # محصولات ساختگی نباید به دیتابیس اصلی (و از آنجا به all_products.jsonl و
+    # پرامپت ربات) برسند؛ مثل تست‌ها یک دیتابیس موقت با همان migrationها ساخته
+    # و بعد از بنچمارک حذف می‌شود
+    connection.settings_dict.setdefault("TEST", {})["NAME"] = str(Path(directory) / "bench.sqlite3")
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def make_sink(name, directory):
+    if name == "jsonl":
+        return JsonlSink(Path(directory) / "all_products.jsonl")
+    if name == "db":
+        return ProductSink()
+    return NullSink()
+
+
+async def run_once(backend_name, base_url, sink, concurrency, adaptive, max_page, retries, browsers):
+    limiter = make_limiter(concurrency, adaptive)
+    options = browser_options(base_url, True, [], [], None, browsers)
+    max_connections = int(getattr(limiter, "maximum", concurrency))
+    start = time.perf_counter()
+    async with make_backend(backend_name, base_url, options=options, max_connections=max_connections) as backend:
+        timed = TimedBackend(backend)
+        await scrape_site(timed, sink, concurrency, max_page, retries=retries, limiter=limiter)
+    if isinstance(sink, JsonlSink):
+        await asyncio.to_thread(sink.finalize)
+    elapsed = time.perf_counter() - start
+    return {
+        "elapsed": elapsed,
+        "pages": len(timed.latencies),
+        "failures": timed.failures,
+        "products": sink.written,
+        "p50": percentile(timed.latencies, 0.50),
+        "p95": percentile(timed.latencies, 0.95),
+        "limiter": limiter.summary(),
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark scrape_site end-to-end against a local fixture site (pages/sec, products/sec, RSS, latency)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backend", choices=["http", "browser"], default="http")
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--pages", type=int, default=8, help="non-empty pages per category")
+        parser.add_argument("--per-page", type=int, default=24)
+        parser.add_argument("--directory", help="serve saved pages instead of synthetic ones")
+        parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+        parser.add_argument("--jitter", type=float, default=0.02)
+        parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with 503")
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--fixed-concurrency", action="store_true")
+        parser.add_argument("--retries", type=int, default=PAGE_RETRIES)
+        parser.add_argument("--browsers", type=int, default=1)
+        parser.add_argument(
+            "--sink", choices=["null", "jsonl", "db"], default="jsonl",
+            help="null: count only; jsonl: temp file incl. final merge; db: a throwaway database with the app's schema",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--verbose", action="store_true", help="show the crawler's own output")
+
+    def handle(self, *args, backend, categories, pages, per_page, directory, latency, jitter, failure_rate,
+               concurrency, fixed_concurrency, retries, browsers, sink, repeat, verbose, **kwargs):
+        site = FixtureSite(categories, pages, per_page, directory, latency, jitter, failure_rate)
+        server = start_fixture_process(site)
+        self.stdout.write(
+            f"{backend} backend, {categories} categories x {pages} pages x {per_page} cards, "
+            f"latency {latency}s±{jitter}s, failure rate {failure_rate:.0%}, sink {sink}"
+        )
+        try:
+            with contextlib.ExitStack() as stack:
+                if sink == "db":
+                    stack.enter_context(throwaway_database(stack.enter_context(tempfile.TemporaryDirectory())))
+                self.run_all(backend, server.base_url, sink, concurrency, fixed_concurrency, pages, retries,
+                             browsers, repeat, verbose)
+        finally:
+            server.terminate()
+
+        # ru_maxrss روی لینوکس به کیلوبایت است؛ سرور نمونه و مرورگر جزو children حساب می‌شوند
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        self.stdout.write(f"peak RSS: {own:.0f} MB crawler, {children:.0f} MB largest child process (fixture server / browser)")
+
+    def run_all(self, backend, base_url, sink, concurrency, fixed_concurrency, pages, retries, browsers, repeat,
+                verbose):
+        for i in range(repeat):
+            with tempfile.TemporaryDirectory() as tmp:
+                output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+                try:
+                    with output:
+                        result = asyncio.run(run_once(
+                            backend, base_url, make_sink(sink, tmp), concurrency,
+                            not fixed_concurrency, pages + 1, retries, browsers,
+                        ))
+                except PageError as e:
+                    # صفحه اصلی بعد از همه تلاش‌ها هم نیامد
+                    self.stdout.write(f"run {i + 1}: crawl failed: {e}")
+                    continue
+            self.stdout.write(
+                f"run {i + 1}: {result['elapsed']:.2f}s, "
+                f"{result['pages'] / result['elapsed']:.1f} pages/s, "
+                f"{result['products'] / result['elapsed']:.0f} products/s, "
+                f"page latency p50 {result['p50'] * 1000:.0f} ms / p95 {result['p95'] * 1000:.0f} ms, "
+                f"{result['failures']} failed requests, {result['limiter']}"
+            )
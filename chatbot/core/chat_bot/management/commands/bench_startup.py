@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from chat_bot.llm_stub import LLMStub, start_llm_stub_process
+from chat_bot.management.commands.bench_chat import free_port, percentile, virtual_user, wait_until_up
+
+BASE_DIR = Path(__file__).resolve().parents[3]  # پوشه manage.py و gunicorn.conf.py
+
+# پروسه تازه: زمان django.setup و هر مرحله warm_up، و RSS بعد از آن
+COLD_START = """
+import json, resource, time
+start = time.perf_counter()
+import django
+django.setup()
+timings = {"django": time.perf_counter() - start}
+from chat_bot.warmup import warm_up
+timings.update(warm_up())
+print(json.dumps({"timings": timings, "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def cold_start():
+    output = subprocess.run(
+        [sys.executable, "-c", COLD_START], cwd=BASE_DIR, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def memory_mb(pid: int):
+    # Pss حافظه مشترک (copy-on-write) را بین پروسه‌ها تقسیم می‌کند؛ جمعش حافظه واقعی است
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss"):
+                values[name.lower()] = int(rest.split()[0]) / 1024
+    return values
+
+
+def child_pids(pid: int):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def start_gunicorn(port: int, workers: int, preload: bool, llm_url: str, log):
+    env = {
+        **os.environ,
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+        "WEB_CONCURRENCY": str(workers),
+        "GUNICORN_PRELOAD": str(preload),
+        "API_URL": llm_url,
+        "API_KEY": "stub",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "core.asgi:application", "--access-logfile", os.devnull],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log,
+    )
+
+
+async def wait_for_server(url: str, server, timeout: float = 120.0):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            return await wait_until_up(url, timeout=0.5)
+        except Exception:
+            if server.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with code {server.returncode}") from None
+            if time.perf_counter() > deadline:
+                raise
+
+
+async def first_chats(url: str, users: int):
+    # یک سوال برای هر کاربر مجازی؛ worker تازه بدون preload اینجا کاتالوگ و tiktoken را بار می‌کند
+    results = []
+    await asyncio.gather(*(virtual_user(url, "sync", user, 1, False, results) for user in range(users)))
+    return results
+
+
+class Command(BaseCommand):
+    help = "Measure cold start: warm-up cost of a fresh process, and gunicorn boot time and worker memory with/without preload_app"
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--users", type=int, default=0, help="chat requests after boot (default 3 per worker)")
+        parser.add_argument("--no-gunicorn", action="store_true", help="only measure a single cold process")
+
+    def handle(self, *args, workers, users, no_gunicorn, **kwargs):
+        cold = cold_start()
+        steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in cold["timings"].items())
+        self.stdout.write(f"cold process: {steps}; total {sum(cold['timings'].values()):.2f} s, "
+                          f"peak RSS {cold['rss_mb']:.0f} MB")
+        if no_gunicorn:
+            return
+
+        stub = start_llm_stub_process(LLMStub(ttft=0.05, tokens_per_sec=0, reply_tokens=60))
+        try:
+            for preload in (False, True):
+                self.run_gunicorn(workers, users or 3 * workers, preload, stub.base_url)
+        finally:
+            stub.terminate()
+
+    def run_gunicorn(self, workers: int, users: int, preload: bool, llm_url: str):
+        port = free_port("127.0.0.1")
+        url = f"http://127.0.0.1:{port}"
+        # لاگ gunicorn (و لاگ JSON درخواست‌ها) فقط اگر چیزی خراب شد چاپ می‌شود
+        with tempfile.TemporaryFile("w+") as log:
+            start = time.perf_counter()
+            server = start_gunicorn(port, workers, preload, llm_url, log)
+            try:
+                asyncio.run(wait_for_server(url, server))
+                boot = time.perf_counter() - start
+                results = asyncio.run(first_chats(url, users))
+                master = memory_mb(server.pid)
+                worker_memory = [memory_mb(pid) for pid in child_pids(server.pid)]
+            except Exception:
+                log.seek(0)
+                self.stderr.write(log.read()[-4000:])
+                raise
+            finally:
+                server.terminate()
+                server.wait()
+
+        latencies = [r[0] for r in results if not isinstance(r, Exception)]
+        failed = len(results) - len(latencies)
+
+        self.stdout.write(
+            f"gunicorn preload_app={preload}, {workers} workers: first response after {boot:.2f} s; "
+            f"first chats p50 {percentile(latencies, 0.5) * 1000:.0f} ms / max {max(latencies, default=0) * 1000:.0f} ms"
+            f"{f', {failed} failed' if failed else ''}"
+        )
+        rss = [m["rss"] for m in worker_memory]
+        pss = [m["pss"] for m in worker_memory]
+        self.stdout.write(
+            f"  per worker: RSS {sum(rss) / len(rss):.0f} MB, PSS {sum(pss) / len(pss):.0f} MB; "
+            f"master RSS {master['rss']:.0f} MB; total PSS {sum(pss) + master['pss']:.0f} MB"
+        )
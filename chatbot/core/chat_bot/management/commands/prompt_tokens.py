@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from chat_bot import views
+from chat_bot.prompts import SYSTEM_PROMPT_TAIL, get_encoding, product_line
+
+QUESTIONS = [
+    "یک لپ تاپ مناسب برنامه نویسی معرفی کن",
+    "قیمت هارد اکسترنال وسترن دیجیتال چقدر است؟",
+    "گوشی سامسونگ زیر ۲۰ میلیون دارید؟",
+    "حافظه SSD بین ۲ تا ۴ میلیون",
+    "برای گیمینگ چه مانیتوری پیشنهاد می‌دهید؟",
+]
+
+
+def legacy_prompt(catalog, product_ids, target_web: str) -> str:
+    # قالب قبلی: هر محصول یک سطر با «(قیمت: … تومان) | لینک: https://…»
+    lines = "".join(product_line(p, target_web) + "\n" for p in catalog.products(product_ids))
+    return catalog.prompt.head + lines + SYSTEM_PROMPT_TAIL
+
+
+class Command(BaseCommand):
+    help = "Compare system prompt tokens of the compact catalog encoding with the old one-line-per-product format"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--question", action="append", help="repeatable; defaults to a few sample questions")
+        parser.add_argument("--full", action="store_true", help="also measure the whole catalog in one prompt")
+
+    def handle(self, *args, question, full, **kwargs):
+        catalog = views.catalog_store.get()
+        encoding = get_encoding(views.MODEL_NAME)
+        cases = [(q, views.select_products(catalog, q)) for q in question or QUESTIONS]
+        if full:
+            cases.append(("(whole catalog)", None))
+
+        self.stdout.write(f"{len(catalog)} products in the catalog, model {views.MODEL_NAME}")
+        total_old = total_new = 0
+        for text, product_ids in cases:
+            old = len(encoding.encode(legacy_prompt(catalog, product_ids, views.TARGET_WEB)))
+            new = len(encoding.encode(catalog.prompt.render(product_ids)))
+            total_old += old
+            total_new += new
+            count = len(catalog) if product_ids is None else len(product_ids)
+            self.stdout.write(
+                f"{old:7d} -> {new:6d} tokens ({old - new:6d} saved, {old / new:4.1f}x), {count:4d} products: {text}"
+            )
+        self.stdout.write(
+            f"average per request: {total_old / len(cases):.0f} -> {total_new / len(cases):.0f} tokens, "
+            f"{(total_old - total_new) / len(cases):.0f} saved ({total_old / total_new:.1f}x fewer)"
+        )
@@ -1,112 +1,130 @@
 import asyncio
-import json
-from playwright.async_api import async_playwright, TimeoutError, Error
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
-BASE_URL = "https://www.ehadish.com"
-MAX_CONCURRENT = 5
-semaphore = asyncio.Semaphore(MAX_CONCURRENT)
-MAX_PAGE = 10  # حداکثر صفحات
-
-async def scrape_category(context, category_url, category_name):
-    products = []
-    page = await context.new_page()
-    page_num = 1
-
-    while page_num <= MAX_PAGE:
-        url = f"{category_url}?page={page_num}"
-        try:
-            await page.goto(url, timeout=60000)
-            await page.wait_for_selector("div.bx-product", timeout=10000)
-        except (TimeoutError, Error):
-            print(f"Page too slow: {url}. Skipping to next category.")
-            break
-
-        product_divs = await page.query_selector_all("div.bx-product")
-        if not product_divs:
-            print(f"No products on {url}. Ending this category.")
-            break
-
-        products_in_page = []
-        for product in product_divs:
-            try:
-                title_tag = await product.query_selector("h2 a")
-                title = await title_tag.inner_text()
-                link = await title_tag.get_attribute("href")
-
-                price_tag = await product.query_selector("div.bx-price")
-                price = (await price_tag.inner_text() if price_tag else "").replace("تومان", "").strip()
-
-                if not price:  # محصول موجود نیست
-                    continue
-
-                products_in_page.append({
-                    "title": title,
-                    "link": f"{BASE_URL}{link}",
-                    "price": price,
-                    "categories": [category_name],
-                })
-            except Exception as e:
-                print(f"Failed to parse a product on {url}: {e}")
-
-        if not products_in_page:
-            print(f"No available products on {url}. Moving to next category.")
-            break
-
-        products.extend(products_in_page)
-        page_num += 1
-
-    await page.close()
-    return products
-
-async def scrape_category_with_semaphore(context, url, name):
-    async with semaphore:
-        return await scrape_category(context, url, name)
-
-async def scrape_site():
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context()
-        page = await context.new_page()
-
-        await page.goto(BASE_URL, timeout=60000)
-
-        category_links = await page.query_selector_all("a[href*='/products/category-']")
-        categories = []
-        for c in category_links:
-            href = await c.get_attribute("href")
-            text = (await c.inner_text()).strip()
-            if href and href.startswith("/products/category"):
-                categories.append((f"{BASE_URL}{href}", text))
-        await page.close()
-
-        tasks = [scrape_category_with_semaphore(context, url, name) for url, name in categories]
-        results = await asyncio.gather(*tasks)
-
-        all_products = []
-        product_index = {}
-        for products in results:
-            for p_item in products:
-                link = p_item["link"]
-                if link in product_index:
-                    idx = product_index[link]
-                    for cat in p_item["categories"]:
-                        if cat not in all_products[idx]["categories"]:
-                            all_products[idx]["categories"].append(cat)
-                else:
-                    all_products.append(p_item)
-                    product_index[link] = len(all_products) - 1
-
-        await browser.close()
-
-        with open("all_products.json", "w", encoding="utf-8") as f:
-            json.dump(all_products, f, ensure_ascii=False, indent=4)
-
-        print("All products saved to all_products.json (up to page 10).")
+from chat_bot.crawler.checkpoint import CrawlCheckpoint
+from chat_bot.crawler.crawl import MAX_CONCURRENT, MAX_PAGE, PAGE_RETRIES, make_limiter, scrape_site
+from chat_bot.crawler.extract import BASE_URL
+from chat_bot.crawler.limiter import TARGET_LATENCY
+from chat_bot.crawler.routing import ALLOWED_RESOURCE_TYPES, ResourcePolicy
+from chat_bot.crawler.state import CrawlState
+from chat_bot.ingest import DeltaSink, JsonlSink, ProductSink, export_catalog
+
+OUTPUT_PATH = settings.BASE_DIR / "all_products.jsonl"
+HTTP_CONCURRENCY = 20  # بدون مرورگر صفحه‌های بسیار بیشتری هم‌زمان جا می‌شوند
+
+
+def browser_options(base_url, block, allow_types, allow_hosts, profile_dir, processes=1):
+    policy = None
+    if block:
+        policy = ResourcePolicy(base_url, allowed_types=(*ALLOWED_RESOURCE_TYPES, *allow_types),
+                                allowed_hosts=allow_hosts)
+    return {"policy": policy, "block_resources": block, "profile_dir": profile_dir, "processes": processes}
+
+
+def make_backend(name, base_url, state=None, options=None, max_connections=HTTP_CONCURRENCY):
+    options = options or {}
+    if name == "browser":
+        from chat_bot.crawler.browser_backend import BrowserBackend
+
+        return BrowserBackend(base_url, **options)
+    from chat_bot.crawler.http_backend import HttpBackend
+
+    return HttpBackend(base_url, max_connections=max_connections, state=state, browser_options=options)
+
+
+async def run(backend_name, base_url, concurrency, max_page, sink, state=None, options=None,
+              checkpoint=None, retries=PAGE_RETRIES, resume=False, limiter=None):
+    max_connections = int(getattr(limiter, "maximum", concurrency))
+    async with make_backend(backend_name, base_url, state, options, max_connections) as backend:
+        await scrape_site(backend, sink, concurrency, max_page, state, checkpoint, retries, limiter)
+    if isinstance(sink, JsonlSink):
+        await sync_to_async(sink.finalize)()
+        print(f"Wrote {sink.written} product records to {OUTPUT_PATH.name} (up to page {max_page}).")
+        return
+    if isinstance(sink, DeltaSink):
+        delta = await sync_to_async(sink.finish)()
+        print(f"{len(delta['added'])} new, {len(delta['changed'])} changed, {len(delta['removed'])} removed products.")
+        if resume:
+            # تغییرات قبل از قطع شدن در این پروسه نیستند؛ کاتالوگ کامل بازسازی می‌شود
+            delta = None
+        elif not any(delta.values()) and OUTPUT_PATH.exists():
+            # فایل دست نمی‌خورد تا کاتالوگ و کش پاسخ‌های ربات معتبر بمانند
+            print(f"Nothing changed; {OUTPUT_PATH.name} left as is.")
+            return
+        await sync_to_async(export_catalog)(OUTPUT_PATH, delta=delta)
+    else:
+        await sync_to_async(export_catalog)(OUTPUT_PATH)
+    print(f"Upserted {sink.written} products into the database and exported {OUTPUT_PATH.name} (up to page {max_page}).")
 
 
 class Command(BaseCommand):
-    help = "Scrape products from eHadish.com and save to all_products.json"
-
-    def handle(self, *args, **kwargs):
-        asyncio.run(scrape_site())
+    help = "Scrape products from eHadish.com into the database and export all_products.jsonl"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend", choices=["http", "browser"], default="http",
+            help="http: pooled HTTP client + selectolax, Chromium only as a fallback; browser: Playwright for every page",
+        )
+        parser.add_argument("--base-url", default=BASE_URL, help="site root, e.g. a local fixture server")
+        parser.add_argument("--concurrency", type=int, default=None, help="pages fetched at the same time (starting value)")
+        parser.add_argument(
+            "--fixed-concurrency", action="store_true",
+            help="keep --concurrency constant instead of tuning it from page latency and errors (AIMD)",
+        )
+        parser.add_argument("--min-concurrency", type=int, default=1)
+        parser.add_argument("--max-concurrency", type=int, default=None, help="default: 4x --concurrency")
+        parser.add_argument(
+            "--target-latency", type=float, default=TARGET_LATENCY,
+            help="seconds per page above which the site counts as slowing down",
+        )
+        parser.add_argument("--browsers", type=int, default=1, help="Chromium processes in the browser pool")
+        parser.add_argument("--max-page", type=int, default=MAX_PAGE)
+        parser.add_argument(
+            "--resume", action="store_true",
+            help="continue an interrupted crawl: pages already saved are not fetched again",
+        )
+        parser.add_argument("--retries", type=int, default=PAGE_RETRIES, help="extra attempts per failing page")
+        parser.add_argument(
+            "--full", action="store_true",
+            help="ignore the saved crawl state: re-download every page and upsert every product, remove nothing",
+        )
+        parser.add_argument(
+            "--sink", choices=["db", "jsonl"], default="db",
+            help="db: upsert into the database, then export; jsonl: stream records straight to all_products.jsonl (always a full crawl)",
+        )
+        parser.add_argument(
+            "--no-block", action="store_true",
+            help="let the browser load images, fonts, CSS and third-party scripts",
+        )
+        parser.add_argument(
+            "--allow-resource", action="append", default=[], metavar="TYPE",
+            help="extra Playwright resource type to let through, e.g. stylesheet (repeatable)",
+        )
+        parser.add_argument(
+            "--allow-host", action="append", default=[], metavar="HOST",
+            help="third-party host the browser may load from, e.g. a CDN serving the listing JS (repeatable)",
+        )
+        parser.add_argument("--profile-dir", default=None, help="persistent browser profile (cookies, cache) to reuse across runs")
+
+    def handle(self, *args, backend, base_url, concurrency, fixed_concurrency, min_concurrency, max_concurrency,
+               target_latency, browsers, max_page, resume, retries, full, sink, no_block, allow_resource,
+               allow_host, profile_dir, **kwargs):
+        base_url = base_url.rstrip("/")
+        if concurrency is None:
+            concurrency = HTTP_CONCURRENCY if backend == "http" else MAX_CONCURRENT
+        checkpoint = CrawlCheckpoint()
+        if not resume:
+            checkpoint.reset()
+        if sink == "jsonl":
+            sink, state = JsonlSink(OUTPUT_PATH, append=resume), None
+        elif full:
+            sink, state = ProductSink(), None
+        else:
+            # پیش‌فرض: re-crawl تدریجی با درخواست شرطی و فقط اعمال تغییرات
+            sink, state = DeltaSink(), CrawlState().load()
+        options = browser_options(base_url, not no_block, allow_resource, allow_host, profile_dir, browsers)
+        limiter = make_limiter(concurrency, not fixed_concurrency, min_concurrency, max_concurrency, target_latency)
+        asyncio.run(run(backend, base_url, concurrency, max_page, sink, state, options, checkpoint, retries, resume,
+                        limiter))
@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+
+from chat_bot.crawler.fixtures import FixtureSite, start_fixture_server
+
+
+class Command(BaseCommand):
+    help = "Serve synthetic or saved ehadish.com listing pages locally for crawler testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument("--categories", type=int, default=8)
+        parser.add_argument("--pages", type=int, default=4, help="non-empty pages per category")
+        parser.add_argument("--per-page", type=int, default=24)
+        parser.add_argument("--directory", help="saved pages: index.html and <slug>/page-<n>.html")
+        parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+        parser.add_argument("--jitter", type=float, default=0.0, help="random +/- seconds around --latency")
+        parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with 503")
+
+    def handle(self, *args, port, categories, pages, per_page, directory, latency, jitter, failure_rate, **kwargs):
+        site = FixtureSite(categories, pages, per_page, directory, latency, jitter, failure_rate)
+        server = start_fixture_server(site, port=port)
+        self.stdout.write(f"Serving fixtures at {server.base_url} (run: manage.py scraper --base-url {server.base_url})")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
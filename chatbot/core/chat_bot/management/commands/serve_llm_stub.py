@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+
+from chat_bot.llm_stub import LLMStub, start_llm_stub
+
+
+class Command(BaseCommand):
+    help = "Serve a local OpenAI-compatible chat completions stub with configurable TTFT and token rate"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8002)
+        parser.add_argument("--ttft", type=float, default=0.5, help="seconds before the first token")
+        parser.add_argument("--tokens-per-sec", type=float, default=50.0, help="0 sends all tokens at once")
+        parser.add_argument("--reply-tokens", type=int, default=120)
+
+    def handle(self, *args, port, ttft, tokens_per_sec, reply_tokens, **kwargs):
+        server = start_llm_stub(LLMStub(ttft, tokens_per_sec, reply_tokens), port=port)
+        self.stdout.write(f"Serving LLM stub at {server.base_url} (run the chat server with API_URL={server.base_url})")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -0,0 +1,106 @@
+import re
+
+import markdown
+
+from .prompts import PRODUCT_REF_RE
+
+# ================== تبدیل تدریجی markdown به HTML ==================
+# markdown متن را روی خط‌های خالی به بلوک تقسیم می‌کند و هر بلوک فقط به بلوک
+# قبلی خودش نگاه می‌کند (ادامه لیست، نقل‌قول یا کد تورفته). پس وقتی بعد از یک
+# خط خالی، خطی می‌رسد که نمی‌تواند ادامه بلوک قبلی باشد، آن بلوک نهایی است و
+# می‌شود همان لحظه HTMLش را فرستاد؛ خروجی کنار هم برابر markdown.markdown روی
+# کل متن است و هر بلوک فقط یک بار پردازش می‌شود.
+# دو چیز به بلوک‌های بعدی بستگی دارد: لینک ارجاعی ([متن][id] و تعریف [id]: url)
+# و بلوک HTML خام که می‌تواند از روی خط خالی رد شود. از اولین خطی که یکی از این‌ها
+# را دارد، همه متن تا flush() نگه داشته و یکجا تبدیل می‌شود. ارجاع محصول ([30796]،
+# پشت سر هم هم) لینک ارجاعی حساب نمی‌شود تا پاسخ‌های معمولی ربات تدریجی بمانند.
+# تنها استثنا: لینک کوتاه [id] (از جمله ارجاع محصول) در بلوکی که قبلاً فرستاده
+# شده، اگر تعریفش بعداً برسد لینک نمی‌شود.
+_LIST_ITEM_RE = re.compile(r"^\s*([*+-]|\d+\.)\s")
+_REF_LINK_RE = re.compile(r"\[[^\]\n]*\]\s?\[[^\]\n]*\]")
+_HOLD_LINE_RE = re.compile(r"^ {0,3}\[[^\]\n]+\]:|^ {0,3}<[A-Za-z!?/]")
+
+
+def _holds(line: str) -> bool:
+    return bool(_HOLD_LINE_RE.search(line) or _REF_LINK_RE.search(PRODUCT_REF_RE.sub("", line)))
+
+
+def _block_kind(line: str) -> str:
+    if _LIST_ITEM_RE.match(line):
+        return "list"
+    if line.lstrip().startswith(">"):
+        return "quote"
+    return "other"
+
+
+class IncrementalMarkdown:
+    def __init__(self, preprocess=None, **kwargs):
+        # preprocess: روی متن هر بلوک قبل از تبدیل (مثلاً Catalog.expand_refs)
+        self._preprocess = preprocess
+        self._md = markdown.Markdown(**kwargs)
+        self._partial = ""
+        self._pending = []
+        self._kind = None
+        self._after_blank = False
+        self._started = False
+        self._hold = False
+
+    def feed(self, text: str) -> str:
+        self._partial += text
+        if "\n" not in text:
+            return ""
+        *lines, self._partial = self._partial.split("\n")
+        return "".join(self._push(line) for line in lines)
+
+    def pending(self) -> str:
+        # متنی که هنوز به HTML تبدیل نشده؛ کلاینت تا نهایی شدن بلوک خامش را نشان می‌دهد
+        return "\n".join([*self._pending, self._partial])
+
+    def flush(self) -> str:
+        if self._partial:
+            self._pending.append(self._partial)
+            self._partial = ""
+        return self._render()
+
+    def _continues(self, line: str) -> bool:
+        if line[:1] in (" ", "\t"):
+            return True
+        kind = _block_kind(line)
+        return kind != "other" and kind == self._kind
+
+    def _push(self, line: str) -> str:
+        if not line.strip():
+            if self._pending:
+                self._pending.append(line)
+                self._after_blank = True
+            return ""
+
+        html = ""
+        # بلوک قبلی هم نگه داشته می‌شود: تعریف [id]: از خروجی حذف می‌شود و دو طرفش ممکن است یکی شوند
+        if _holds(line):
+            self._hold = True
+        if self._after_blank and not self._hold and not self._continues(line):
+            html = self._render()
+        if not self._pending:
+            self._kind = _block_kind(line)
+        self._after_blank = False
+        self._pending.append(line)
+        return html
+
+    def _render(self) -> str:
+        text = "\n".join(self._pending).strip("\n")
+        self._pending = []
+        self._after_blank = False
+        if not text:
+            return ""
+        if self._preprocess is not None:
+            text = self._preprocess(text)
+        self._md.reset()
+        html = self._md.convert(text)
+        if not html:
+            return ""
+        # markdown.markdown بلوک‌های سطح بالا را با \n به هم می‌چسباند
+        if self._started:
+            html = "\n" + html
+        self._started = True
+        return html
@@ -0,0 +1,47 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+# ================== حافظه گفتگو ==================
+# هر نوبت (سوال کاربر + پاسخ ربات) با تعداد توکنش در session ذخیره می‌شود تا
+# برای پنجره‌بندی لازم نباشد هر بار تاریخچه دوباره encode شود. به مدل فقط
+# جدیدترین نوبت‌هایی می‌رسند که در بودجه توکن جا می‌شوند.
+SESSION_KEY = "chat_history"
+MAX_STORED_TURNS = 20
+
+
+class ConversationMemory:
+    def __init__(self, session, token_budget: int, counter, max_turns: int = MAX_STORED_TURNS):
+        self.session = session
+        self.token_budget = token_budget
+        self.counter = counter
+        self.max_turns = max_turns
+        self.turns = []
+
+    async def aload(self):
+        self.turns = await self.session.aget(SESSION_KEY, [])
+        return self
+
+    def __bool__(self):
+        return bool(self.turns)
+
+    def last_question(self) -> str:
+        return self.turns[-1]["user"] if self.turns else ""
+
+    def window(self):
+        selected = []
+        used = 0
+        for turn in reversed(self.turns):
+            if used + turn["tokens"] > self.token_budget:
+                break
+            used += turn["tokens"]
+            selected.append(turn)
+
+        messages = []
+        for turn in reversed(selected):
+            messages.append(HumanMessage(content=turn["user"]))
+            messages.append(AIMessage(content=turn["assistant"]))
+        return messages
+
+    async def aappend(self, user_message: str, reply: str):
+        tokens = self.counter.count(user_message) + self.counter.count(reply)
+        self.turns = [*self.turns, {"user": user_message, "assistant": reply, "tokens": tokens}][-self.max_turns:]
+        await self.session.aset(SESSION_KEY, self.turns)
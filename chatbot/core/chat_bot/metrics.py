@@ -0,0 +1,213 @@
+import json
+import logging
+import threading
+from bisect import bisect_left
+
+# ================== متریک‌ها (قالب متنی Prometheus) ==================
+# شمارنده‌ها و هیستوگرام‌ها در حافظه همین پروسه‌اند؛ با چند worker هر worker
+# عدد خودش را گزارش می‌کند. آمار کش پاسخ‌ها از backend کش خوانده می‌شود و بین
+# workerها مشترک است.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # ثانیه
+
+logger = logging.getLogger("chat_bot.requests")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, _labels(self.labels, key), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # برای هر سری: تعداد در هر bucket (غیرتجمعی)، جمع و تعداد کل
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        names = self.labels + ("le",)
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                yield f"{self.name}_bucket", _labels(names, key + (bound,)), cumulative
+            yield f"{self.name}_sum", _labels(self.labels, key), total
+            yield f"{self.name}_count", _labels(self.labels, key), count
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self):
+        yield self.name, "", self.value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DURATION_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        metric = Gauge(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+http_requests = registry.counter(
+    "chat_http_requests_total", "HTTP requests by view and status", ("view", "method", "status"),
+)
+http_duration = registry.histogram(
+    "chat_http_request_duration_seconds", "Time until the last byte of the response", ("view",),
+)
+stage_duration = registry.histogram(
+    "chat_stage_duration_seconds", "Server time per request stage (chat pipeline, product search)", ("view", "stage"),
+)
+ttft = registry.histogram("chat_ttft_seconds", "Time from request start to the first answer token", ("view",))
+tokens = registry.counter("chat_tokens_total", "Tokens sent to and received from the LLM", ("view", "kind"))
+answers = registry.counter("chat_answers_total", "Chat answers by source", ("view", "source"))
+llm_calls = registry.counter(
+    "chat_llm_calls_total", "Upstream LLM calls by outcome (ok, error, timeout, rejected)", ("kind", "outcome"),
+)
+llm_coalesced = registry.counter(
+    "chat_llm_coalesced_total", "Requests that shared an identical in-flight LLM call", ("kind",),
+)
+llm_inflight = registry.gauge("chat_llm_inflight", "Upstream LLM calls in progress")
+llm_circuit_open = registry.gauge("chat_llm_circuit_open", "1 while the LLM circuit breaker is open")
+llm_queued = registry.gauge("chat_llm_queued", "Requests waiting for an LLM slot")
+llm_queue_wait = registry.histogram("chat_llm_queue_wait_seconds", "Time admitted requests waited for an LLM slot")
+admission_rejected = registry.counter(
+    "chat_admission_rejected_total",
+    "Requests answered with a busy reply (queue_full, client_queue_full, queue_timeout, rate_limited)", ("reason",),
+)
+
+
+def render_cache_stats(stats) -> str:
+    # همان اعداد /cache/stats/ به قالب Prometheus
+    lines = [
+        "# HELP chat_response_cache_events_total Response cache lookups and stores (all workers)",
+        "# TYPE chat_response_cache_events_total counter",
+    ]
+    lines.extend(
+        f'chat_response_cache_events_total{{event="{name}"}} {value}'
+        for name, value in stats.items() if name != "hit_ratio"
+    )
+    lines.append("# HELP chat_response_cache_hit_ratio Share of lookups answered from the cache")
+    lines.append("# TYPE chat_response_cache_hit_ratio gauge")
+    lines.append(f"chat_response_cache_hit_ratio {stats['hit_ratio']}")
+    return "\n".join(lines) + "\n"
+
+
+def record_request(request, status: int, timer):
+    match = getattr(request, "resolver_match", None)
+    view = match.view_name if match else "unmatched"
+    elapsed = timer.total()
+    http_requests.inc(view=view, method=request.method, status=status)
+    http_duration.observe(elapsed, view=view)
+    if not timer.stages:
+        return
+
+    # فقط درخواست‌هایی که مرحله‌هایشان اندازه گرفته شده (چت، جستجوی محصولات)
+    for stage, seconds in timer.stages.items():
+        stage_duration.observe(seconds, view=view, stage=stage)
+    if "ttft" in timer.marks:
+        ttft.observe(timer.marks["ttft"], view=view)
+    info = timer.info
+    if "source" in info:
+        answers.inc(view=view, source=info["source"])
+    # پاسخ مشترک با یک فراخوانی هم‌زمان دیگر، توکن جدیدی از API مصرف نکرده
+    if info.get("source") == "llm" and not info.get("coalesced"):
+        tokens.inc(info.get("prompt_tokens", 0), view=view, kind="prompt")
+        tokens.inc(info.get("completion_tokens", 0), view=view, kind="completion")
+
+    # یک خط JSON برای هر درخواست (برای جمع‌آوری لاگ‌ها)
+    logger.info(json.dumps({
+        "event": "request",
+        "view": view,
+        "status": status,
+        "duration_ms": round(elapsed * 1000, 2),
+        "timings_ms": timer.as_dict(),
+        **info,
+    }, ensure_ascii=False))
@@ -0,0 +1,51 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import record_request
+from .timing import StageTimer
+
+# ================== متریک هر درخواست ==================
+# باید اولین middleware باشد تا زمان کل، بقیه middlewareها را هم شامل شود. برای
+# پاسخ‌های stream ثبت بعد از آخرین رویداد انجام می‌شود، نه هنگام برگشتن ویو.
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request.timer = StageTimer()
+        return self.observe(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        request.timer = StageTimer()
+        return self.observe(request, await self.get_response(request))
+
+    def observe(self, request, response):
+        if not response.streaming:
+            record_request(request, response.status_code, request.timer)
+        elif response.is_async:
+            response.streaming_content = self._aobserve(request, response, response.streaming_content)
+        else:
+            response.streaming_content = self._observe(request, response, response.streaming_content)
+        return response
+
+    async def _aobserve(self, request, response, content):
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            record_request(request, response.status_code, request.timer)
+
+    def _observe(self, request, response, content):
+        try:
+            yield from content
+        finally:
+            record_request(request, response.status_code, request.timer)
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('url', models.URLField(blank=True, max_length=500)),
+            ],
+            options={
+                'verbose_name_plural': 'categories',
+            },
+        ),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('link', models.URLField(max_length=1000, unique=True)),
+                ('title', models.CharField(max_length=500)),
+                ('price', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('price_text', models.CharField(blank=True, max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('categories', models.ManyToManyField(related_name='products', to='chat_bot.category')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['price'], name='chat_bot_pr_price_1bae87_idx'), models.Index(fields=['updated_at'], name='chat_bot_pr_updated_21d1d1_idx')],
+            },
+        ),
+    ]
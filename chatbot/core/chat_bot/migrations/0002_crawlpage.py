@@ -0,0 +1,25 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=1000, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('last_modified', models.CharField(blank=True, max_length=64)),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('product_links', models.JSONField(default=list)),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
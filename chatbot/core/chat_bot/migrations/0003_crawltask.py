@@ -0,0 +1,29 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_bot', '0002_crawlpage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category_url', models.URLField(max_length=1000)),
+                ('category_name', models.CharField(max_length=255)),
+                ('page', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('done', 'done'), ('empty', 'empty')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('product_links', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category_url', 'page'), name='unique_crawl_task')],
+            },
+        ),
+    ]
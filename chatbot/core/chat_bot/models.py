@@ -1,3 +1,80 @@
 from django.db import models
 
-# Create your models here.
+from .text import category_id
+
+
+class Category(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    url = models.URLField(max_length=500, blank=True)
+
+    class Meta:
+        verbose_name_plural = "categories"
+
+    def __str__(self):
+        return self.name
+
+
+class Product(models.Model):
+    link = models.URLField(max_length=1000, unique=True)
+    title = models.CharField(max_length=500)
+    price = models.PositiveBigIntegerField(null=True, blank=True)  # تومان
+    price_text = models.CharField(max_length=64, blank=True)
+    categories = models.ManyToManyField(Category, related_name="products")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["price"]),
+            models.Index(fields=["updated_at"]),
+        ]
+
+    def __str__(self):
+        return self.title
+
+    def as_dict(self):
+        categories = [c.name for c in self.categories.all()]
+        return {
+            "title": self.title,
+            "link": self.link,
+            "price": self.price_text,
+            "price_value": self.price,
+            "categories": categories,
+            "category_ids": [category_id(name) for name in categories],
+        }
+
+
+class CrawlPage(models.Model):
+    # وضعیت آخرین دریافت هر صفحه فهرست برای درخواست شرطی و تشخیص تغییر
+    url = models.URLField(max_length=1000, unique=True)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    product_links = models.JSONField(default=list)
+    fetched_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.url
+
+
+class CrawlTask(models.Model):
+    # صف پایدار صفحه‌های دور فعلی اسکرپ؛ scraper --resume از همین‌جا ادامه می‌دهد
+    PENDING = "pending"
+    DONE = "done"
+    EMPTY = "empty"  # صفحه خالی = پایان دسته
+    STATUS_CHOICES = [(PENDING, "pending"), (DONE, "done"), (EMPTY, "empty")]
+
+    category_url = models.URLField(max_length=1000)
+    category_name = models.CharField(max_length=255)
+    page = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    product_links = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["category_url", "page"], name="unique_crawl_task"),
+        ]
+
+    def __str__(self):
+        return f"{self.category_url}?page={self.page} ({self.status})"
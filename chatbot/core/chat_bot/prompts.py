@@ -0,0 +1,146 @@
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import tiktoken
+
+# ================== متن ثابت پرامپت سیستم ==================
+SYSTEM_PROMPT_HEAD = (
+    "تو یک دستیار حرفه‌ای پشتیبانی برای فروشگاه آنلاین {target_web} هستی. "
+    "همیشه مودبانه و واضح به فارسی پاسخ بده. "
+    "وظایف تو شامل پاسخ به سوالات مشتریان درباره خرید، پرداخت، پیگیری سفارش، بازگشت کالا و مشکلات احتمالی است. "
+    "اگر سوال درباره مشخصات یا قابلیت‌های محصولات باشد، می‌توانی **با توجه به مشخصات سخت‌افزاری، پیش‌بینی تقریبی بدهی** که محصول برای کار خاصی مناسب است یا نه. "
+    "مثلاً اگر مشتری بپرسد آیا لپ‌تاپ برای بازی یا کار خواستی X مناسب است، با توجه به CPU، GPU و RAM، راهنمایی تقریبی بده. "
+    "همیشه تاکید کن که این پیش‌بینی تقریبی است و عملکرد واقعی ممکن است متفاوت باشد. "
+    "برای معرفی هر محصول فقط شناسه‌اش را داخل کروشه بنویس، مثلاً [30796]؛ "
+    "شناسه خودکار به نام و لینک محصول تبدیل می‌شود و خودت هیچ لینکی ننویس. "
+    "لیست محصولات فروشگاه برای راهنمایی، به تفکیک دسته (هر سطر: شناسه | نام | قیمت به تومان):\n"
+)
+SYSTEM_PROMPT_TAIL = (
+    "\n"
+    "اگر سوال خارج از محدوده فروشگاه یا محصولات باشد، فقط بگو که نمی‌توانی پاسخ بدهی و هیچ اطلاعاتی اضافه نده."
+)
+NO_PRODUCTS = "فعلاً محصولی موجود نیست."
+NO_MATCHING_PRODUCTS = "محصول مرتبطی با این سوال در فهرست پیدا نشد."
+
+
+OTHER_CATEGORY = "سایر محصولات"
+# شماره محصول در آدرس سایت: /product/category-ssd/30796-...
+_SITE_ID_RE = re.compile(r"/product/[^/]+/(\d+)-")
+# شناسه‌ای که مدل در پاسخ می‌نویسد: [30796]، ولی نه لینک markdown مثل [متن](...)
+PRODUCT_REF_RE = re.compile(r"\[(n?\d+)\](?!\()")
+
+
+def product_ref(product, doc_id: int) -> str:
+    # شناسه کوتاه به‌جای لینک کامل؛ شماره سایت بین نسخه‌های کاتالوگ ثابت است و
+    # شناسه‌های تاریخچه گفتگو بعد از اسکرپ تازه هم به همان محصول اشاره می‌کنند
+    match = _SITE_ID_RE.search(product["link"])
+    return match.group(1) if match else f"n{doc_id}"
+
+
+def compact_line(product, ref: str) -> str:
+    return f"{ref} | {product['title']} | {product['price']}\n"
+
+
+def category_header(name: str) -> str:
+    return f"\n# {name}\n"
+
+
+def product_line(product, target_web: str) -> str:
+    # قالب قدیمی (یک سطر با لینک کامل برای هر محصول)؛ فقط برای مقایسه در prompt_tokens
+    link = product["link"]
+    if not link.startswith(("http://", "https://")):
+        link = f"https://{target_web}{link}"
+    return f"- {product['title']} (قیمت: {product['price']} تومان) | لینک: {link}"
+
+
+# ================== شمارش توکن ==================
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+class TokenCounter:
+    # شمارش پرامپت‌های ساخته‌شده از قبل معلوم است؛ آن‌ها را نگه می‌داریم تا
+    # num_tokens_from_messages دوباره کل پرامپت سیستم را encode نکند.
+    def __init__(self, model: str, maxsize: int = 256):
+        self.model = model
+        self.maxsize = maxsize
+        self._known = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, text: str, tokens: int):
+        with self._lock:
+            self._known[text] = tokens
+            self._known.move_to_end(text)
+            while len(self._known) > self.maxsize:
+                self._known.popitem(last=False)
+
+    def count(self, text: str) -> int:
+        with self._lock:
+            tokens = self._known.get(text)
+        if tokens is None:
+            tokens = len(get_encoding(self.model).encode(text))
+        return tokens
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(model: str) -> TokenCounter:
+    return TokenCounter(model)
+
+
+# ================== کش پرامپت سیستم ==================
+class SystemPrompt:
+    # برای هر نسخه از کاتالوگ یک بار ساخته می‌شود: سطر هر محصول و تعداد
+    # توکن‌هایش در snapshot کاتالوگ آماده است و هر درخواست فقط سطرهای
+    # انتخاب‌شده را زیر سرتیتر دسته‌شان کنار هم می‌گذارد.
+    def __init__(self, catalog, target_web: str, model: str):
+        self.catalog = catalog
+        self.counter = get_token_counter(model)
+        self.encoding = get_encoding(model)
+
+        self.head = SYSTEM_PROMPT_HEAD.format(target_web=target_web)
+        self.head_tokens = len(self.encoding.encode(self.head))
+        self.tail_tokens = len(self.encoding.encode(SYSTEM_PROMPT_TAIL))
+        self._headers = {}
+        self._full = None
+
+    def _header(self, category):
+        if category not in self._headers:
+            text = category_header(self.catalog.categories().get(category) or OTHER_CATEGORY)
+            self._headers[category] = (text, len(self.encoding.encode(text)))
+        return self._headers[category]
+
+    def _join(self, lines, empty_text: str):
+        if not lines:
+            text = self.head + empty_text + "\n" + SYSTEM_PROMPT_TAIL
+            tokens = self.counter.count(text)
+        else:
+            # lines: (دسته، سطر، توکن)؛ ترتیب دسته‌ها همان ترتیب اولین محصول هر دسته است
+            groups = {}
+            for category, line, line_tokens in lines:
+                groups.setdefault(category, []).append((line, line_tokens))
+            parts = [self.head]
+            # جمع توکن تکه‌ها؛ در مرز سطرها ممکن است یکی دو توکن با encode کامل فرق کند.
+            tokens = self.head_tokens + self.tail_tokens
+            for category, items in groups.items():
+                header, header_tokens = self._header(category)
+                parts.append(header)
+                parts.extend(line for line, _ in items)
+                tokens += header_tokens + sum(n for _, n in items)
+            parts.append(SYSTEM_PROMPT_TAIL)
+            text = "".join(parts)
+        self.counter.remember(text, tokens)
+        return text
+
+    def render(self, product_ids=None) -> str:
+        if product_ids is None:
+            if self._full is None:
+                self._full = self._join(self.catalog.prompt_lines(), NO_PRODUCTS)
+            return self._full
+        empty_text = NO_MATCHING_PRODUCTS if len(self.catalog) else NO_PRODUCTS
+        return self._join(self.catalog.prompt_lines(product_ids), empty_text)
@@ -0,0 +1,30 @@
+import math
+
+from .text import normalize_text
+
+# ================== جستجوی محلی محصولات (BM25 روی n-gram حرفی) ==================
+# n-gram حرفی بدون نیاز به ریشه‌یاب فارسی با پسوندها و املاهای مختلف
+# (مثلاً «گیگابایت» و «گیگ» یا «لپ‌تاپ» و «لپ تاپ») کنار می‌آید.
+NGRAM_SIZE = 3
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE):
+    grams = []
+    for word in normalize_text(text).split():
+        word = f" {word} "
+        if len(word) <= n:
+            grams.append(word)
+            continue
+        grams.extend(word[i:i + n] for i in range(len(word) - n + 1))
+    return grams
+
+
+def bm25_idf(total: int, df: int) -> float:
+    return math.log(1 + (total - df + 0.5) / (df + 0.5))
+
+
+def product_document(product) -> str:
+    return " ".join([product["title"], *product.get("categories", [])])
+
@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+# ================== Server-Sent Events ==================
+HEARTBEAT = ": ping\n\n"
+_DONE = object()
+
+
+def sse_event(event: str, data) -> str:
+    # json.dumps هیچ خط جدید خامی تولید نمی‌کند، پس هر رویداد یک خط data دارد
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def with_heartbeat(events, interval: float):
+    # رویدادها در یک task جدا مصرف می‌شوند تا اگر LLM مدتی ساکت بود، ping بفرستیم
+    # و proxyها اتصال را نبندند. اگر کلاینت قطع شود، ASGI این generator را cancel
+    # می‌کند و finally همان لحظه stream بالادستی LLM را هم می‌بندد.
+    queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for event, data in events:
+                queue.put_nowait(sse_event(event, data))
+        finally:
+            queue.put_nowait(_DONE)
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), interval)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+                continue
+            if item is _DONE:
+                break
+            yield item
+        await task
+    finally:
+        task.cancel()
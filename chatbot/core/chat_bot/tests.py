@@ -1,3 +1,1068 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import runpy
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import markdown
+import openai
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from .admission import AdmissionController, Overloaded, RateLimited, TokenBuckets
+from .cache import ResponseCache
+from .catalog import Catalog, CatalogStore, apply_delta, build_snapshot, delta_path, iter_products, source_version
+from .crawler.crawl import scrape_category, scrape_site
+from .crawler.fixtures import FixtureSite, start_fixture_server
+from .crawler.http_backend import HttpBackend, parse_listing
+from .crawler.limiter import AdaptiveLimiter, ConcurrencyLimiter
+from .crawler.results import PageError, UnchangedPage
+from .crawler.routing import ResourcePolicy
+from .crawler.state import CrawlState
+from .ingest import DeltaSink, JsonlSink, export_catalog
+from .llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable
+from .markdown_stream import IncrementalMarkdown
+from .memory import SESSION_KEY, ConversationMemory
+from .models import Product
+from .prompts import NO_MATCHING_PRODUCTS, PRODUCT_REF_RE, TokenCounter, get_token_counter
+from .text import normalize_product, parse_price, parse_price_range
+
+TARGET_WEB = "ehadish.com"
+MODEL_NAME = "gpt-4o-mini"
+
+
+class WordEncoding:
+    # جای tiktoken در تست‌ها تا o200k_base دانلود نشود: هر کلمه یک توکن
+    def encode(self, text):
+        return text.split()
+
+
+class OfflineTokensMixin:
+    def setUp(self):
+        super().setUp()
+        for target in ("chat_bot.prompts.get_encoding", "chat_bot.catalog.get_encoding"):
+            patcher = mock.patch(target, lambda model: WordEncoding())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+def make_catalog(directory, products) -> Catalog:
+    json_path = Path(directory) / "all_products.jsonl"
+    snapshot_path = Path(directory) / "all_products.sqlite3"
+    json_path.write_text("".join(json.dumps(p, ensure_ascii=False) + "\n" for p in products), encoding="utf-8")
+    build_snapshot(iter_products(json_path), snapshot_path, source_version(json_path), TARGET_WEB, MODEL_NAME)
+    return Catalog(snapshot_path, TARGET_WEB, MODEL_NAME)
+
+
+def product(site_id, title, price, category):
+    return normalize_product({
+        "title": title,
+        "link": f"https://www.ehadish.com/product/category-{site_id}/{site_id}-p/",
+        "price": price,
+        "categories": [category],
+    })
+
+
+# ================== re-crawl تدریجی و delta ==================
+class DeltaSinkTests(OfflineTokensMixin, TestCase):
+    LINK = "https://www.ehadish.com/product/category-hdd/30796-hard/"
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.json_path = Path(tmp.name) / "all_products.jsonl"
+        self.snapshot_path = Path(tmp.name) / "all_products.sqlite3"
+
+    def item(self, category, title="هارد اکسترنال", price="1,700,000 تومان"):
+        return {"title": title, "link": self.LINK, "price": price, "categories": [category]}
+
+    def crawl(self, pages, complete=True):
+        # pages: {نام دسته: محصولات}؛ مثل scrape_site هر دسته بعد از نوشتن category_done می‌گیرد
+        sink = DeltaSink()
+        for name, products in pages.items():
+            sink.write(products, f"https://www.ehadish.com/{name}/")
+            sink.category_done(name, [], complete)
+        return sink.finish()
+
+    def snapshot_categories(self):
+        catalog = Catalog(self.snapshot_path, TARGET_WEB, MODEL_NAME)
+        return [sorted(p["categories"]) for p in catalog.products()]
+
+    def export_and_apply(self, delta):
+        export_catalog(self.json_path, delta=delta)
+        apply_delta(delta, self.snapshot_path, source_version(self.json_path), MODEL_NAME)
+
+    def test_category_only_change_is_in_delta(self):
+        self.crawl({"A": [self.item("A")]})
+        export_catalog(self.json_path)
+        build_snapshot(iter_products(self.json_path), self.snapshot_path, source_version(self.json_path),
+                       TARGET_WEB, MODEL_NAME)
+
+        delta = self.crawl({"A": [self.item("A")], "B": [self.item("B")]})
+        self.assertEqual(delta["added"], [])
+        self.assertEqual([sorted(p["categories"]) for p in delta["changed"]], [["A", "B"]])
+        self.export_and_apply(delta)
+        self.assertEqual(self.snapshot_categories(), [["A", "B"]])
+
+        # دیگر در دسته A نیست: لینک A حذف می‌شود ولی خود محصول می‌ماند
+        delta = self.crawl({"A": [], "B": [self.item("B")]})
+        self.assertEqual([p["categories"] for p in delta["changed"]], [["B"]])
+        self.assertEqual(delta["removed"], [])
+        self.export_and_apply(delta)
+        self.assertEqual(self.snapshot_categories(), [["B"]])
+
+    def test_unchanged_crawl_has_empty_delta(self):
+        self.crawl({"A": [self.item("A")]})
+        delta = self.crawl({"A": [self.item("A")]})
+        self.assertFalse(any(delta.values()))
+
+    def test_incomplete_category_keeps_links(self):
+        self.crawl({"A": [self.item("A")], "B": [self.item("B")]})
+        delta = self.crawl({"A": [], "B": [self.item("B")]}, complete=False)
+        self.assertFalse(any(delta.values()))
+        product = Product.objects.get(link=self.LINK)
+        self.assertEqual(sorted(c.name for c in product.categories.all()), ["A", "B"])
+
+
+# ================== کاتالوگ و پرامپت سیستم ==================
+class CatalogStoreTests(OfflineTokensMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.json_path = Path(tmp.name) / "all_products.jsonl"
+        self.store = CatalogStore(self.json_path, self.json_path.with_suffix(".sqlite3"), TARGET_WEB, MODEL_NAME,
+                                  check_interval=0)
+
+    def write(self, *products):
+        self.json_path.write_text("".join(json.dumps(p, ensure_ascii=False) + "\n" for p in products),
+                                  encoding="utf-8")
+
+    def test_reloads_when_source_changes(self):
+        self.assertEqual(len(self.store.get()), 0)
+        self.write(product(1, "هارد وسترن", "1,700,000", "هارد"))
+        first = self.store.get()
+        self.assertEqual(first.version, source_version(self.json_path))
+        self.assertIs(self.store.get(), first)
+
+        self.write(product(1, "هارد وسترن", "1,700,000", "هارد"), product(2, "فلش سندیسک", "300,000", "فلش"))
+        second = self.store.get()
+        self.assertIsNot(second, first)
+        self.assertEqual([p["title"] for p in second.products()], ["هارد وسترن", "فلش سندیسک"])
+        # درخواست‌های در حال اجرا روی نسخه قبلی می‌مانند
+        self.assertEqual(len(first), 1)
+
+    def test_check_interval_skips_stat(self):
+        self.write(product(1, "هارد وسترن", "1,700,000", "هارد"))
+        self.store.check_interval = 60
+        catalog = self.store.get()
+        self.write(product(2, "فلش سندیسک", "300,000", "فلش"))
+        self.assertIs(self.store.get(), catalog)
+
+    def test_applies_delta_for_next_version(self):
+        self.write(product(1, "هارد وسترن", "1,700,000", "هارد"))
+        self.store.get()
+        base = source_version(self.json_path)
+        changed = product(1, "هارد وسترن", "990,000", "هارد")
+        self.write(changed)
+        delta_path(self.json_path).write_text(json.dumps({
+            "version": source_version(self.json_path), "base_version": base,
+            "added": [], "changed": [changed], "removed": [],
+        }, ensure_ascii=False), encoding="utf-8")
+        with mock.patch("chat_bot.catalog.build_snapshot") as rebuild:
+            catalog = self.store.get()
+        rebuild.assert_not_called()
+        self.assertEqual(catalog.products()[0]["price_value"], 990000)
+
+
+class CatalogTests(OfflineTokensMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.catalog = make_catalog(tmp.name, [
+            product(30796, "هارد [اکسترنال] وسترن", "1,700,000", "هارد"),
+            product(30797, "فلش سندیسک", "300,000", "فلش"),
+        ])
+
+    def test_expand_refs(self):
+        text = "پیشنهاد: [30796] و [30797]. [99999] ناشناخته است و [لینک](/x/) دست نمی‌خورد."
+        self.assertEqual(
+            self.catalog.expand_refs(text),
+            "پیشنهاد: [هارد (اکسترنال) وسترن](https://www.ehadish.com/product/category-30796/30796-p/)"
+            " و [فلش سندیسک](https://www.ehadish.com/product/category-30797/30797-p/)."
+            " [99999] ناشناخته است و [لینک](/x/) دست نمی‌خورد.",
+        )
+
+    def test_system_prompt_is_cached_per_catalog(self):
+        prompt = self.catalog.prompt
+        full = prompt.render()
+        self.assertIs(prompt.render(), full)
+        self.assertIn("30796 | هارد [اکسترنال] وسترن", full)
+        self.assertIn("# فلش", full)
+
+        selected = prompt.render([self.catalog.search_ids("فلش", 1)[0]])
+        self.assertIn("30797 | فلش سندیسک", selected)
+        self.assertNotIn("هارد [اکسترنال]", selected)
+        self.assertIn(NO_MATCHING_PRODUCTS, prompt.render([]))
+
+    def test_prompt_token_count_is_remembered(self):
+        text = self.catalog.prompt.render()
+        with mock.patch("chat_bot.prompts.get_encoding") as encoding:
+            tokens = get_token_counter(MODEL_NAME).count(text)
+        encoding.assert_not_called()
+        # جمع توکن تکه‌ها همان encode کامل است (اینجا هر کلمه یک توکن)
+        self.assertEqual(tokens, len(text.split()))
+
+
+class ConversationMemoryTests(OfflineTokensMixin, SimpleTestCase):
+    async def memory(self, token_budget=100, max_turns=20):
+        session = SessionStore()
+        counter = TokenCounter(MODEL_NAME)
+        return await ConversationMemory(session, token_budget, counter, max_turns).aload(), session
+
+    async def test_window_keeps_newest_turns_in_budget(self):
+        memory, _ = await self.memory(token_budget=9)
+        for i in range(4):
+            await memory.aappend(f"سوال {i}", f"پاسخ شماره {i}")  # هر نوبت ۵ توکن
+        self.assertEqual([m.content for m in memory.window()], ["سوال 3", "پاسخ شماره 3"])
+        self.assertEqual(memory.last_question(), "سوال 3")
+
+    async def test_stored_turns_are_capped_and_saved(self):
+        memory, session = await self.memory(max_turns=2)
+        for i in range(3):
+            await memory.aappend(f"سوال {i}", "پاسخ")
+        self.assertEqual([t["user"] for t in await session.aget(SESSION_KEY)], ["سوال 1", "سوال 2"])
+        reloaded = await ConversationMemory(session, 100, TokenCounter(MODEL_NAME)).aload()
+        self.assertEqual([m.content for m in reloaded.window()], ["سوال 1", "پاسخ", "سوال 2", "پاسخ"])
+
+    async def test_turn_larger_than_budget_is_dropped(self):
+        memory, _ = await self.memory(token_budget=3)
+        await memory.aappend("سوال خیلی طولانی", "پاسخ طولانی")
+        self.assertTrue(memory)
+        self.assertEqual(memory.window(), [])
+
+
+# ================== markdown تدریجی ==================
+class IncrementalMarkdownTests(SimpleTestCase):
+    TEXTS = [
+        "# عنوان\n\nسلام **دوست** من\n\n- هارد\n- فلش\n\n    کد\n\nپایان",
+        "1. یک\n2. دو\n\n   ادامه دو\n\n> نقل\n> قول\n\n---\n\nمتن",
+        "```\nfenced\n\ncode\n```\n\nبعد",
+        "ببینید [سایت][site] را\n\nپاراگراف\n\n[site]: https://www.ehadish.com/",
+        "- a\n- b\n\n[x]: http://x.com\n\n- c\n\n[x][]",
+        "قبل\n\n<div>\nraw\n\nhtml\n</div>\n\nبعد",
+    ]
+
+    def stream(self, text, size):
+        renderer = IncrementalMarkdown()
+        parts = [renderer.feed(text[i:i + size]) for i in range(0, len(text), size)]
+        return parts, renderer.flush()
+
+    def test_matches_one_shot_render(self):
+        for text in self.TEXTS:
+            for size in (1, 3, 7, len(text)):
+                with self.subTest(text=text, size=size):
+                    parts, tail = self.stream(text, size)
+                    self.assertEqual("".join(parts) + tail, markdown.markdown(text))
+
+    def test_finished_blocks_are_sent_early(self):
+        parts, _ = self.stream("پاراگراف اول\n\nدوم\n", 1)
+        self.assertEqual("".join(parts), "<p>پاراگراف اول</p>")
+
+    def test_adjacent_product_refs_stream_incrementally(self):
+        # پرامپت از مدل می‌خواهد ارجاع‌ها را پشت سر هم بنویسد: [30796] [30797]
+        text = "هاردها: [30796] [30797]\n\n- [30798][n12]\n\nسوم\n\nچهارم\n"
+        links = {"30796": "[هارد ۱](/p/1/)", "30797": "[هارد ۲](/p/2/)", "30798": "[هارد ۳](/p/3/)"}
+
+        def expand(block):
+            return PRODUCT_REF_RE.sub(lambda m: links.get(m.group(1), m.group(0)), block)
+
+        for preprocess in (None, expand):
+            with self.subTest(preprocess=preprocess):
+                renderer = IncrementalMarkdown(preprocess=preprocess)
+                parts = [renderer.feed(char) for char in text]
+                self.assertIn("سوم", "".join(parts))
+                expected = markdown.markdown(expand(text) if preprocess else text)
+                self.assertEqual("".join(parts) + renderer.flush(), expected)
+
+    def test_reference_and_html_blocks_wait_for_flush(self):
+        # بلوک درست قبل از آن‌ها هم نگه داشته می‌شود
+        for text in ("اول\n\nدوم\n\nلینک [a][b]\n\nسوم\n\nچهارم\n", "اول\n\nدوم\n\n<div>\n\nسوم\n\nچهارم\n"):
+            with self.subTest(text=text):
+                parts, tail = self.stream(text, 1)
+                self.assertEqual("".join(parts), "<p>اول</p>")
+                self.assertIn("دوم", tail)
+                self.assertIn("چهارم", tail)
+
+
+# ================== circuit breaker و دروازه LLM ==================
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("chat_bot.llm_gateway.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=2, cooldown=30)
+
+    def open_circuit(self):
+        for _ in range(2):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.failure()
+
+    def test_opens_after_threshold(self):
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, "closed")
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, "open")
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_failures(self):
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_half_open_allows_one_probe(self):
+        self.open_circuit()
+        self.now += 30
+        self.assertEqual(self.breaker.state, "half_open")
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, "closed")
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self.open_circuit()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, "open")
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+
+    def test_released_probe_can_be_retried(self):
+        self.open_circuit()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.release()
+        self.assertTrue(self.breaker.allow())
+
+
+class FailingLLM:
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        raise self.error
+
+
+class LLMGatewayErrorTests(SimpleTestCase):
+    REQUEST = httpx.Request("POST", "http://llm/chat/completions")
+
+    def invoke(self, error, breaker=None):
+        gateway = LLMGateway(FailingLLM(error), breaker=breaker)
+        messages = [mock.Mock(type="human", content="سلام")]
+        asyncio.run(gateway.ainvoke(messages))
+
+    def status_error(self, status):
+        return openai.APIStatusError("error", response=httpx.Response(status, request=self.REQUEST), body=None)
+
+    def test_upstream_errors_become_unavailable(self):
+        for error in (openai.APITimeoutError(self.REQUEST), openai.APIConnectionError(request=self.REQUEST),
+                      self.status_error(502), self.status_error(429)):
+            with self.subTest(error=type(error).__name__):
+                breaker = CircuitBreaker(failure_threshold=1)
+                with self.assertRaises(LLMUnavailable):
+                    self.invoke(error, breaker)
+                self.assertEqual(breaker.state, "open")
+
+    def test_request_errors_pass_through(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        with self.assertRaises(openai.APIStatusError):
+            self.invoke(self.status_error(400), breaker)
+        self.assertEqual(breaker.state, "closed")
+
+
+# ================== کنترل پذیرش ==================
+class AdmissionControllerTests(SimpleTestCase):
+    def test_turns_rotate_between_clients(self):
+        async def scenario():
+            admission = AdmissionController(max_concurrent=1, max_queue_per_client=2, queue_timeout=5)
+            await admission.acquire("a")
+            order = []
+
+            async def request(name, client):
+                await admission.acquire(client)
+                order.append(name)
+                admission.release()
+
+            tasks = []
+            for name, client in (("a1", "a"), ("a2", "a"), ("b1", "b")):
+                tasks.append(asyncio.create_task(request(name, client)))
+                await asyncio.sleep(0)
+            self.assertEqual(admission.queued, 3)
+            admission.release()
+            await asyncio.gather(*tasks)
+            return order, admission
+
+        order, admission = asyncio.run(scenario())
+        self.assertEqual(order, ["a1", "b1", "a2"])
+        self.assertEqual((admission.active, admission.queued), (0, 0))
+
+    def test_client_queue_limit(self):
+        async def scenario():
+            admission = AdmissionController(max_concurrent=1, max_queue_per_client=1, queue_timeout=5)
+            await admission.acquire("a")
+            waiting = asyncio.create_task(admission.acquire("b"))
+            await asyncio.sleep(0)
+            with self.assertRaises(Overloaded) as rejected:
+                await admission.acquire("b")
+            admission.check("c")
+            admission.release()
+            await waiting
+            return rejected.exception
+
+        self.assertEqual(asyncio.run(scenario()).reason, "client_queue_full")
+
+    def test_queue_timeout(self):
+        async def scenario():
+            admission = AdmissionController(max_concurrent=1, queue_timeout=0.01)
+            await admission.acquire("a")
+            with self.assertRaises(Overloaded) as rejected:
+                await admission.acquire("b")
+            return rejected.exception, admission
+
+        error, admission = asyncio.run(scenario())
+        self.assertEqual(error.reason, "queue_timeout")
+        self.assertEqual((admission.active, admission.queued), (1, 0))
+
+
+class TokenBucketsTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("chat_bot.admission.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buckets = TokenBuckets(per_minute=600, burst=100)
+
+    def test_refills_over_time(self):
+        self.buckets.take("a", 100)
+        with self.assertRaises(RateLimited) as limited:
+            self.buckets.take("a", 50)
+        self.assertAlmostEqual(limited.exception.retry_after, 5)
+        self.now += 5
+        self.buckets.take("a", 50)
+
+    def test_refill_is_capped_at_burst(self):
+        self.now += 3600
+        self.buckets.take("a", 100)
+        with self.assertRaises(RateLimited):
+            self.buckets.take("a", 1)
+
+    def test_charge_can_go_negative(self):
+        self.buckets.take("a", 10)
+        self.buckets.charge("a", 190)
+        self.now += 10  # سطل از ‎-100 به صفر رسیده است
+        with self.assertRaises(RateLimited):
+            self.buckets.take("a", 1)
+        self.buckets.take("b", 100)
+
+    def test_zero_rate_disables_limit(self):
+        buckets = TokenBuckets(per_minute=0)
+        buckets.take("a", 10 ** 6)
+
+
+class EchoLLM:
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        return messages[-1].content
+
+
+class CoalescedAdmissionTests(SimpleTestCase):
+    def test_admission_is_checked_per_caller(self):
+        async def scenario():
+            admission = AdmissionController(max_concurrent=1, max_queue_per_client=1, queue_timeout=5)
+            gateway = LLMGateway(EchoLLM(), admission=admission)
+            await admission.acquire("x")
+            # فراخوانی اول a در صف است و سهم صف a پر شده
+            first = asyncio.create_task(gateway.ainvoke([mock.Mock(type="human", content="هارد")], client="a"))
+            await asyncio.sleep(0.01)
+            second = [mock.Mock(type="human", content="فلش")]
+            rejected = asyncio.create_task(gateway.ainvoke(second, client="a"))
+            info = {}
+            other = asyncio.create_task(gateway.ainvoke(second, info, client="b"))
+            await asyncio.sleep(0.01)
+            self.assertIsInstance(rejected.exception(), Overloaded)
+            self.assertFalse(other.done())  # رد شدن a به b نمی‌رسد
+            admission.release()
+            return await first, await other, info, gateway.llm.calls
+
+        first, other, info, calls = asyncio.run(scenario())
+        self.assertEqual((first, other, calls), ("هارد", "فلش", 2))
+        self.assertNotIn("coalesced", info)
+
+    def test_joiner_is_checked_against_its_own_queue(self):
+        async def scenario():
+            admission = AdmissionController(max_concurrent=1, max_queue_per_client=1, queue_timeout=5)
+            gateway = LLMGateway(EchoLLM(), admission=admission)
+            await admission.acquire("x")
+            question = [mock.Mock(type="human", content="هارد")]
+            first = asyncio.create_task(gateway.ainvoke(question, client="a"))
+            await asyncio.sleep(0.01)
+            with self.assertRaises(Overloaded):
+                await gateway.ainvoke(question, client="a")
+            info = {}
+            joined = asyncio.create_task(gateway.ainvoke(question, info, client="b"))
+            await asyncio.sleep(0)
+            admission.release()
+            return await first, await joined, info, gateway.llm.calls
+
+        first, joined, info, calls = asyncio.run(scenario())
+        self.assertEqual((first, joined, calls), ("هارد", "هارد", 1))
+        self.assertTrue(info["coalesced"])
+
+
+class ClientKeyTests(OfflineTokensMixin, TestCase):
+    async def client_key(self, session):
+        from .views import client_key, new_memory
+
+        request = RequestFactory().post("/", REMOTE_ADDR="10.0.0.7")
+        request.session = session
+        await new_memory(session).aload()
+        return client_key(request)
+
+    async def test_cookieless_request_is_keyed_on_address(self):
+        session = SessionStore()
+        self.assertEqual(await self.client_key(session), "addr:10.0.0.7")
+        self.assertFalse(session.modified)
+        # کلید ساختگی که در دیتابیس نیست هم سهمیه تازه نمی‌گیرد
+        self.assertEqual(await self.client_key(SessionStore("x" * 32)), "addr:10.0.0.7")
+        self.assertFalse(await Session.objects.aexists())
+
+    async def test_existing_session_is_its_own_key(self):
+        session = SessionStore()
+        await session.acreate()
+        self.assertEqual(await self.client_key(SessionStore(session.session_key)), session.session_key)
+
+    async def test_stream_creates_session_only_after_reply(self):
+        for answered in (False, True):
+            with self.subTest(answered=answered):
+                async def fake_stream(user_message, memory, timer, client):
+                    # تا پذیرش نشده هیچ ردیف session ساخته نشده است
+                    self.assertEqual(client, "addr:127.0.0.1")
+                    self.assertFalse(await Session.objects.aexists())
+                    if answered:
+                        await memory.aappend(user_message, "سلام")
+                    yield "token", {"text": "سلام"}
+
+                with mock.patch("chat_bot.views.chat_with_bot_stream", fake_stream):
+                    response = await self.async_client.post("/stream/", {"user_input": "سلام"})
+                    key = response.cookies[settings.SESSION_COOKIE_NAME].value
+                    body = b"".join([chunk async for chunk in response.streaming_content])
+                self.assertIn(b"event: done", body)
+                self.assertEqual(await Session.objects.filter(session_key=key).aexists(), answered)
+
+
+# ================== قیمت و /api/products ==================
+class PriceParsingTests(SimpleTestCase):
+    def test_parse_price(self):
+        cases = {
+            "1,700,000 تومان": 1700000,
+            "۹۱,۹۰۰,۰۰۰\n۹۳,۹۰۰,۰۰۰": 91900000,  # تخفیف‌دار: قیمت فعلی کمترین است
+            "ناموجود": None,
+            "": None,
+        }
+        for text, price in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(parse_price(text), price)
+
+    def test_parse_price_range(self):
+        cases = {
+            "هارد زیر ۲ میلیون": (None, 2000000),
+            "بیشتر از 500 هزار تومان": (500000, None),
+            "کمتر از ۱.۵ میلیون": (None, 1500000),
+            "بین ۳ تا ۵ میلیون": (3000000, 5000000),
+            "بین 5 میلیون تا 3 میلیون": (3000000, 5000000),
+            "بالای ۱۰ میلیون زیر ۲۰ میلیون": (10000000, 20000000),
+            "لپتاپ زیر 20000000": (None, 20000000),
+            # عدد کوچک بدون واحد قیمت نیست (مثلاً ظرفیت)
+            "زیر 500": (None, None),
+            "هارد 2 ترابایت": (None, None),
+            "": (None, None),
+        }
+        for text, price_range in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(parse_price_range(text), price_range)
+
+
+class ProductSearchViewTests(OfflineTokensMixin, SimpleTestCase):
+    def test_invalid_parameters_return_400(self):
+        cases = {
+            "sort=cheapest": "sort must be one of",
+            "min_price=abc": "min_price must be an integer",
+            "max_price=-1": "max_price must be at least 0",
+            "page=0": "page must be at least 1",
+            "page_size=0": "page_size must be at least 1",
+        }
+        for query, error in cases.items():
+            with self.subTest(query=query):
+                response = self.client.get(f"/api/products?{query}")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(error, response.json()["error"])
+
+    western = "هارد اکسترنال وسترن دیجیتال مدل المنت ظرفیت یک ترابایت"
+    seagate = "هارد اکسترنال سیگیت مدل وان تاچ ظرفیت دو ترابایت"
+    harman = "هارمان کاردن هارمان"
+
+    def search(self, query):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        catalog = make_catalog(tmp.name, [
+            product(1, self.western, "1,700,000", "هارد"),
+            product(2, self.seagate, "2,100,000", "هارد"),
+            product(3, self.harman, "900,000", "اسپیکر"),
+            product(4, "فلش سندیسک", "300,000", "فلش"),
+        ])
+        with mock.patch("chat_bot.views.get_catalog", mock.AsyncMock(return_value=catalog)):
+            response = self.client.get(f"/api/products?{query}")
+        self.assertEqual(response.status_code, 200)
+        return [p["title"] for p in response.json()["results"]]
+
+    def test_price_sort_keeps_only_relevant_matches(self):
+        # «هارمان کاردن» سه trigram از چهار trigram «هارد» را دارد؛ نباید ارزان‌ترین هارد باشد
+        self.assertEqual(self.search("q=هارد&sort=price"), [self.western, self.seagate])
+        self.assertEqual(self.search("q=هارد&sort=-price"), [self.seagate, self.western])
+
+    def test_filters_without_query(self):
+        self.assertEqual(self.search("max_price=1000000"), ["فلش سندیسک", self.harman])
+        self.assertEqual(self.search("category=هارد&sort=-price&page_size=1"), [self.seagate])
+
+
+# ================== خزنده ==================
+class ListSink:
+    def __init__(self):
+        self.products = []
+        self.categories = {}
+
+    def write(self, products, category_url: str = ""):
+        self.products.extend(products)
+
+    def category_done(self, name: str, unchanged_links, complete: bool):
+        self.categories[name] = complete
+
+
+class FlakyHomeBackend:
+    # صفحه اصلی چند بار اول خطا می‌دهد؛ همه دسته‌ها خالی‌اند
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    async def categories(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise PageError("HTTP 503: home")
+        return [("https://www.ehadish.com/products/category-hdd/", "هارد")]
+
+    async def listing(self, category_url, page_num, category_name):
+        return None
+
+
+@mock.patch("chat_bot.crawler.crawl.backoff_delay", lambda attempt: 0)
+class ScrapeSiteRetryTests(SimpleTestCase):
+    def test_home_page_is_retried(self):
+        backend, sink = FlakyHomeBackend(failures=2), ListSink()
+        asyncio.run(scrape_site(backend, sink, retries=3))
+        self.assertEqual(backend.calls, 3)
+        self.assertEqual(sink.categories, {"هارد": True})
+
+    def test_home_page_error_after_retries(self):
+        backend = FlakyHomeBackend(failures=5)
+        with self.assertRaises(PageError):
+            asyncio.run(scrape_site(backend, ListSink(), retries=2))
+        self.assertEqual(backend.calls, 3)
+
+
+def card(product_id, title, price):
+    return (
+        '<div class="bx-product">'
+        f'<h2><a href="/product/category-hdd/{product_id}/">  {title}\n</a></h2>'
+        f'<div class="bx-price">{price}</div>'
+        "</div>"
+    )
+
+
+def page_html(*cards):
+    return f'<html><body><div class="products">{"".join(cards)}</div></body></html>'
+
+
+class FakeBrowser:
+    # جای BrowserBackend در fallback؛ Chromium لازم نیست
+    def __init__(self):
+        self.calls = []
+
+    async def listing(self, category_url, page_num, category_name):
+        self.calls.append((category_url, page_num, category_name))
+        return [{"title": "کارت JS", "link": f"{category_url}js/", "price": "1,000 تومان",
+                 "price_value": 1000, "categories": [category_name]}]
+
+
+class HttpBackendFixtureTests(SimpleTestCase):
+    # صفحه‌های ذخیره‌شده از پوشه، با FixtureSite روی یک سرور HTTP محلی
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name)
+        pages = {
+            "index.html": '<html><body><nav><a href="/products/category-hdd/">هارد</a>'
+                          '<a href="/products/category-js/">دسته JS</a><a href="/about/">درباره</a></nav></body></html>',
+            "category-hdd/page-1.html": page_html(card(1, "هارد وسترن ۲ ترابایت", "۱,۷۰۰,۰۰۰ تومان"),
+                                                  card(2, "هارد ناموجود", "")),
+            "category-hdd/page-2.html": page_html(card(3, "هارد سیگیت", "2,100,000 تومان")),
+            # صفحه‌ای که کارت‌هایش با JS ساخته می‌شوند
+            "category-js/page-1.html": '<html><body><div id="app"></div><script src="/app.js"></script></body></html>',
+        }
+        for name, html in pages.items():
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            (root / name).write_text(html, encoding="utf-8")
+        server = start_fixture_server(FixtureSite(directory=root))
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = server.base_url
+
+    async def crawl(self, **kwargs):
+        sink = ListSink()
+        browser = FakeBrowser()
+        async with HttpBackend(self.base_url, **kwargs) as backend:
+            with mock.patch.object(backend, "browser", mock.AsyncMock(return_value=browser)):
+                await scrape_site(backend, sink, max_page=5)
+        return sink, browser
+
+    def test_parse_listing(self):
+        rows = parse_listing(page_html(card(1, "هارد", "1,000 تومان"), '<div class="bx-product"></div>'))
+        self.assertEqual(rows, [
+            {"title": "هارد", "href": "/product/category-hdd/1/", "price": "1,000 تومان"},
+            {"title": None, "href": None, "price": ""},
+        ])
+
+    def test_crawl_extracts_products_until_the_last_page(self):
+        sink, browser = asyncio.run(self.crawl())
+        hdd = [p for p in sink.products if p["categories"] == ["هارد"]]
+        # صفحه‌های یک دسته هم‌زمان گرفته می‌شوند؛ ترتیب ثابت نیست
+        self.assertEqual(sorted((p["link"], p["title"], p["price_value"]) for p in hdd), [
+            (f"{self.base_url}/product/category-hdd/1/", "هارد وسترن 2 ترابایت", 1700000),
+            (f"{self.base_url}/product/category-hdd/3/", "هارد سیگیت", 2100000),
+        ])
+        # صفحه ۳ کارتی ندارد: دسته کامل تمام شده است
+        self.assertEqual(sink.categories, {"هارد": True, "دسته JS": True})
+
+    def test_js_only_page_falls_back_to_browser(self):
+        sink, browser = asyncio.run(self.crawl())
+        self.assertEqual(browser.calls, [(f"{self.base_url}/products/category-js/", 1, "دسته JS")])
+        self.assertIn("کارت JS", [p["title"] for p in sink.products])
+
+    def test_no_fallback_without_js_fallback(self):
+        sink, browser = asyncio.run(self.crawl(js_fallback=False))
+        self.assertEqual(browser.calls, [])
+        self.assertNotIn("کارت JS", [p["title"] for p in sink.products])
+
+    def test_not_modified_page_is_unchanged(self):
+        async def fetch_twice():
+            state = CrawlState()
+            async with HttpBackend(self.base_url, state=state) as backend:
+                url = f"{self.base_url}/products/category-hdd/"
+                first = await backend.listing(url, 1, "هارد")
+                self.assertTrue(state.conditional_headers(f"{url}?page=1"))
+                return first, await backend.listing(url, 1, "هارد")
+
+        first, second = asyncio.run(fetch_twice())
+        self.assertEqual(len(first), 1)
+        self.assertIsInstance(second, UnchangedPage)
+        self.assertEqual(second.links, [first[0]["link"]])
+
+
+class PagedBackend:
+    # دسته‌ای با pages صفحه پر؛ صفحه بعدی خالی است
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+
+    async def listing(self, category_url, page_num, category_name):
+        self.requested.append(page_num)
+        if page_num > self.pages:
+            return []
+        return [{"link": f"{category_url}{page_num}", "categories": [category_name]}]
+
+
+class ScrapeCategoryTests(SimpleTestCase):
+    def test_first_empty_page_ends_category(self):
+        backend = PagedBackend(pages=2)
+        pages = {}
+
+        async def on_page(page_num, result):
+            pages[page_num] = result
+
+        complete = asyncio.run(scrape_category(backend, ConcurrencyLimiter(1), "/c/", "هارد", on_page, max_page=10))
+        self.assertTrue(complete)
+        # صفحه‌هایی که بعد از صفحه خالی در صف بودند دیگر درخواست نمی‌شوند
+        self.assertEqual(sorted(backend.requested), [1, 2, 3])
+        self.assertEqual({n: bool(result) for n, result in pages.items()}, {1: True, 2: True, 3: False})
+
+
+class AdaptiveLimiterTests(SimpleTestCase):
+    def test_grows_per_round_and_halves_on_error(self):
+        async def run():
+            limiter = AdaptiveLimiter(4, minimum=2, maximum=5, target_latency=60)
+            for _ in range(4):
+                await limiter.record(time.perf_counter(), ok=True)
+            grown = limiter.limit
+            in_flight = time.perf_counter()
+            await limiter.record(time.perf_counter(), ok=False)
+            halved = limiter.limit
+            # درخواستی که قبل از کاهش رفته بود دوباره کم نمی‌کند
+            await limiter.record(in_flight, ok=False)
+            await limiter.record(time.perf_counter(), ok=False)
+            return grown, halved, limiter.limit, limiter.errors
+
+        with mock.patch("builtins.print"):
+            grown, halved, lowest, errors = asyncio.run(run())
+        self.assertAlmostEqual(grown, 5, places=0)
+        self.assertAlmostEqual(halved, grown / 2)
+        self.assertEqual((lowest, errors), (2, 3))
+
+    def test_limit_bounds_concurrent_holders(self):
+        async def run():
+            limiter = ConcurrencyLimiter(2)
+            peak = 0
+
+            async def hold():
+                nonlocal peak
+                async with limiter:
+                    peak = max(peak, limiter.active)
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(*(hold() for _ in range(6)))
+            return peak
+
+        self.assertEqual(asyncio.run(run()), 2)
+
+
+class ResourcePolicyTests(SimpleTestCase):
+    def request(self, url, resource_type="document", method="GET"):
+        return SimpleNamespace(url=url, resource_type=resource_type, method=method)
+
+    def test_allows_only_site_documents_and_scripts(self):
+        policy = ResourcePolicy("https://www.ehadish.com", allowed_hosts=("cdn.example.net",))
+        cases = {
+            ("https://ehadish.com/products/", "document"): True,
+            ("https://cdn.ehadish.com/app.js", "script"): True,
+            ("https://cdn.example.net/lib.js", "script"): True,
+            ("https://www.ehadish.com/logo.png", "image"): False,
+            ("https://www.ehadish.com/font.woff2", "font"): False,
+            ("https://analytics.example.com/t.js", "script"): False,
+            ("https://notehadish.com/x.js", "script"): False,
+        }
+        for (url, resource_type), allowed in cases.items():
+            with self.subTest(url=url, resource_type=resource_type):
+                self.assertEqual(policy.allows(self.request(url, resource_type)), allowed)
+
+    def test_blocks_and_caches_routes(self):
+        policy = ResourcePolicy("https://www.ehadish.com")
+        response = mock.Mock(ok=True, status=200, headers={"content-type": "text/javascript"})
+        response.body = mock.AsyncMock(return_value=b"app()")
+
+        async def run():
+            routes = [mock.AsyncMock() for _ in range(4)]
+            routes[2].fetch.return_value = response
+            await policy.handle(routes[0], self.request("https://www.ehadish.com/a.png", "image"))
+            await policy.handle(routes[1], self.request("https://www.ehadish.com/", "document"))
+            await policy.handle(routes[2], self.request("https://www.ehadish.com/app.js", "script"))
+            await policy.handle(routes[3], self.request("https://www.ehadish.com/app.js", "script"))
+            return routes
+
+        image, page, first, second = asyncio.run(run())
+        image.abort.assert_awaited_once_with("blockedbyclient")
+        page.continue_.assert_awaited_once()
+        first.fulfill.assert_awaited_once_with(response=response, body=b"app()")
+        second.fetch.assert_not_called()
+        second.fulfill.assert_awaited_once_with(status=200, headers={"content-type": "text/javascript"}, body=b"app()")
+        self.assertEqual((policy.allowed, policy.blocked, policy.cache_hits), (3, 1, 1))
+
+
+class JsonlSinkTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "all_products.jsonl"
+
+    def item(self, site_id, category):
+        return {"title": f"محصول {site_id}", "link": f"https://www.ehadish.com/product/c/{site_id}-p/",
+                "price": "1,000", "categories": [category]}
+
+    def read(self):
+        return [(p["title"], p["categories"], p["category_ids"]) for p in iter_products(self.path)]
+
+    def test_duplicates_are_merged_on_finalize(self):
+        sink = JsonlSink(self.path)
+        sink.write([self.item(1, "هارد"), self.item(2, "هارد")])
+        sink.write([self.item(1, "حافظه SSD")])
+        self.assertFalse(self.path.exists())
+        sink.finalize()
+        self.assertEqual(self.read(), [
+            ("محصول 1", ["هارد", "حافظه SSD"], ["هارد", "حافظه-ssd"]),
+            ("محصول 2", ["هارد"], ["هارد"]),
+        ])
+        self.assertFalse(sink.partial_path.exists())
+        self.assertEqual(sink.written, 3)
+
+    def test_append_resumes_from_finished_output(self):
+        sink = JsonlSink(self.path)
+        sink.write([self.item(1, "هارد")])
+        sink.finalize()
+        sink = JsonlSink(self.path, append=True)
+        sink.write([self.item(2, "فلش"), self.item(1, "فلش")])
+        sink.finalize()
+        self.assertEqual(self.read(), [
+            ("محصول 1", ["هارد", "فلش"], ["هارد", "فلش"]),
+            ("محصول 2", ["فلش"], ["فلش"]),
+        ])
+
+
+# ================== /metrics ==================
+class MetricsViewTests(SimpleTestCase):
+    def metrics(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_counts_requests_by_view_and_status(self):
+        requests = 'chat_http_requests_total{view="product_search",method="GET",status="400"}'
+        count = 'chat_http_request_duration_seconds_count{view="product_search"}'
+        before = self.metrics()
+        self.client.get("/api/products?page=0")
+        after = self.metrics()
+        self.assertEqual(after[requests] - before.get(requests, 0), 1)
+        self.assertEqual(after[count] - before.get(count, 0), 1)
+        self.assertEqual(after['chat_http_request_duration_seconds_bucket{view="product_search",le="+Inf"}'],
+                         after[count])
+        for name in ("chat_llm_inflight", "chat_response_cache_hit_ratio",
+                     'chat_response_cache_events_total{event="misses"}'):
+            self.assertIn(name, after)
+
+
+# ================== کش پاسخ‌ها ==================
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ResponseCache(similarity=0.8, max_vectors=3, max_candidates=2)
+        self.cache.backend.clear()
+
+    def get(self, question, version="v1"):
+        return asyncio.run(self.cache.aget(question, version))
+
+    def put(self, question, value, version="v1"):
+        asyncio.run(self.cache.aset(question, version, value))
+
+    def test_exact_and_trigram_hits(self):
+        self.put("هزینه ارسال سفارش چقدر است؟", "ارسال")
+        self.assertEqual(self.get("  هزینه ارسال  سفارش چقدر است؟"), "ارسال")
+        self.assertEqual(self.get("هزینه ارسال سفارش چقدر هست"), "ارسال")
+        self.assertIsNone(self.get("روش های پرداخت"))
+        self.assertIsNone(self.get("هزینه ارسال سفارش چقدر است؟", version="v2"))
+        stats = asyncio.run(self.cache.astats())
+        self.assertEqual((stats["exact_hits"], stats["similar_hits"], stats["misses"]), (1, 1, 2))
+
+    def test_numbers_must_match(self):
+        self.put("لپ تاپ زیر 20 میلیون", "۲۰")
+        self.assertIsNone(self.get("لپ تاپ زیر 10 میلیون"))
+        self.assertEqual(self.get("لپتاپ زیر 20 میلیون"), "۲۰")
+
+    def test_only_recent_candidates_are_scanned(self):
+        self.put("هزینه ارسال سفارش چقدر است؟", "قدیمی")
+        self.put("روش های پرداخت اقساطی", "پرداخت")
+        self.put("ساعت کاری پشتیبانی", "پشتیبانی")
+        # فقط دو بردار آخر این دسته مقایسه می‌شوند
+        self.assertIsNone(self.get("هزینه ارسال سفارش چقدر هست"))
+        self.assertEqual(self.get("روش های پرداخت اقساطی چیست"), "پرداخت")
+
+    def test_vectors_are_bounded(self):
+        for i, question in enumerate(["ارسال", "پرداخت", "گارانتی", "مرجوعی"]):
+            self.put(f"سوال درباره {question}", i)
+        self.assertEqual(len(self.cache._vectors), 3)
+        self.assertEqual(sum(len(v) for v in self.cache._buckets.values()), 3)
+
+
+# ================== اجرای production ==================
+class GunicornConfigTests(SimpleTestCase):
+    def load(self):
+        from gunicorn.config import Config
+
+        # مثل gunicorn: نام‌های سطح ماژول که تنظیم gunicorn هستند
+        cfg = Config()
+        for name, value in runpy.run_path(str(settings.BASE_DIR / "gunicorn.conf.py")).items():
+            if name in cfg.settings:
+                cfg.set(name, value)
+        return cfg
+
+    def test_uvicorn_worker_with_preload(self):
+        from gunicorn.workers.base import Worker
+
+        cfg = self.load()
+        self.assertTrue(issubclass(cfg.worker_class, Worker))
+        self.assertEqual(cfg.worker_class_str, "uvicorn_worker.UvicornWorker")
+        self.assertTrue(cfg.preload_app)
+
+    def test_hooks_warm_up_master_and_reopen_in_workers(self):
+        cfg = self.load()
+        server = mock.Mock()
+        with mock.patch("chat_bot.warmup.warm_up", return_value={"import": 0.5, "catalog": 0.02}) as warm_up:
+            cfg.when_ready(server)
+        warm_up.assert_called_once_with()
+        server.log.info.assert_called_once_with("warm-up: %s", "import 500 ms, catalog 20 ms")
+        with mock.patch("chat_bot.warmup.after_fork") as after_fork:
+            cfg.post_fork(server, mock.Mock())
+        after_fork.assert_called_once_with()
+
+
+class EntrypointTests(SimpleTestCase):
+    def run_entrypoint(self, migrate_status):
+        # python جعلی فقط آرگومان‌هایش را ثبت می‌کند
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        log = Path(tmp.name) / "python.log"
+        python = Path(tmp.name) / "python"
+        python.write_text(f'#!/bin/sh\necho "$@" >> "{log}"\nexit {migrate_status}\n')
+        python.chmod(0o755)
+        result = subprocess.run(
+            ["sh", str(settings.BASE_DIR / "docker-entrypoint.sh"), "echo", "serving"],
+            capture_output=True, text=True, env={**os.environ, "PATH": f"{tmp.name}:{os.environ['PATH']}"},
+        )
+        return result, log.read_text()
+
+    def test_migrates_then_runs_command(self):
+        result, calls = self.run_entrypoint(0)
+        self.assertEqual(calls, "manage.py migrate --noinput\n")
+        self.assertEqual((result.returncode, result.stdout), (0, "serving\n"))
+
+    def test_failed_migration_stops_start(self):
+        result, _ = self.run_entrypoint(1)
+        self.assertEqual((result.returncode, result.stdout), (1, ""))
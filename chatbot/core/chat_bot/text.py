@@ -0,0 +1,113 @@
+import re
+
+# ================== یکسان‌سازی متن فارسی ==================
+# ی و ک عربی، ارقام فارسی/عربی و نیم‌فاصله در عنوان‌ها و پیام کاربران
+# به‌صورت ناهمگون می‌آیند؛ قبل از مقایسه همه را به یک شکل درمی‌آوریم.
+_CHAR_MAP = str.maketrans({
+    "ي": "ی",
+    "ى": "ی",
+    "ك": "ک",
+    "ة": "ه",
+    "أ": "ا",
+    "إ": "ا",
+    "آ": "ا",
+    "ؤ": "و",
+    "\u200c": " ",  # نیم‌فاصله
+    "\u200f": "",
+    "\u200e": "",
+})
+_DIGIT_MAP = str.maketrans({
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # ارقام فارسی
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # ارقام عربی
+    "٬": ",",
+    "٫": ".",
+})
+_DIACRITICS_RE = re.compile("[\u064b-\u0652\u0670\u0640]")
+_NON_WORD_RE = re.compile(r"[^\w]+")
+_PRICE_NUMBER_RE = re.compile(r"\d+(?:,\d+)*")
+
+
+def normalize_digits(text: str) -> str:
+    return text.translate(_DIGIT_MAP)
+
+
+def normalize_text(text: str) -> str:
+    text = normalize_digits(text.translate(_CHAR_MAP)).lower()
+    text = _DIACRITICS_RE.sub("", text)
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+def parse_price(text: str):
+    # محصول تخفیف‌دار دو قیمت دارد («91,900,000 \n93,900,000»)؛ قیمت فعلی کمترین است
+    amounts = [int(number.replace(",", "")) for number in _PRICE_NUMBER_RE.findall(normalize_digits(text))]
+    return min(amounts) if amounts else None
+
+
+def clean_text(text: str) -> str:
+    # فقط ارقام و فاصله‌ها؛ حروف برای نمایش دست نمی‌خورند
+    return " ".join(normalize_digits(text).replace("\u200f", "").replace("\u200e", "").split())
+
+
+def category_id(name: str) -> str:
+    # شناسه پایدار دسته از روی نامش: «حافظه SSD» -> «حافظه-ssd»
+    return normalize_text(name).replace(" ", "-")
+
+
+def normalize_product(product):
+    # خروجی اسکرپر (و هر رکورد قدیمی هنگام ساخت snapshot) از این رد می‌شود؛
+    # روی رکورد نرمال‌شده دوباره اجرا شود همان را برمی‌گرداند.
+    price_value = parse_price(product.get("price") or "")
+    categories = []
+    for name in product.get("categories", []):
+        name = clean_text(name)
+        if name and name not in categories:
+            categories.append(name)
+    return {
+        "title": clean_text(product["title"]),
+        "link": product["link"],
+        "price": f"{price_value:,}" if price_value is not None else clean_text(product.get("price") or ""),
+        "price_value": price_value,
+        "categories": categories,
+        "category_ids": [category_id(name) for name in categories],
+    }
+
+
+# ================== بازه قیمت در پیام کاربر ==================
+# «زیر ۲۰ میلیون»، «بیشتر از ۵۰۰ هزار تومان»، «بین ۱۰ تا ۱۵ میلیون»؛ عدد بدون
+# واحد فقط وقتی قیمت حساب می‌شود که خودش بزرگ باشد (نه «A55» یا «۱۶ گیگ»).
+_PRICE_UNITS = {"هزار": 1_000, "میلیون": 1_000_000, "میلیارد": 1_000_000_000}
+_AMOUNT = r"(\d+(?:[.,]\d+)*)\s*(هزار|میلیون|میلیارد)?"
+_PRICE_BETWEEN_RE = re.compile(rf"بین\s+{_AMOUNT}\s*(?:تومان|تومن)?\s*(?:و|تا)\s+{_AMOUNT}")
+_PRICE_MAX_RE = re.compile(rf"(?:زیر|کمتر\s*از|ارزان\s*تر\s*از|حداکثر|تا\s*سقف|نهایتا)\s+{_AMOUNT}")
+_PRICE_MIN_RE = re.compile(rf"(?:بالای|بیشتر\s*از|گران\s*تر\s*از|حداقل|بالاتر\s*از)\s+{_AMOUNT}")
+MIN_BARE_PRICE = 10_000  # تومان
+
+
+def _amount(number: str, unit, default_unit=None):
+    if "," in number or number.count(".") > 1:
+        value = float(number.replace(",", "").replace(".", ""))
+    else:
+        value = float(number)
+    unit = unit or default_unit
+    if unit is None:
+        return int(value) if value >= MIN_BARE_PRICE else None
+    return int(value * _PRICE_UNITS[unit])
+
+
+def parse_price_range(text: str):
+    # (حداقل، حداکثر) به تومان؛ هر کدام که در متن نیامده None است
+    text = normalize_digits(text.translate(_CHAR_MAP))
+    match = _PRICE_BETWEEN_RE.search(text)
+    if match:
+        low_number, low_unit, high_number, high_unit = match.groups()
+        low, high = _amount(low_number, low_unit, high_unit), _amount(high_number, high_unit)
+        if low is not None and high is not None:
+            return min(low, high), max(low, high)
+    low = high = None
+    match = _PRICE_MAX_RE.search(text)
+    if match:
+        high = _amount(*match.groups())
+    match = _PRICE_MIN_RE.search(text)
+    if match:
+        low = _amount(*match.groups())
+    return low, high
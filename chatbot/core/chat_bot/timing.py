@@ -0,0 +1,47 @@
+import time
+from contextlib import contextmanager
+
+# ================== زمان‌سنجی مرحله‌های هر درخواست ==================
+# هر درخواست چت یک StageTimer دارد؛ مرحله‌ها (کاتالوگ، ساخت پرامپت، LLM، markdown،
+# رندر قالب، ...) جدا اندازه گرفته می‌شوند و در هدر Server-Timing (یا رویداد done
+# در stream) برمی‌گردند تا بنچمارک بتواند سربار خود ما را از زمان LLM جدا کند.
+# RequestMetricsMiddleware همین‌ها را در /metrics و لاگ درخواست‌ها ثبت می‌کند.
+
+
+class StageTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.marks = {}
+        # اطلاعات دیگر درخواست برای متریک‌ها: توکن‌ها، پاسخ از کش، ...
+        self.info = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def mark(self, name: str):
+        # فاصله از شروع درخواست تا اولین بار رسیدن به این نقطه (مثلاً ttft)
+        self.marks.setdefault(name, time.perf_counter() - self.started)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        # میلی‌ثانیه
+        values = {**self.stages, **self.marks, "total": self.total()}
+        return {name: round(seconds * 1000, 2) for name, seconds in values.items()}
+
+    def header(self) -> str:
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.as_dict().items())
+
+
+def request_timer(request) -> StageTimer:
+    # RequestMetricsMiddleware برای هر درخواست یکی می‌سازد؛ بدون آن (مثلاً در تست‌ها) همین‌جا
+    if getattr(request, "timer", None) is None:
+        request.timer = StageTimer()
+    return request.timer
@@ -1,7 +1,11 @@
 from django.urls import path
-from .views import ChatView
+from .views import CacheStatsView, ChatView, ChatStreamView, MetricsView, ProductSearchView
 
 urlpatterns = [
     path("", ChatView.as_view(), name="chat"),
+    path("stream/", ChatStreamView.as_view(), name="chat_stream"),
+    path("cache/stats/", CacheStatsView.as_view(), name="chat_cache_stats"),
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    path("api/products", ProductSearchView.as_view(), name="product_search"),
 ]
 
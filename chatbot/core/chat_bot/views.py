@@ -1,103 +1,360 @@
-import json
+import math
 from pathlib import Path
+from asgiref.sync import sync_to_async
 from decouple import config
-from django.views.generic import TemplateView
+from django.conf import settings
+from django.views.generic import TemplateView, View
 from django.template.loader import render_to_string
-from django.http import HttpResponse, StreamingHttpResponse
-import tiktoken
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 import markdown
-from langchain_openai import ChatOpenAI
-from langchain.schema import SystemMessage, HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from .admission import AdmissionController, Overloaded, RateLimited, TokenBuckets
+from .cache import ResponseCache
+from .llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable, make_chat_model
+from .catalog import SORTS, Catalog, CatalogStore, ProductFilter
+from .markdown_stream import IncrementalMarkdown
+from .memory import ConversationMemory
+from .sse import with_heartbeat
+from .prompts import get_token_counter
+from .metrics import registry, render_cache_stats
+from .text import category_id, normalize_digits
+from .timing import StageTimer, request_timer
 
 # ================== تنظیمات ==================
 API_KEY = config("API_KEY")
 API_URL = config("API_URL")
 MODEL_NAME = "gpt-4o-mini"
 TARGET_WEB = "ehadish.com"
-JSON_PATH = Path(__file__).resolve().parent.parent / "all_products.json"
-
-try:
-    with open(JSON_PATH, "r", encoding="utf-8") as f:
-        PRODUCTS_DATA = json.load(f)
-except FileNotFoundError:
-    PRODUCTS_DATA = []
-
-llm = ChatOpenAI(
-    model=MODEL_NAME,
-    base_url=API_URL,
-    api_key=API_KEY,
+JSON_PATH = Path(config("CATALOG_PATH", default=str(Path(__file__).resolve().parent.parent / "all_products.jsonl")))
+SNAPSHOT_PATH = JSON_PATH.with_suffix(".sqlite3")
+# فقط top-k محصول مرتبط با سوال وارد پرامپت می‌شود؛ کاتالوگ‌های کوچک‌تر از
+# RETRIEVAL_MIN_PRODUCTS همچنان کامل فرستاده می‌شوند.
+RETRIEVAL_TOP_K = config("RETRIEVAL_TOP_K", default=15, cast=int)
+RETRIEVAL_MIN_PRODUCTS = config("RETRIEVAL_MIN_PRODUCTS", default=50, cast=int)
+CATALOG_CHECK_INTERVAL = config("CATALOG_CHECK_INTERVAL", default=1.0, cast=float)
+SSE_HEARTBEAT_INTERVAL = config("SSE_HEARTBEAT_INTERVAL", default=15.0, cast=float)
+# 0 لایه شباهت کش را خاموش می‌کند؛ مثلاً 0.9 سوال‌های تقریباً یکسان را هم از کش جواب می‌دهد
+CHAT_CACHE_SIMILARITY = config("CHAT_CACHE_SIMILARITY", default=0.0, cast=float)
+# سقف توکن تاریخچه گفتگو که همراه هر سوال فرستاده می‌شود
+HISTORY_TOKEN_BUDGET = config("HISTORY_TOKEN_BUDGET", default=1500, cast=int)
+# بازه قیمت/دسته‌ای که در سوال آمده («زیر ۲۰ میلیون») قبل از رتبه‌بندی محصولات اعمال می‌شود
+RETRIEVAL_FILTERS = config("RETRIEVAL_FILTERS", default=True, cast=bool)
+PRODUCTS_PAGE_SIZE = 20  # /api/products
+PRODUCTS_MAX_PAGE_SIZE = 100
+# اتصال به API مدل: سقف اتصال‌های هم‌زمان این پروسه، مهلت‌ها (ثانیه) و circuit breaker
+LLM_MAX_CONNECTIONS = config("LLM_MAX_CONNECTIONS", default=100, cast=int)
+LLM_CONNECT_TIMEOUT = config("LLM_CONNECT_TIMEOUT", default=5.0, cast=float)
+LLM_FIRST_TOKEN_TIMEOUT = config("LLM_FIRST_TOKEN_TIMEOUT", default=20.0, cast=float)
+LLM_DEADLINE = config("LLM_DEADLINE", default=60.0, cast=float)
+LLM_MAX_RETRIES = config("LLM_MAX_RETRIES", default=1, cast=int)
+LLM_BREAKER_FAILURES = config("LLM_BREAKER_FAILURES", default=5, cast=int)
+LLM_BREAKER_COOLDOWN = config("LLM_BREAKER_COOLDOWN", default=30.0, cast=float)
+# کنترل پذیرش (هر پروسه): فراخوانی‌های هم‌زمان LLM، صف انتظار، سهم هر session از صف
+# و مهلت ماندن در صف؛ سهمیه توکن هر session در دقیقه (0 یعنی بدون سهمیه)
+LLM_MAX_CONCURRENT = config("LLM_MAX_CONCURRENT", default=20, cast=int)
+LLM_QUEUE_SIZE = config("LLM_QUEUE_SIZE", default=100, cast=int)
+LLM_QUEUE_PER_CLIENT = config("LLM_QUEUE_PER_CLIENT", default=2, cast=int)
+LLM_QUEUE_TIMEOUT = config("LLM_QUEUE_TIMEOUT", default=10.0, cast=float)
+CHAT_TOKENS_PER_MINUTE = config("CHAT_TOKENS_PER_MINUTE", default=20000, cast=int)
+CHAT_TOKENS_BURST = config("CHAT_TOKENS_BURST", default=40000, cast=int)
+# وقتی API مدل در دسترس نیست یا مهلتش گذشته، به جای پیام خطا
+DEGRADED_REPLY = (
+    "در حال حاضر امکان پاسخ‌گویی وجود ندارد؛ لطفاً چند لحظه دیگر دوباره امتحان کنید.\n\n"
+    "فهرست محصولات و قیمت‌ها در سایت **ehadish.com** همچنان در دسترس است."
+)
+BUSY_REPLY = "سرور در حال حاضر شلوغ است؛ لطفاً چند لحظه دیگر دوباره امتحان کنید."
+RATE_LIMITED_REPLY = "تعداد پیام‌های شما در چند دقیقه اخیر زیاد بوده؛ لطفاً {seconds} ثانیه دیگر دوباره امتحان کنید."
+
+
+
+def new_llm():
+    return make_chat_model(
+        MODEL_NAME, API_URL, API_KEY,
+        max_connections=LLM_MAX_CONNECTIONS,
+        connect_timeout=LLM_CONNECT_TIMEOUT,
+        deadline=LLM_DEADLINE,
+        max_retries=LLM_MAX_RETRIES,
+    )
+
+
+# کلاینت مدل (و import سنگین langchain_openai/openai) اولین بار که لازم شود ساخته
+# می‌شود؛ زیر gunicorn با preload_app همان warm_up قبل از fork این کار را می‌کند.
+llm_gateway = LLMGateway(
+    factory=new_llm,
+    first_token_timeout=LLM_FIRST_TOKEN_TIMEOUT,
+    deadline=LLM_DEADLINE,
+    breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN),
+    admission=AdmissionController(LLM_MAX_CONCURRENT, LLM_QUEUE_SIZE, LLM_QUEUE_PER_CLIENT, LLM_QUEUE_TIMEOUT),
+)
+token_buckets = TokenBuckets(CHAT_TOKENS_PER_MINUTE, CHAT_TOKENS_BURST)
+
+catalog_store = CatalogStore(
+    JSON_PATH, SNAPSHOT_PATH, TARGET_WEB, MODEL_NAME, check_interval=CATALOG_CHECK_INTERVAL,
 )
+response_cache = ResponseCache(similarity=CHAT_CACHE_SIMILARITY)
 
 
 # ================== توابع کمکی ==================
 def num_tokens_from_messages(messages, model=MODEL_NAME):
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    return sum(len(encoding.encode(msg.content)) for msg in messages)
+    counter = get_token_counter(model)
+    return sum(counter.count(msg.content) for msg in messages)
 
 
 def convert_markdown_to_html(text: str) -> str:
     return markdown.markdown(text)
 
 
-# ================== منطق اصلی ربات ==================
-def build_messages(user_message: str):
-    products_context = "\n".join([
-        f"- {p['title']} (قیمت: {p['price']} تومان) | لینک: https://{TARGET_WEB}{p['link']}"
-        for p in PRODUCTS_DATA
-    ]) or "فعلاً محصولی موجود نیست."
+def select_products(catalog: Catalog, user_message: str):
+    if len(catalog) <= RETRIEVAL_MIN_PRODUCTS:
+        return None
+    product_filter = catalog.match_filter(user_message) if RETRIEVAL_FILTERS else None
+    if product_filter:
+        # اگر هیچ محصول فیلترشده‌ای با متن سوال جور نبود، ارزان‌ترین‌های همان بازه
+        return (catalog.search_ids(user_message, RETRIEVAL_TOP_K, product_filter)
+                or catalog.filter_ids(product_filter, limit=RETRIEVAL_TOP_K))
+    return catalog.search_ids(user_message, RETRIEVAL_TOP_K)
+
+
+def product_query(params):
+    # پارامترهای /api/products؛ مقدار نامعتبر ValueError می‌دهد
+    def number(name, default=None, minimum=0):
+        value = params.get(name, "").strip()
+        if not value:
+            return default
+        try:
+            value = int(normalize_digits(value).replace(",", ""))
+        except ValueError:
+            raise ValueError(f"{name} must be an integer") from None
+        if value < minimum:
+            raise ValueError(f"{name} must be at least {minimum}")
+        return value
+
+    sort = params.get("sort") or None
+    if sort is not None and sort not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    product_filter = ProductFilter(
+        [category_id(name) for name in params.getlist("category") if name.strip()],
+        number("min_price"),
+        number("max_price"),
+    )
+    return {
+        "query": params.get("q", ""),
+        "product_filter": product_filter,
+        "sort": sort,
+        "page": number("page", 1, minimum=1),
+        "page_size": min(number("page_size", PRODUCTS_PAGE_SIZE, minimum=1), PRODUCTS_MAX_PAGE_SIZE),
+    }
+
+
+def search_products(catalog: Catalog, query: str, product_filter: ProductFilter, sort, page: int, page_size: int):
+    # یک محصول بیشتر از اندازه صفحه خوانده می‌شود تا بدون COUNT معلوم شود صفحه بعدی هست یا نه
+    ids = catalog.query_ids(query, product_filter, sort, page_size + 1, (page - 1) * page_size)
+    return catalog.products(ids[:page_size]), len(ids) > page_size
+
+
+def new_memory(session) -> ConversationMemory:
+    return ConversationMemory(session, HISTORY_TOKEN_BUDGET, get_token_counter(MODEL_NAME))
+
+
+def client_key(request) -> str:
+    # سهم صف پذیرش و سهمیه توکن: session اگر هست، وگرنه IP. session همین‌جا ساخته
+    # نمی‌شود وگرنه هر درخواست بی‌کوکی یک ردیف دیتابیس و سهمیه تازه می‌گرفت؛
+    # بعد از aload صدا زده شود تا کلید ساختگی که در دیتابیس نیست حساب نشود
+    return request.session.session_key or f"addr:{request.META.get('REMOTE_ADDR', '')}"
+
+
+async def reserve_session(request, response):
+    # کوکی stream باید همراه هدرها برود ولی ردیف session بعد از پذیرش، در پایان
+    # stream ساخته می‌شود؛ اینجا فقط یک کلید آزاد رزرو و در کوکی گذاشته می‌شود
+    session = request.session
+    session._session_key = await session._aget_new_session_key()
+    max_age = None if session.get_expire_at_browser_close() else session.get_expiry_age()
+    response.set_cookie(
+        settings.SESSION_COOKIE_NAME,
+        session.session_key,
+        max_age=max_age,
+        domain=settings.SESSION_COOKIE_DOMAIN,
+        path=settings.SESSION_COOKIE_PATH,
+        secure=settings.SESSION_COOKIE_SECURE or None,
+        httponly=settings.SESSION_COOKIE_HTTPONLY or None,
+        samesite=settings.SESSION_COOKIE_SAMESITE,
+    )
+
 
+def busy_reply(error: Overloaded) -> str:
+    if isinstance(error, RateLimited):
+        return convert_markdown_to_html(RATE_LIMITED_REPLY.format(seconds=math.ceil(error.retry_after)))
+    return convert_markdown_to_html(BUSY_REPLY)
+
+
+# ================== منطق اصلی ربات ==================
+def build_messages(user_message: str, catalog: Catalog = None, memory: ConversationMemory = None,
+                   timer: StageTimer = None):
+    # history و retrieval زیرمرحله‌های prompt هستند
+    timer = timer or StageTimer()
+    catalog = catalog or catalog_store.get()
+    with timer.stage("history"):
+        history = memory.window() if memory else []
+    # سوال‌های پیگیری («قیمتش چنده؟») بدون سوال قبلی محصول مرتبطی پیدا نمی‌کنند
+    query = f"{memory.last_question()} {user_message}" if memory else user_message
+    with timer.stage("retrieval"):
+        product_ids = select_products(catalog, query)
     return [
-        SystemMessage(content=(
-            f"تو یک دستیار حرفه‌ای پشتیبانی برای فروشگاه آنلاین {TARGET_WEB} هستی. "
-            "همیشه مودبانه و واضح به فارسی پاسخ بده. "
-            "وظایف تو شامل پاسخ به سوالات مشتریان درباره خرید، پرداخت، پیگیری سفارش، بازگشت کالا و مشکلات احتمالی است. "
-            "اگر سوال درباره مشخصات یا قابلیت‌های محصولات باشد، می‌توانی **با توجه به مشخصات سخت‌افزاری، پیش‌بینی تقریبی بدهی** که محصول برای کار خاصی مناسب است یا نه. "
-            "مثلاً اگر مشتری بپرسد آیا لپ‌تاپ برای بازی یا کار خواستی X مناسب است، با توجه به CPU، GPU و RAM، راهنمایی تقریبی بده. "
-            "همیشه تاکید کن که این پیش‌بینی تقریبی است و عملکرد واقعی ممکن است متفاوت باشد. "
-            "لیست محصولات فروشگاه برای راهنمایی:\n\n"
-            f"{products_context}\n\n"
-            "اگر سوال خارج از محدوده فروشگاه یا محصولات باشد، فقط بگو که نمی‌توانی پاسخ بدهی و هیچ اطلاعاتی اضافه نده."
-        )),
+        SystemMessage(content=catalog.prompt.render(product_ids)),
+        *history,
         HumanMessage(content=user_message),
     ]
 
-def chat_with_bot(user_message: str):
-    messages = build_messages(user_message)
+async def get_catalog() -> Catalog:
+    # ممکن است snapshot کاتالوگ را از نو بسازد؛ نباید event loop را قفل کند.
+    return await sync_to_async(catalog_store.get, thread_sensitive=False)()
+
+
+async def cached_reply(user_message: str, catalog: Catalog, memory: ConversationMemory = None):
+    # پاسخ سوال پیگیری به تاریخچه بستگی دارد؛ کش فقط برای اولین سوال گفتگوست
+    if memory:
+        return None
+    cached = await response_cache.aget(user_message, catalog.version)
+    if cached is not None and memory is not None:
+        await memory.aappend(user_message, cached["reply"])
+    return cached
+
+
+async def chat_with_bot(user_message: str, memory: ConversationMemory = None, timer: StageTimer = None,
+                        client: str = ""):
+    # اگر درخواست پذیرفته نشود (صف پر، سهمیه توکن) Overloaded بالا می‌رود
+    timer = timer or StageTimer()
+    with timer.stage("catalog"):
+        catalog = await get_catalog()
+    with timer.stage("cache"):
+        cached = await cached_reply(user_message, catalog, memory)
+    if cached is not None:
+        timer.info["source"] = "cache"
+        return cached["html"], {**cached["usage"], "cached": True}
+
+    with timer.stage("prompt"):
+        messages = await sync_to_async(build_messages, thread_sensitive=False)(user_message, catalog, memory, timer)
 
     try:
-        response = llm.invoke(messages)
+        with timer.stage("tokens"):
+            prompt_tokens = num_tokens_from_messages(messages)
+        token_buckets.take(client, prompt_tokens)
+        with timer.stage("llm"):
+            response = await llm_gateway.ainvoke(messages, timer.info, client)
         assistant_reply = response.content.strip()
-        assistant_reply_html = convert_markdown_to_html(assistant_reply)
+        with timer.stage("markdown"):
+            # تاریخچه و کش متن خام با شناسه‌های کوتاه را نگه می‌دارند؛ لینک فقط در HTML
+            assistant_reply_html = convert_markdown_to_html(catalog.expand_refs(assistant_reply))
 
-        prompt_tokens = num_tokens_from_messages(messages)
-        completion_tokens = len(tiktoken.encoding_for_model(MODEL_NAME).encode(assistant_reply))
+        with timer.stage("tokens"):
+            completion_tokens = get_token_counter(MODEL_NAME).count(assistant_reply)
+        token_buckets.charge(client, completion_tokens)
         usage_info = {
             "prompt_tokens": prompt_tokens,
             "completion_tokens": completion_tokens,
             "total_tokens": prompt_tokens + completion_tokens
         }
+        timer.info.update(usage_info, source="llm")
 
+        with timer.stage("store"):
+            if not memory:
+                await response_cache.aset(user_message, catalog.version, {
+                    "reply": assistant_reply,
+                    "html": assistant_reply_html,
+                    "usage": usage_info,
+                })
+            if memory is not None:
+                await memory.aappend(user_message, assistant_reply)
         return assistant_reply_html, usage_info
+    except Overloaded as e:
+        timer.info.update(source="busy", error=e.reason)
+        raise
+    except LLMUnavailable as e:
+        timer.info.update(source="degraded", error=str(e))
+        return convert_markdown_to_html(DEGRADED_REPLY), {"error": str(e)}
     except Exception as e:
+        timer.info.update(source="error", error=str(e))
         return f"<p style='color:red'>Error: {e}</p>", {"error": str(e)}
 
 
-def chat_with_bot_stream(user_message: str):
-    messages = build_messages(user_message)
+async def chat_with_bot_stream(user_message: str, memory: ConversationMemory = None, timer: StageTimer = None,
+                               client: str = ""):
+    # رویدادها: token (متن خام تازه)، block (HTML بلوک‌های نهایی‌شده + متن خام باقی‌مانده) و error
+    timer = timer or StageTimer()
+    with timer.stage("catalog"):
+        catalog = await get_catalog()
+    with timer.stage("cache"):
+        cached = await cached_reply(user_message, catalog, memory)
+    if cached is not None:
+        timer.mark("ttft")
+        timer.info["source"] = "cache"
+        yield "block", {"html": cached["html"], "pending": ""}
+        return
+
+    with timer.stage("prompt"):
+        messages = await sync_to_async(build_messages, thread_sensitive=False)(user_message, catalog, memory, timer)
 
+    renderer = IncrementalMarkdown(preprocess=catalog.expand_refs)
+    blocks = []
+    reply = []
     try:
-        response_stream = llm.stream(messages)
-        for chunk in response_stream:
-            if chunk.content:
-                yield convert_markdown_to_html(chunk.content)
+        with timer.stage("tokens"):
+            prompt_tokens = num_tokens_from_messages(messages)
+        token_buckets.take(client, prompt_tokens)
+        # در stream زمان LLM با دو نشانه ttft (اولین توکن) و llm_done اندازه گرفته می‌شود
+        async for chunk in llm_gateway.astream(messages, timer.info, client):
+            if not chunk.content:
+                continue
+            timer.mark("ttft")
+            reply.append(chunk.content)
+            with timer.stage("markdown"):
+                html = renderer.feed(chunk.content)
+            if html:
+                blocks.append(html)
+                yield "block", {"html": html, "pending": renderer.pending()}
+            else:
+                yield "token", {"text": chunk.content}
+        with timer.stage("markdown"):
+            html = renderer.flush()
+        timer.mark("llm_done")
+        blocks.append(html)
+        yield "block", {"html": html, "pending": ""}
+
+        assistant_reply = "".join(reply).strip()
+        with timer.stage("tokens"):
+            completion_tokens = get_token_counter(MODEL_NAME).count(assistant_reply)
+        token_buckets.charge(client, completion_tokens)
+        usage_info = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        timer.info.update(usage_info, source="llm")
+        if not memory:
+            with timer.stage("store"):
+                await response_cache.aset(user_message, catalog.version, {
+                    "reply": assistant_reply,
+                    "html": "".join(blocks),
+                    "usage": usage_info,
+                })
+        if memory is not None:
+            with timer.stage("store"):
+                await memory.aappend(user_message, assistant_reply)
+    except Overloaded as e:
+        timer.info.update(source="busy", error=e.reason)
+        yield "block", {"html": busy_reply(e), "pending": ""}
+    except LLMUnavailable as e:
+        timer.info.update(source="degraded", error=str(e))
+        yield "block", {"html": convert_markdown_to_html(DEGRADED_REPLY), "pending": ""}
     except Exception as e:
-        yield f"<p style='color:red'>Error: {e}</p>"
+        timer.info.update(source="error", error=str(e))
+        yield "error", {"html": f"<p style='color:red'>Error: {e}</p>"}
 
 
 # ================== ویوها ==================
+# ویوها async هستند: زیر ASGI (core.asgi) هر گفتگوی در انتظار LLM فقط یک
+# coroutine است، نه یک thread کامل worker.
 class ChatView(TemplateView):
     template_name = "chat_bot/chat.html"
 
@@ -110,18 +367,98 @@ class ChatView(TemplateView):
         )
         return context
 
-    def post(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
+        return self.render_to_response(self.get_context_data(**kwargs))
+
+    async def post(self, request, *args, **kwargs):
+        timer = request_timer(request)
         user_input = request.POST.get("user_input", "")
-        response_html, usage_info = chat_with_bot(user_input)
-        html = render_to_string("chat_bot/message.html", {
-            "user_input": user_input,
-            "response": response_html
-        })
-        return HttpResponse(html)
+        with timer.stage("session"):
+            memory = await new_memory(request.session).aload()
+            client = client_key(request)
+        busy = None
+        try:
+            response_html, usage_info = await chat_with_bot(user_input, memory, timer, client)
+        except Overloaded as e:
+            busy = e
+            response_html = busy_reply(e)
+        with timer.stage("render"):
+            html = render_to_string("chat_bot/message.html", {
+                "user_input": user_input,
+                "response": response_html
+            })
+        response = HttpResponse(html)
+        if busy is not None:
+            response.status_code = busy.status
+            response["Retry-After"] = str(math.ceil(busy.retry_after))
+        # زمان هر مرحله سمت سرور (میلی‌ثانیه)؛ bench_chat و DevTools مرورگر آن را می‌خوانند
+        response["Server-Timing"] = timer.header()
+        return response
+
+
+class ProductSearchView(View):
+    async def get(self, request, *args, **kwargs):
+        try:
+            query = product_query(request.GET)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        timer = request_timer(request)
+        with timer.stage("catalog"):
+            catalog = await get_catalog()
+        with timer.stage("search"):
+            products, has_next = await sync_to_async(search_products, thread_sensitive=False)(catalog, **query)
+        return JsonResponse({
+            "page": query["page"],
+            "page_size": query["page_size"],
+            "has_next": has_next,
+            "results": products,
+        }, json_dumps_params={"ensure_ascii": False})
+
 
+class CacheStatsView(View):
+    async def get(self, request, *args, **kwargs):
+        return JsonResponse(await response_cache.astats())
 
-class ChatStreamView(TemplateView):
-    def post(self, request, *args, **kwargs):
+
+class MetricsView(View):
+    async def get(self, request, *args, **kwargs):
+        text = registry.render() + render_cache_stats(await response_cache.astats())
+        return HttpResponse(text, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class ChatStreamView(View):
+    async def post(self, request, *args, **kwargs):
+        timer = request_timer(request)
         user_input = request.POST.get("user_input", "")
-        response_stream = chat_with_bot_stream(user_input)
-        return StreamingHttpResponse(response_stream, content_type="text/html; charset=utf-8")
+        with timer.stage("session"):
+            memory = await new_memory(request.session).aload()
+            client = client_key(request)
+            new_session = request.session.session_key is None
+        response = StreamingHttpResponse(
+            with_heartbeat(self.events(request, user_input, memory, timer, client, new_session),
+                           SSE_HEARTBEAT_INTERVAL),
+            content_type="text/event-stream; charset=utf-8",
+        )
+        if new_session:
+            with timer.stage("session"):
+                await reserve_session(request, response)
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # بافر nginx را برای این پاسخ خاموش می‌کند
+        return response
+
+    async def events(self, request, user_input: str, memory: ConversationMemory, timer: StageTimer, client: str,
+                     new_session: bool = False):
+        with timer.stage("render"):
+            html = render_to_string("chat_bot/message.html", {
+                "user_input": user_input,
+                "response": "",
+            })
+        yield "start", {"html": html}
+        async for event in chat_with_bot_stream(user_input, memory, timer, client):
+            yield event
+        # SessionMiddleware قبل از شروع stream کارش تمام شده؛ تاریخچه را خودمان ذخیره می‌کنیم
+        if request.session.modified:
+            with timer.stage("session"):
+                await request.session.asave(must_create=new_session)
+        # بعد از شروع stream دیگر هدری نمی‌شود فرستاد؛ زمان‌ها در رویداد done می‌آیند
+        yield "done", {"timings": timer.as_dict()}
@@ -0,0 +1,46 @@
+import gc
+import sys
+import time
+
+# ================== گرم کردن قبل از fork ==================
+# زیر gunicorn با preload_app، پروسه master قبل از ساختن workerها این کارها را
+# یک بار انجام می‌دهد: import همه ویوها، بارگذاری encoding مدل tiktoken، باز کردن
+# (و در صورت نیاز ساختن) snapshot کاتالوگ و ساختن کلاینت LLM. workerها این حافظه
+# را copy-on-write با master شریک‌اند و هر کدام از صفر شروع نمی‌کنند.
+WARMUP_QUESTION = "لپ تاپ زیر ۲۰ میلیون"
+
+
+def warm_up():
+    # زمان هر مرحله (ثانیه)؛ bench_startup همین را گزارش می‌کند
+    timings = {}
+    start = time.perf_counter()
+    from django.urls import get_resolver
+    get_resolver().url_patterns  # همه ویوها را import می‌کند
+    from . import views
+    timings["import"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    views.get_token_counter(views.MODEL_NAME).count(WARMUP_QUESTION)
+    timings["tiktoken"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    catalog = views.catalog_store.get()
+    catalog.prompt.render(views.select_products(catalog, WARMUP_QUESTION))
+    timings["catalog"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    views.llm_gateway.llm
+    timings["llm_client"] = time.perf_counter() - start
+
+    # اشیای ساخته‌شده تا اینجا از دید gc ثابت می‌شوند تا gc در workerها صفحه‌های
+    # مشترک را لمس (و کپی) نکند
+    gc.collect()
+    gc.freeze()
+    return timings
+
+
+def after_fork():
+    # در هر worker بعد از fork؛ بدون preload هنوز چیزی بارگذاری نشده
+    views = sys.modules.get("chat_bot.views")
+    if views is not None:
+        views.catalog_store.after_fork()
@@ -0,0 +1,7 @@
+#!/bin/sh
+# Apply database migrations (sessions, products) before starting the given command
+set -e
+
+python manage.py migrate --noinput
+
+exec "$@"
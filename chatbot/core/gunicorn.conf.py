@@ -0,0 +1,34 @@
+# ================== تنظیمات gunicorn (سرور production) ==================
+# gunicorn core.asgi:application
+# این فایل خودکار از پوشه جاری خوانده می‌شود. هر worker یک event loop از uvicorn
+# است؛ ویوهای async هزاران گفتگوی در انتظار LLM را در همان یک worker نگه می‌دارند.
+# همه نام‌های سطح ماژول تنظیم gunicorn حساب می‌شوند (از جمله «config»)؛ پس
+# decouple.config با نام کامل صدا زده می‌شود.
+import multiprocessing
+
+import decouple
+
+bind = decouple.config("GUNICORN_BIND", default="0.0.0.0:8000")
+workers = decouple.config("WEB_CONCURRENCY", default=min(multiprocessing.cpu_count(), 4), cast=int)
+worker_class = "uvicorn_worker.UvicornWorker"
+# پاسخ‌های stream تا پایان پاسخ LLM باز می‌مانند؛ timeout فقط برای worker قفل‌شده است
+timeout = decouple.config("GUNICORN_TIMEOUT", default=120, cast=int)
+graceful_timeout = decouple.config("GUNICORN_GRACEFUL_TIMEOUT", default=30, cast=int)
+keepalive = 5
+accesslog = "-"
+
+# اپ یک بار در master بارگذاری و گرم می‌شود و workerها با fork از آن ساخته می‌شوند
+preload_app = decouple.config("GUNICORN_PRELOAD", default=True, cast=bool)
+
+
+def when_ready(server):
+    # در master، بعد از بارگذاری اپ و قبل از ساختن workerها
+    if preload_app:
+        from chat_bot.warmup import warm_up
+        timings = warm_up()
+        server.log.info("warm-up: %s", ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items()))
+
+
+def post_fork(server, worker):
+    from chat_bot.warmup import after_fork
+    after_fork()
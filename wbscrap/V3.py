@@ -4,6 +4,20 @@ from playwright.async_api import async_playwright
 
 BASE_URL = "https://www.ehadish.com"
 
+EXTRACT_PRODUCTS_JS = """
+cards => cards.map(card => {
+    const a = card.querySelector("h2 a");
+    const img = card.querySelector("div.bx-img img");
+    const price = card.querySelector("div.bx-price");
+    return {
+        title: a.innerText,
+        href: a.getAttribute("href"),
+        image: img ? img.getAttribute("src") : "",
+        price: price ? price.innerText : "",
+    };
+})
+"""
+
 async def scrape_category(page, category_url, category_name):
     products = []
     page_num = 1
@@ -17,26 +31,17 @@ async def scrape_category(page, category_url, category_name):
         except:
             break  # یعنی محصولی نیست یا صفحه تموم شد
 
-        product_divs = await page.query_selector_all("div.bx-product")
-        if not product_divs:
+        # همه کارت‌ها در یک رفت‌وبرگشت به مرورگر
+        rows = await page.eval_on_selector_all("div.bx-product", EXTRACT_PRODUCTS_JS)
+        if not rows:
             break
 
-        for product in product_divs:
-            title_tag = await product.query_selector("h2 a")
-            title = await title_tag.inner_text()
-            link = await title_tag.get_attribute("href")
-
-            img_tag = await product.query_selector("div.bx-img img")
-            img_src = await img_tag.get_attribute("src") if img_tag else ""
-
-            price_tag = await product.query_selector("div.bx-price")
-            price = (await price_tag.inner_text() if price_tag else "").replace("تومان", "").strip()
-
+        for row in rows:
             products.append({
-                "title": title,
-                "link": f"{BASE_URL}{link}",
-                "price": price,
-                "image": img_src,
+                "title": row["title"],
+                "link": f"{BASE_URL}{row['href']}",
+                "price": row["price"].replace("تومان", "").strip(),
+                "image": row["image"],
                 "category": category_name,
             })
 
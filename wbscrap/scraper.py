@@ -1,74 +1,141 @@
+import argparse
 import asyncio
 import json
+import os
+from urllib.parse import urlsplit
 from playwright.async_api import async_playwright, TimeoutError, Error
 
 BASE_URL = "https://www.ehadish.com"
-MAX_CONCURRENT = 5
-semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+MAX_CONCURRENT = 5  # حداکثر صفحات هم‌زمان در کل اسکرپ (پیش‌فرض --concurrency)
 MAX_PAGE = 10  # حداکثر صفحات
-
-async def scrape_category(context, category_url, category_name):
-    products = []
+PAGE_WORKERS = 3  # حداکثر صفحات هم‌زمان از یک دسته
+OUTPUT_PATH = "all_products.jsonl"
+PARTIAL_PATH = OUTPUT_PATH + ".partial"
+
+EXTRACT_PRODUCTS_JS = """
+cards => cards.map(card => {
+    const a = card.querySelector("h2 a");
+    const price = card.querySelector("div.bx-price");
+    return {
+        title: a ? a.innerText : null,
+        href: a ? a.getAttribute("href") : null,
+        price: price ? price.innerText : "",
+    };
+})
+"""
+# فقط سند و اسکریپت‌های خود سایت؛ تصویر، فونت، CSS و سرویس‌های بیرونی لازم نیستند
+ALLOWED_RESOURCE_TYPES = {"document", "script", "xhr", "fetch"}
+ALLOWED_DOMAIN = "ehadish.com"
+
+async def block_resources(route, request):
+    host = urlsplit(request.url).hostname or ""
+    if request.resource_type in ALLOWED_RESOURCE_TYPES and (host == ALLOWED_DOMAIN or host.endswith("." + ALLOWED_DOMAIN)):
+        await route.continue_()
+    else:
+        await route.abort("blockedbyclient")
+
+async def scrape_page(context, url, category_name):
+    # None یعنی صفحه خالی/کند است و صفحه‌های بعدی این دسته لازم نیستند
     page = await context.new_page()
-    page_num = 1
-
-    while page_num <= MAX_PAGE:
-        url = f"{category_url}?page={page_num}"
+    try:
         try:
-            await page.goto(url, timeout=60000)
+            await page.goto(url, timeout=60000, wait_until="domcontentloaded")
             await page.wait_for_selector("div.bx-product", timeout=10000)
         except (TimeoutError, Error):
-            print(f"Page too slow: {url}. Skipping to next category.")
-            break
+            print(f"Page too slow: {url}. Stopping this category here.")
+            return None
 
-        product_divs = await page.query_selector_all("div.bx-product")
-        if not product_divs:
+        # همه کارت‌ها در یک رفت‌وبرگشت به مرورگر، به‌جای چند await برای هر کارت
+        rows = await page.eval_on_selector_all("div.bx-product", EXTRACT_PRODUCTS_JS)
+        if not rows:
             print(f"No products on {url}. Ending this category.")
-            break
+            return None
 
         products_in_page = []
-        for product in product_divs:
-            try:
-                title_tag = await product.query_selector("h2 a")
-                title = await title_tag.inner_text()
-                link = await title_tag.get_attribute("href")
-
-                price_tag = await product.query_selector("div.bx-price")
-                price = (await price_tag.inner_text() if price_tag else "").replace("تومان", "").strip()
-
-                if not price:  # محصول موجود نیست
-                    continue
-
-                products_in_page.append({
-                    "title": title,
-                    "link": f"{BASE_URL}{link}",
-                    "price": price,
-                    "categories": [category_name],
-                })
-            except Exception as e:
-                print(f"Failed to parse a product on {url}: {e}")
+        for row in rows:
+            if not row["title"] or not row["href"]:
+                print(f"Failed to parse a product on {url}: missing title link")
+                continue
+
+            price = row["price"].replace("تومان", "").strip()
+            if not price:  # محصول موجود نیست
+                continue
+
+            products_in_page.append({
+                "title": row["title"],
+                "link": f"{BASE_URL}{row['href']}",
+                "price": price,
+                "categories": [category_name],
+            })
 
         if not products_in_page:
-            print(f"No available products on {url}. Moving to next category.")
-            break
-
-        products.extend(products_in_page)
-        page_num += 1
-
-    await page.close()
-    return products
-
-async def scrape_category_with_semaphore(context, url, name):
-    async with semaphore:
-        return await scrape_category(context, url, name)
+            print(f"No available products on {url}. Ending this category.")
+            return None
+        return products_in_page
+    finally:
+        await page.close()
 
-async def scrape_site():
+async def scrape_category(context, category_url, category_name, semaphore):
+    # صف صفحه‌ها: چند worker صفحه‌های دسته را هم‌زمان می‌گیرند و semaphore سراسری
+    # تعداد کل صفحه‌های باز را محدود می‌کند. اولین صفحه خالی سقف دسته را پایین
+    # می‌آورد تا صفحه‌های بعدی اصلاً درخواست نشوند.
+    queue = asyncio.Queue()
+    for page_num in range(1, MAX_PAGE + 1):
+        queue.put_nowait(page_num)
+    last_page = MAX_PAGE
+    pages = {}
+
+    async def worker():
+        nonlocal last_page
+        while not queue.empty():
+            page_num = queue.get_nowait()
+            if page_num > last_page:
+                return
+            async with semaphore:
+                if page_num > last_page:
+                    return
+                products = await scrape_page(context, f"{category_url}?page={page_num}", category_name)
+            if products is None:
+                last_page = min(last_page, page_num - 1)
+            else:
+                pages[page_num] = products
+
+    await asyncio.gather(*(worker() for _ in range(PAGE_WORKERS)))
+    return [p for page_num in sorted(pages) if page_num <= last_page for p in pages[page_num]]
+
+def dump_record(product):
+    return json.dumps(product, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def merge_partial(source, path):
+    # محصول تکراری (در چند دسته) یک رکورد با همه دسته‌ها می‌شود؛ جایگزینی اتمیک
+    categories = {}
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            names = categories.setdefault(item["link"], [])
+            names.extend(c for c in item["categories"] if c not in names)
+
+    tmp_path = f"{path}.tmp"
+    with open(source, "r", encoding="utf-8") as f, open(tmp_path, "w", encoding="utf-8") as out:
+        for line in f:
+            item = json.loads(line)
+            names = categories.pop(item["link"], None)
+            if names is not None:
+                item["categories"] = names
+                out.write(dump_record(item))
+    os.replace(tmp_path, path)
+    os.unlink(source)
+
+async def scrape_site(concurrency=MAX_CONCURRENT):
+    # semaphore همین‌جا از --concurrency ساخته می‌شود، نه هنگام import
+    semaphore = asyncio.Semaphore(concurrency)
     async with async_playwright() as p:
         browser = await p.chromium.launch(headless=True)
         context = await browser.new_context()
+        await context.route("**/*", block_resources)
         page = await context.new_page()
 
-        await page.goto(BASE_URL, timeout=60000)
+        await page.goto(BASE_URL, timeout=60000, wait_until="domcontentloaded")
 
         category_links = await page.query_selector_all("a[href*='/products/category-']")
         categories = []
@@ -79,29 +146,22 @@ async def scrape_site():
                 categories.append((f"{BASE_URL}{href}", text))
         await page.close()
 
-        tasks = [scrape_category_with_semaphore(context, url, name) for url, name in categories]
-        results = await asyncio.gather(*tasks)
-
-        all_products = []
-        product_index = {}
-        for products in results:
-            for p_item in products:
-                link = p_item["link"]
-                if link in product_index:
-                    idx = product_index[link]
-                    for cat in p_item["categories"]:
-                        if cat not in all_products[idx]["categories"]:
-                            all_products[idx]["categories"].append(cat)
-                else:
-                    all_products.append(p_item)
-                    product_index[link] = len(all_products) - 1
+        # هر دسته به محض تمام شدن، یک محصول در هر خط، به فایل partial اضافه می‌شود
+        with open(PARTIAL_PATH, "w", encoding="utf-8") as out:
+            async def scrape_to_file(url, name):
+                products = await scrape_category(context, url, name, semaphore)
+                out.writelines(dump_record(p_item) for p_item in products)
+                out.flush()
 
-        await browser.close()
+            await asyncio.gather(*(scrape_to_file(url, name) for url, name in categories))
 
-        with open("all_products.json", "w", encoding="utf-8") as f:
-            json.dump(all_products, f, ensure_ascii=False, indent=4)
+        await browser.close()
 
-        print("All products saved to all_products.json (up to page 10).")
+    merge_partial(PARTIAL_PATH, OUTPUT_PATH)
+    print(f"All products saved to {OUTPUT_PATH} (up to page {MAX_PAGE}).")
 
 if __name__ == "__main__":
-    asyncio.run(scrape_site())
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT, help="pages open at the same time")
+    args = parser.parse_args()
+    asyncio.run(scrape_site(args.concurrency))